@@ -1,10 +1,10 @@
 import logging
 from fastapi import APIRouter, HTTPException
 from pydantic import BaseModel
-from google_auth_oauthlib.flow import Flow
 from google.oauth2.credentials import Credentials
 
 from app.auth.tokens import store_user_credentials
+from app.auth.credential_store import credential_store
 from app.config import get_settings
 
 logger = logging.getLogger(__name__)
@@ -27,6 +27,8 @@ class TokenResponse(BaseModel):
 @router.get("/login")
 async def login():
     """Generate OAuth authorization URL."""
+    from google_auth_oauthlib.flow import Flow
+
     logger.info(f"Login request - redirect_uri: {settings.oauth_redirect_uri}")
     logger.info(f"Scopes: {settings.gmail_scopes}")
 
@@ -60,6 +62,8 @@ async def login():
 @router.post("/callback", response_model=TokenResponse)
 async def oauth_callback(request: TokenExchangeRequest):
     """Exchange authorization code for tokens."""
+    from google_auth_oauthlib.flow import Flow
+
     logger.info(f"Callback request - redirect_uri: {request.redirect_uri}")
     logger.info(f"Code received: {request.code[:20]}..." if request.code else "No code")
 
@@ -102,8 +106,10 @@ async def oauth_callback(request: TokenExchangeRequest):
     try:
         await store_user_credentials(
             user_email=user_email,
-            credentials=credentials
+            credentials=credentials,
+            session_token=credentials.token
         )
+        credential_store.invalidate(user_email)
         logger.info("Credentials stored in Firestore")
     except Exception as e:
         logger.error(f"Failed to store credentials: {e}")
@@ -1,37 +1,113 @@
-from fastapi import APIRouter, Depends, HTTPException
+import hashlib
+import json
+import time
+from datetime import datetime, timedelta, timezone
+
+from fastapi import APIRouter, BackgroundTasks, Depends, Header, HTTPException, Query, Request, Response
 
 from app.api.dependencies import get_current_user, User
 from app.rules.engine import RuleEngine
-from app.rules.models import Rule, RuleCreate, RuleUpdate, MagicFolder, AutoLearnFolder, UserSettings, UserSettingsUpdate, MagicFolderSettings, MagicFolderSettingsUpdate
+from app.rules.simulation import simulate_rules
+from app.rules.models import Rule, RuleChanges, RuleCreate, RuleUpdate, RuleBatchRequest, RuleSimulationRequest, RuleCompactionRequest, MagicFolder, AutoLearnFolder, UserSettings, UserSettingsUpdate, MagicFolderSettings, MagicFolderSettingsUpdate
 from pydantic import BaseModel
 from app.gmail.client import GmailClient
+from app.gmail.mirror import MailboxMirror, due_messages, chunks
 from app.config import get_settings
 
 router = APIRouter()
 settings = get_settings()
 
 
+def _labels_fingerprint(label_map: dict[str, str]) -> str:
+    """Short stable hash of a label ID -> name map."""
+    payload = json.dumps(sorted(label_map.items()), separators=(",", ":"))
+    return hashlib.sha256(payload.encode()).hexdigest()[:16]
+
+
+def _etag_matches(if_none_match: str | None, etag: str) -> bool:
+    """Check an If-None-Match header against an ETag."""
+    if not if_none_match:
+        return False
+    candidates = {t.strip().removeprefix("W/") for t in if_none_match.split(",")}
+    return "*" in candidates or etag in candidates
+
+
 # ============ RULES ============
 
-@router.get("/rules", response_model=list[Rule])
-async def list_rules(user: User = Depends(get_current_user)):
-    """Get all rules for the authenticated user."""
+@router.get("/rules", response_model=list[Rule] | RuleChanges)
+async def list_rules(
+    background_tasks: BackgroundTasks,
+    response: Response,
+    limit: int | None = Query(None, ge=1, le=1000, description="Page size (omit for all rules)"),
+    cursor: str | None = Query(None, description="Cursor from the previous page's X-Next-Cursor header"),
+    since: str | None = Query(None, description="Sync token - return only changes after it"),
+    if_none_match: str | None = Header(None),
+    user: User = Depends(get_current_user)
+):
+    """
+    Get rules for the authenticated user.
+
+    - Plain request: all rules (or one page with ?limit=&cursor=)
+    - ?since=<sync token>: only rules changed and IDs deleted since the token
+    - Returns 304 when If-None-Match matches the current ETag
+    The X-Sync-Token response header is the token to pass as ?since= next time.
+    """
     engine = RuleEngine(user.id)
-    rules = await engine.list_rules()
 
-    # Sync label names with Gmail (handles renames)
-    gmail = GmailClient(user.credentials)
+    # Capture the sync token before reading so concurrent writes are not missed
+    sync_token = str(int(time.time() * 1000))
+
+    # Label names are part of the response, so they are part of the ETag
+    gmail = GmailClient(user.credentials, user.id)
     labels = await gmail.list_labels()
     label_map = {l["id"]: l["name"] for l in labels}
 
-    # Update any rules with stale label names
+    # times_applied is in the response too; it only moves along with emails_processed
+    user_doc = await engine.stats_doc.get()
+    user_data = user_doc.to_dict() if user_doc.exists else {}
+    rules_version = user_data.get("rules_version", 0)
+    emails_processed = user_data.get("emails_processed", 0)
+    etag = f'"{rules_version}-{emails_processed}-{_labels_fingerprint(label_map)}"'
+    if _etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers={"ETag": etag})
+
+    response.headers["ETag"] = etag
+    response.headers["X-Sync-Token"] = sync_token
+
+    if since is not None:
+        try:
+            since_at = datetime.fromtimestamp(int(since) / 1000, tz=timezone.utc)
+        except (ValueError, OverflowError):
+            raise HTTPException(status_code=400, detail="Invalid sync token")
+
+        horizon = datetime.now(timezone.utc) - timedelta(days=settings.rule_tombstone_retention_days)
+        if since_at < horizon:
+            raise HTTPException(status_code=410, detail="Sync token expired, fetch the full rule list")
+
+        rules, deleted = await engine.list_rule_changes(
+            since_at - timedelta(seconds=settings.rule_sync_skew_seconds)
+        )
+    elif limit:
+        rules, next_cursor = await engine.list_rules_page(limit, cursor)
+        if next_cursor:
+            response.headers["X-Next-Cursor"] = next_cursor
+    else:
+        rules = await engine.list_rules()
+
+    # Fix stale label names in the response now, persist them after responding
+    renames = {}
     for rule in rules:
         if rule.destination_label_id and rule.destination_label_id in label_map:
             current_name = label_map[rule.destination_label_id]
             if rule.destination_label_name != current_name:
-                await engine.update_rule(rule.id, {"destination_label_name": current_name})
+                renames[rule.id] = {"destination_label_name": current_name}
                 rule.destination_label_name = current_name
 
+    if renames:
+        background_tasks.add_task(engine.batch_update_rules, renames)
+
+    if since is not None:
+        return RuleChanges(rules=rules, deleted=deleted, sync_token=sync_token)
     return rules
 
 
@@ -52,6 +128,115 @@ async def create_rule(
     )
 
 
+@router.patch("/rules:batch")
+async def batch_rules(
+    request: RuleBatchRequest,
+    user: User = Depends(get_current_user)
+):
+    """
+    Update or delete many rules in one request. Operations are applied in
+    transactions of up to ~250; returns one result per operation, in order,
+    with the updated rule for each successful update.
+    """
+    rule_ids = [operation.id for operation in request.operations]
+    if len(set(rule_ids)) != len(rule_ids):
+        raise HTTPException(status_code=400, detail="Each rule may appear in only one operation")
+    if any(operation.op == "update" and operation.update is None for operation in request.operations):
+        raise HTTPException(status_code=400, detail="Update operations need an `update` object")
+
+    engine = RuleEngine(user.id)
+    try:
+        results = await engine.apply_rule_operations([
+            (
+                operation.op,
+                operation.id,
+                operation.update.model_dump(exclude_unset=True) if operation.op == "update" else {}
+            )
+            for operation in request.operations
+        ])
+    except Exception as e:
+        # Operations may already be written; re-sending the request is safe
+        # (updates reapply, deletes report not_found) and bumps the version
+        raise HTTPException(status_code=500, detail=f"Rule changes may not have propagated, retry the request: {e}")
+    return {
+        "results": results,
+        "updated": sum(1 for result in results if result["status"] == "updated"),
+        "deleted": sum(1 for result in results if result["status"] == "deleted"),
+        "not_found": sum(1 for result in results if result["status"] == "not_found"),
+        "failed": sum(1 for result in results if result["status"] == "failed"),
+    }
+
+
+@router.post("/rules/simulate")
+async def simulate_rule_changes(
+    request: RuleSimulationRequest,
+    user: User = Depends(get_current_user)
+):
+    """
+    Dry-run proposed rules against the newest INBOX messages without saving them.
+    Returns which messages would move where and which existing rules they would shadow.
+    """
+    engine = RuleEngine(user.id)
+    gmail = GmailClient(user.credentials, user.id)
+    return await simulate_rules(engine, gmail, request.rules, request.max_messages)
+
+
+@router.get("/rules/export")
+async def export_rules(user: User = Depends(get_current_user)):
+    """Download all rules as NDJSON, streamed as they are read from Firestore."""
+    from fastapi.responses import StreamingResponse
+    from app.rules.transfer import export_rules_ndjson
+
+    return StreamingResponse(
+        export_rules_ndjson(RuleEngine(user.id)),
+        media_type="application/x-ndjson",
+        headers={"Content-Disposition": 'attachment; filename="rules.ndjson"'}
+    )
+
+
+@router.post("/rules/import")
+async def import_rules(
+    request: Request,
+    user: User = Depends(get_current_user)
+):
+    """
+    Import rules from an NDJSON body (one rule per line, as from /rules/export).
+    Destinations are matched to this account's labels by name. Returns
+    created/updated/skipped counts and the first invalid lines.
+    """
+    from app.rules.transfer import import_rules_ndjson
+
+    gmail = GmailClient(user.credentials, user.id)
+    labels = await gmail.list_labels()
+    try:
+        return await import_rules_ndjson(RuleEngine(user.id), request.stream(), labels)
+    except ValueError as e:
+        # Rules before the bad line have already been imported
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@router.get("/rules/compaction")
+async def analyze_rule_compaction(user: User = Depends(get_current_user)):
+    """
+    Propose replacing groups of EXACT rules in one domain with a single DOMAIN
+    rule, and list rules that are shadowed by earlier rules. Changes nothing.
+    """
+    from app.rules.compaction import analyze_rules
+
+    return await analyze_rules(RuleEngine(user.id))
+
+
+@router.post("/rules/compaction")
+async def apply_rule_compaction(
+    request: RuleCompactionRequest,
+    user: User = Depends(get_current_user)
+):
+    """Apply compaction proposals - all of them, or only `domains`."""
+    from app.rules.compaction import compact_rules
+
+    return await compact_rules(RuleEngine(user.id), request.domains)
+
+
 @router.get("/rules/{rule_id}", response_model=Rule)
 async def get_rule(
     rule_id: str,
@@ -105,17 +290,29 @@ async def delete_rule(
 # ============ LABELS ============
 
 @router.get("/labels")
-async def list_labels(user: User = Depends(get_current_user)):
-    """Get user's Gmail labels."""
-    gmail = GmailClient(user.credentials)
+async def list_labels(
+    response: Response,
+    if_none_match: str | None = Header(None),
+    user: User = Depends(get_current_user)
+):
+    """Get user's Gmail labels. Returns 304 when If-None-Match matches the current ETag."""
+    gmail = GmailClient(user.credentials, user.id)
     labels = await gmail.list_labels()
 
     # Filter to user labels (not system labels)
-    return [
+    result = [
         {"id": l["id"], "name": l["name"], "type": l.get("type", "user")}
         for l in labels
     ]
 
+    payload = json.dumps(result, sort_keys=True, separators=(",", ":"))
+    etag = f'"{hashlib.sha256(payload.encode()).hexdigest()[:16]}"'
+    if _etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers={"ETag": etag})
+
+    response.headers["ETag"] = etag
+    return result
+
 
 class CreateMagicFoldersRequest(BaseModel):
     folders: list[str]  # e.g., ["Newsletters", "Shopping", "Receipts"]
@@ -130,7 +327,7 @@ async def create_magic_folders(
     Create magic folders (with @ prefix) in user's Gmail.
     Used during onboarding to set up initial folders.
     """
-    gmail = GmailClient(user.credentials)
+    gmail = GmailClient(user.credentials, user.id)
 
     # Get existing labels
     existing_labels = await gmail.list_labels()
@@ -163,7 +360,7 @@ async def create_magic_folders(
 @router.get("/magic-folders/list")
 async def list_magic_folders_simple(user: User = Depends(get_current_user)):
     """Get all magic folders (labels starting with @)."""
-    gmail = GmailClient(user.credentials)
+    gmail = GmailClient(user.credentials, user.id)
     labels = await gmail.list_labels()
 
     return [
@@ -180,9 +377,10 @@ async def delete_magic_folder(
 ):
     """
     Delete a magic folder and all rules associated with it.
-    This removes the Gmail label and deletes any rules that sort to this folder.
+    This removes the Gmail label, deletes any rules that sort to this folder,
+    and removes its archive settings and folder registrations.
     """
-    gmail = GmailClient(user.credentials)
+    gmail = GmailClient(user.credentials, user.id)
     engine = RuleEngine(user.id)
 
     # Get label info before deleting
@@ -192,8 +390,8 @@ async def delete_magic_folder(
     if not label_info:
         raise HTTPException(status_code=404, detail="Label not found")
 
-    # Delete all rules that point to this folder
-    rules_deleted = await engine.delete_rules_by_destination(label_id)
+    # Delete all rules, settings and registrations tied to this folder
+    teardown = await engine.delete_label_data(label_id)
 
     # Delete the Gmail label
     try:
@@ -205,7 +403,8 @@ async def delete_magic_folder(
         "status": "deleted",
         "label_id": label_id,
         "label_name": label_info.get("name"),
-        "rules_deleted": rules_deleted
+        "rules_deleted": teardown["rules_deleted"],
+        "failed": teardown["failed"]
     }
 
 
@@ -219,7 +418,7 @@ async def list_magic_folders(user: User = Depends(get_current_user)):
 @router.post("/magic-folders/setup")
 async def setup_magic_folders(user: User = Depends(get_current_user)):
     """Create magic folders in user's Gmail account."""
-    gmail = GmailClient(user.credentials)
+    gmail = GmailClient(user.credentials, user.id)
     engine = RuleEngine(user.id)
 
     # Get user's existing labels
@@ -282,7 +481,7 @@ async def get_folder_settings(
     user: User = Depends(get_current_user)
 ):
     """Get archive settings for a specific magic folder."""
-    gmail = GmailClient(user.credentials)
+    gmail = GmailClient(user.credentials, user.id)
     engine = RuleEngine(user.id)
 
     # Get label name
@@ -300,7 +499,7 @@ async def update_folder_settings(
     user: User = Depends(get_current_user)
 ):
     """Update archive settings for a specific magic folder."""
-    gmail = GmailClient(user.credentials)
+    gmail = GmailClient(user.credentials, user.id)
     engine = RuleEngine(user.id)
 
     # Get label name
@@ -322,6 +521,7 @@ async def update_folder_settings(
 class AutoLearnRequest(BaseModel):
     label_id: str
     label_name: str
+    bootstrap: bool = False  # Also learn rules from mail already in the folder
 
 
 @router.get("/auto-learn")
@@ -334,7 +534,7 @@ async def list_auto_learn_folders(user: User = Depends(get_current_user)):
 @router.get("/labels/with-auto-learn")
 async def list_labels_with_auto_learn_status(user: User = Depends(get_current_user)):
     """Get all Gmail labels with their auto-learn status."""
-    gmail = GmailClient(user.credentials)
+    gmail = GmailClient(user.credentials, user.id)
     engine = RuleEngine(user.id)
 
     labels = await gmail.list_labels()
@@ -357,11 +557,66 @@ async def list_labels_with_auto_learn_status(user: User = Depends(get_current_us
 @router.post("/auto-learn/enable", response_model=AutoLearnFolder)
 async def enable_auto_learn(
     request: AutoLearnRequest,
+    background_tasks: BackgroundTasks,
     user: User = Depends(get_current_user)
 ):
-    """Enable auto-learning for an existing folder."""
+    """Enable auto-learning for an existing folder, optionally bootstrapping rules from its mail."""
     engine = RuleEngine(user.id)
-    return await engine.enable_auto_learn(request.label_id, request.label_name)
+    folder = await engine.enable_auto_learn(request.label_id, request.label_name)
+    if request.bootstrap:
+        await _start_rule_bootstrap(user, engine, request.label_id, request.label_name, background_tasks)
+    return folder
+
+
+async def _start_rule_bootstrap(
+    user: User,
+    engine: RuleEngine,
+    label_id: str,
+    label_name: str,
+    background_tasks: BackgroundTasks
+) -> dict:
+    from app.rules.bootstrap import FolderBootstrap, is_running
+
+    bootstrap = FolderBootstrap(engine, GmailClient(user.credentials, user.id), label_id, label_name)
+    if is_running(await bootstrap.get_progress()):
+        raise HTTPException(status_code=409, detail="Bootstrap already running for this folder")
+    progress = await bootstrap.start()
+    background_tasks.add_task(bootstrap.run)
+    return progress
+
+
+@router.post("/auto-learn/{label_id}/bootstrap", status_code=202)
+async def bootstrap_auto_learn_rules(
+    label_id: str,
+    background_tasks: BackgroundTasks,
+    user: User = Depends(get_current_user)
+):
+    """
+    Learn rules from the mail already in a folder. Runs in the background;
+    poll GET on the same path for progress.
+    """
+    gmail = GmailClient(user.credentials, user.id)
+    labels = await gmail.list_labels()
+    label = next((l for l in labels if l["id"] == label_id), None)
+    if not label:
+        raise HTTPException(status_code=404, detail="Label not found")
+
+    return await _start_rule_bootstrap(user, RuleEngine(user.id), label_id, label["name"], background_tasks)
+
+
+@router.get("/auto-learn/{label_id}/bootstrap")
+async def get_auto_learn_bootstrap(
+    label_id: str,
+    user: User = Depends(get_current_user)
+):
+    """Progress of the latest rule bootstrap for a folder."""
+    from app.rules.bootstrap import FolderBootstrap
+
+    bootstrap = FolderBootstrap(RuleEngine(user.id), None, label_id, "")
+    progress = await bootstrap.get_progress()
+    if progress is None:
+        raise HTTPException(status_code=404, detail="No bootstrap for this folder")
+    return progress
 
 
 @router.post("/auto-learn/disable/{label_id}")
@@ -398,6 +653,29 @@ async def get_stats(user: User = Depends(get_current_user)):
     return await engine.get_stats()
 
 
+# ============ EVENTS ============
+
+@router.get("/events")
+async def stream_events(
+    user: User = Depends(get_current_user),
+    last_event_id: str | None = Header(None)
+):
+    """
+    Server-sent events for this user: `rules` (rules written by auto-learn),
+    `sorted` (a new message moved by a rule) and `stats` (counter deltas per
+    notification). Send Last-Event-ID on reconnect to receive missed events;
+    a `reset` event means they are gone and lists should be re-fetched.
+    """
+    from fastapi.responses import StreamingResponse
+    from app.events import event_bus
+
+    return StreamingResponse(
+        event_bus.stream(user.id, last_event_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
 # ============ SETTINGS ============
 
 @router.get("/settings", response_model=UserSettings)
@@ -422,10 +700,10 @@ async def update_settings(
 @router.get("/watch/status")
 async def get_watch_status(user: User = Depends(get_current_user)):
     """Get the current watch status for the user."""
-    from google.cloud import firestore
+    from app.db import get_db
     import time
 
-    db = firestore.AsyncClient(project=settings.project_id)
+    db = get_db()
     doc = await db.collection("users").document(user.id).get()
 
     if doc.exists:
@@ -446,9 +724,9 @@ async def get_watch_status(user: User = Depends(get_current_user)):
 async def start_watch(user: User = Depends(get_current_user)):
     """Start watching user's Gmail for changes."""
     from app.auth.tokens import update_history_id, get_last_history_id
-    from google.cloud import firestore
+    from app.db import get_db
 
-    gmail = GmailClient(user.credentials)
+    gmail = GmailClient(user.credentials, user.id)
     result = await gmail.start_watch()
 
     # Store the initial history ID so we have a baseline for processing
@@ -459,12 +737,12 @@ async def start_watch(user: User = Depends(get_current_user)):
         if not existing:
             await update_history_id(user.id, history_id)
 
-    # Store watch expiration
+    # Store watch expiration (as a number so renewal can range-query it)
     expiration = result.get("expiration")
     if expiration:
-        db = firestore.AsyncClient(project=settings.project_id)
+        db = get_db()
         await db.collection("users").document(user.id).set(
-            {"watch_expiration": expiration},
+            {"watch_expiration": int(expiration)},
             merge=True
         )
 
@@ -478,13 +756,13 @@ async def start_watch(user: User = Depends(get_current_user)):
 @router.post("/watch/stop")
 async def stop_watch(user: User = Depends(get_current_user)):
     """Stop watching user's Gmail."""
-    from google.cloud import firestore
+    from app.db import get_db
 
-    gmail = GmailClient(user.credentials)
+    gmail = GmailClient(user.credentials, user.id)
     await gmail.stop_watch()
 
     # Clear watch expiration
-    db = firestore.AsyncClient(project=settings.project_id)
+    db = get_db()
     await db.collection("users").document(user.id).set(
         {"watch_expiration": None},
         merge=True
@@ -496,23 +774,18 @@ async def stop_watch(user: User = Depends(get_current_user)):
 @router.post("/watch/renew")
 async def renew_watch(user: User = Depends(get_current_user)):
     """Renew the Gmail watch (call before expiration)."""
-    from google.cloud import firestore
+    from app.db import get_db
 
-    gmail = GmailClient(user.credentials)
-    # Stop existing watch first
-    try:
-        await gmail.stop_watch()
-    except Exception:
-        pass
-    # Start new watch
+    gmail = GmailClient(user.credentials, user.id)
+    # Calling watch again extends the existing watch - no need to stop it first
     result = await gmail.start_watch()
 
     # Store watch expiration
     expiration = result.get("expiration")
     if expiration:
-        db = firestore.AsyncClient(project=settings.project_id)
+        db = get_db()
         await db.collection("users").document(user.id).set(
-            {"watch_expiration": expiration},
+            {"watch_expiration": int(expiration)},
             merge=True
         )
 
@@ -523,56 +796,101 @@ async def renew_watch(user: User = Depends(get_current_user)):
 
 
 @router.post("/watch/renew-all")
-async def renew_all_watches():
+async def renew_all_watches(
+    window_hours: int | None = Query(None, ge=1, description="Renew watches expiring within this many hours")
+):
     """
-    Internal endpoint to renew watches for all users.
+    Internal endpoint to renew watches that are about to expire.
     Called by Cloud Scheduler to keep watches active.
+
+    Only users whose stored watch_expiration falls within the renewal window
+    are renewed, soonest first. Users who stopped watching (no expiration)
+    are left alone.
     """
+    import asyncio
     import logging
-    from google.cloud import firestore
-    from app.auth.tokens import get_user_credentials
+    import time
+    from app.db import get_db
+    from app.auth.tokens import credentials_from_user_doc
+    from app.rules.engine import BATCH_WRITE_LIMIT
 
     logger = logging.getLogger(__name__)
-    db = firestore.AsyncClient(project=settings.project_id)
+    db = get_db()
+
+    window_hours = window_hours or settings.watch_renewal_window_hours
+    horizon_ms = int(time.time() * 1000) + window_hours * 3600 * 1000
+
+    users_ref = db.collection("users")
+    due_docs = [
+        doc async for doc in users_ref
+        .where("watch_expiration", "<=", horizon_ms)
+        .order_by("watch_expiration")
+        .stream()
+    ]
+    # Expirations saved as strings by older versions sort apart from numbers;
+    # treat them as due so they get rewritten as numbers
+    due_docs += [
+        doc async for doc in users_ref.where("watch_expiration", ">=", "").stream()
+    ]
 
     renewed = []
     failed = []
+    updates = []
+    semaphore = asyncio.Semaphore(settings.watch_renewal_concurrency)
 
-    # Get all users from Firestore
-    users_ref = db.collection("users")
-    async for doc in users_ref.stream():
+    async def renew(doc):
         user_id = doc.id  # Use document ID for consistency with subcollections
         user_data = doc.to_dict()
         user_email = user_data.get("email", user_id)
 
         try:
-            credentials = await get_user_credentials(user_id)
+            credentials = credentials_from_user_doc(user_data)
             if not credentials:
                 logger.warning(f"No credentials for {user_email}")
                 failed.append({"email": user_email, "error": "No credentials"})
-                continue
+                return
 
-            gmail = GmailClient(credentials)
+            gmail = GmailClient(credentials, user_id)
 
-            # Stop existing watch
-            try:
-                await gmail.stop_watch()
-            except Exception:
-                pass
+            # Re-calling watch extends the existing watch
+            async with semaphore:
+                result = await gmail.start_watch()
 
-            # Start new watch
-            result = await gmail.start_watch()
-            renewed.append({
+            update = {"watch_history_id": result.get("historyId")}
+            if result.get("expiration"):
+                update["watch_expiration"] = int(result["expiration"])
+            # Only set a baseline if there is none - keep unprocessed history
+            if not user_data.get("last_history_id") and result.get("historyId"):
+                update["last_history_id"] = result["historyId"]
+            updates.append((doc.reference, update, {
                 "email": user_email,
                 "expiration": result.get("expiration")
-            })
+            }))
             logger.info(f"Renewed watch for {user_email}")
 
         except Exception as e:
             logger.error(f"Failed to renew watch for {user_email}: {e}")
             failed.append({"email": user_email, "error": str(e)})
 
+    await asyncio.gather(*(renew(doc) for doc in due_docs))
+
+    # Save new expirations and baselines in batched writes. A user whose save
+    # fails is reported as failed; their stale expiration keeps them due next run
+    for start in range(0, len(updates), BATCH_WRITE_LIMIT):
+        chunk = updates[start:start + BATCH_WRITE_LIMIT]
+        batch = db.batch()
+        for ref, update, _ in chunk:
+            batch.set(ref, update, merge=True)
+        try:
+            await batch.commit()
+        except Exception as e:
+            logger.error(f"Failed to save {len(chunk)} renewed watches: {e}")
+            failed.extend({"email": entry["email"], "error": f"Failed to save watch: {e}"} for _, _, entry in chunk)
+            continue
+        renewed.extend(entry for _, _, entry in chunk)
+
     return {
+        "due": len(due_docs),
         "renewed": len(renewed),
         "failed": len(failed),
         "details": {"renewed": renewed, "failed": failed}
@@ -586,14 +904,15 @@ async def cleanup_blackhole():
     """
     Internal endpoint to delete old emails from @Blackhole folders.
     Called by Cloud Scheduler daily.
-    Deletes emails older than user's configured blackhole_delete_days.
+    Deletes emails older than user's configured blackhole_delete_days, found
+    from the mailbox mirror rather than a Gmail search.
     """
     import logging
-    from google.cloud import firestore
+    from app.db import get_db
     from app.auth.tokens import get_user_credentials
 
     logger = logging.getLogger(__name__)
-    db = firestore.AsyncClient(project=settings.project_id)
+    db = get_db()
 
     cleaned = []
     failed = []
@@ -621,7 +940,7 @@ async def cleanup_blackhole():
                 failed.append({"email": user_email, "error": "No credentials"})
                 continue
 
-            gmail = GmailClient(credentials)
+            gmail = GmailClient(credentials, user_id)
 
             # Get all labels
             labels = await gmail.list_labels()
@@ -647,13 +966,17 @@ async def cleanup_blackhole():
                 logger.info(f"No blackhole folder for {user_email}")
                 continue
 
-            # Search for emails older than configured days
+            # Find emails older than configured days in the mailbox mirror
             delete_days = user_settings.blackhole_delete_days
-            query = f'older_than:{delete_days}d'
-            old_messages = await gmail.search_messages(query, label_ids=[blackhole_label["id"]])
+            mirror = MailboxMirror(user_id)
+            entries = await mirror.get_entries(gmail, blackhole_label["id"], user_data.get("mirror_labels", {}))
+            cutoff_ms = int((time.time() - delete_days * 86400) * 1000)
+            old_messages = due_messages(entries, older_than_ms=cutoff_ms)
 
             if old_messages:
-                await gmail.batch_delete_messages(old_messages)
+                for chunk in chunks(old_messages):
+                    await gmail.batch_delete_messages(chunk)
+                await mirror.remove(blackhole_label["id"], old_messages)
                 logger.info(f"Deleted {len(old_messages)} old emails from @Blackhole for {user_email}")
                 cleaned.append({
                     "email": user_email,
@@ -679,13 +1002,16 @@ async def cleanup_archive():
     Internal endpoint to auto-archive old emails from magic folders.
     Called by Cloud Scheduler daily.
     Archives emails based on per-folder settings for read and unread emails.
+    Candidates come from the mailbox mirror; Gmail is only called to archive.
+    Unread emails are normally archived on time by the archive queue
+    (/cleanup/archive/due); this pass catches any that were never queued.
     """
     import logging
-    from google.cloud import firestore
+    from app.db import get_db
     from app.auth.tokens import get_user_credentials
 
     logger = logging.getLogger(__name__)
-    db = firestore.AsyncClient(project=settings.project_id)
+    db = get_db()
 
     processed = []
     failed = []
@@ -704,7 +1030,7 @@ async def cleanup_archive():
                 failed.append({"email": user_email, "error": "No credentials"})
                 continue
 
-            gmail = GmailClient(credentials)
+            gmail = GmailClient(credentials, user_id)
             engine = RuleEngine(user_id)
 
             # Get all folder settings for this user
@@ -719,6 +1045,16 @@ async def cleanup_archive():
             labels = await gmail.list_labels()
             label_map = {l["id"]: l["name"] for l in labels}
 
+            # Stop mirroring folders that no longer need cleanup
+            mirror = MailboxMirror(user_id)
+            mirror_labels = user_data.get("mirror_labels", {})
+            needed = {
+                fs.label_id for fs in folder_settings_list
+                if fs.archive_read_enabled or fs.archive_unread_enabled
+            }
+            needed.add(RuleEngine.user_settings_from_doc(user_data).blackhole_label_id)
+            await mirror.untrack([label_id for label_id in mirror_labels if label_id not in needed])
+
             user_archived = {"email": user_email, "folders": []}
 
             for folder_settings in folder_settings_list:
@@ -732,31 +1068,39 @@ async def cleanup_archive():
                     "unread_archived": 0
                 }
 
+                if not (folder_settings.archive_read_enabled or folder_settings.archive_unread_enabled):
+                    continue
+
+                entries = await mirror.get_entries(gmail, folder_settings.label_id, mirror_labels)
+
                 # Archive read emails if enabled (no time restriction - archive immediately when read)
                 if folder_settings.archive_read_enabled:
-                    logger.info(f"Getting read messages from {label_name} (label_id: {folder_settings.label_id})")
-                    read_messages = await gmail.get_messages_by_label(folder_settings.label_id, read_only=True)
+                    read_messages = due_messages(entries, unread=False)
                     logger.info(f"Found {len(read_messages)} read messages in {label_name}")
 
                     if read_messages:
-                        await gmail.batch_modify_labels(
-                            read_messages,
-                            remove_labels=[folder_settings.label_id]
-                        )
+                        for chunk in chunks(read_messages):
+                            await gmail.batch_modify_labels(
+                                chunk,
+                                remove_labels=[folder_settings.label_id]
+                            )
+                        await mirror.remove(folder_settings.label_id, read_messages)
                         folder_result["read_archived"] = len(read_messages)
                         logger.info(f"Archived {len(read_messages)} read emails from {label_name} for {user_email}")
 
                 # Archive unread emails if enabled (and mark as read)
                 if folder_settings.archive_unread_enabled:
-                    unit_suffix = "h" if folder_settings.archive_unread_unit == "hours" else "d"
-                    query = f'label:"{label_name}" older_than:{folder_settings.archive_unread_value}{unit_suffix} is:unread'
-                    unread_messages = await gmail.search_messages(query)
+                    unit_seconds = 3600 if folder_settings.archive_unread_unit == "hours" else 86400
+                    cutoff_ms = int((time.time() - folder_settings.archive_unread_value * unit_seconds) * 1000)
+                    unread_messages = due_messages(entries, older_than_ms=cutoff_ms, unread=True)
 
                     if unread_messages:
-                        await gmail.batch_modify_labels(
-                            unread_messages,
-                            remove_labels=[folder_settings.label_id, "UNREAD"]
-                        )
+                        for chunk in chunks(unread_messages):
+                            await gmail.batch_modify_labels(
+                                chunk,
+                                remove_labels=[folder_settings.label_id, "UNREAD"]
+                            )
+                        await mirror.remove(folder_settings.label_id, unread_messages)
                         folder_result["unread_archived"] = len(unread_messages)
                         logger.info(f"Archived {len(unread_messages)} unread emails from {label_name} for {user_email}")
 
@@ -777,6 +1121,18 @@ async def cleanup_archive():
     }
 
 
+@router.post("/cleanup/archive/due")
+async def cleanup_archive_due():
+    """
+    Internal endpoint to archive unread emails whose auto-archive time has passed.
+    Called by Cloud Scheduler every minute; pops due entries from the archive
+    queue instead of scanning folders.
+    """
+    from app.gmail.archive_queue import archive_scheduler
+
+    return await archive_scheduler.run_due()
+
+
 @router.post("/magic-folders/{label_id}/cleanup")
 async def cleanup_magic_folder(
     label_id: str,
@@ -793,7 +1149,7 @@ async def cleanup_magic_folder(
     user_email = user.id
     credentials = user.credentials
 
-    gmail = GmailClient(credentials)
+    gmail = GmailClient(credentials, user_email)
     engine = RuleEngine(user_email)
 
     # Get folder settings
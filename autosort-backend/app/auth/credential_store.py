@@ -0,0 +1,207 @@
+import asyncio
+import logging
+import time
+from datetime import datetime, timedelta, timezone
+
+from google.oauth2.credentials import Credentials
+
+from app.auth.tokens import credentials_from_user_doc, store_user_credentials
+from app.db import get_db
+from app.config import get_settings
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+
+class CachedCredentials:
+    """Credentials held in memory for one user."""
+
+    __slots__ = ("credentials", "session_token", "last_used")
+
+    def __init__(self, credentials: Credentials, session_token: str | None):
+        self.credentials = credentials
+        # Token the desktop app authenticates with - preserved on write-back
+        self.session_token = session_token
+        self.last_used = time.monotonic()
+
+
+class CredentialStore:
+    """
+    In-process cache of user OAuth credentials.
+
+    Access tokens are refreshed shortly before they expire, either on access or
+    by the background refresher, and refreshed tokens are written back to
+    Firestore. Concurrent refreshes for the same user share one OAuth call.
+    """
+
+    def __init__(
+        self,
+        refresh_margin_seconds: int = settings.credential_refresh_margin_seconds,
+        refresh_interval_seconds: int = settings.credential_refresh_interval_seconds,
+        idle_seconds: int = settings.credential_idle_seconds
+    ):
+        self.refresh_margin = timedelta(seconds=refresh_margin_seconds)
+        self.refresh_interval = refresh_interval_seconds
+        self.idle_seconds = idle_seconds
+        self._entries: dict[str, CachedCredentials] = {}
+        self._refreshing: dict[str, asyncio.Task] = {}
+        self._refresher: asyncio.Task | None = None
+
+    async def get(self, user_email: str) -> Credentials | None:
+        """Get credentials for a user, refreshing the access token if it is about to expire."""
+        entry = self._entries.get(user_email)
+        if entry is None:
+            entry = await self._load(user_email)
+            if entry is None:
+                return None
+
+        entry.last_used = time.monotonic()
+
+        if self._expires_soon(entry.credentials):
+            try:
+                await self.refresh(user_email)
+            except Exception as e:
+                if _is_revoked(e):
+                    # Evicted by the refresh - the grant is gone, don't serve its token
+                    return None
+                # Fall back to the stale token - googleapiclient retries the refresh itself
+                logger.warning(f"Proactive token refresh failed for {user_email}: {e}")
+
+        return entry.credentials
+
+    def prime(self, user_email: str, user_data: dict) -> Credentials | None:
+        """
+        Cache credentials from an already-read user document. A cached entry
+        is replaced when the doc holds different tokens, e.g. after the user
+        signed in again through another instance.
+        """
+        credentials = credentials_from_user_doc(user_data)
+        if not credentials:
+            self._entries.pop(user_email, None)
+            return None
+
+        entry = self._entries.get(user_email)
+        if (
+            entry is not None
+            and entry.credentials.refresh_token == credentials.refresh_token
+            and entry.credentials.token == credentials.token
+        ):
+            entry.last_used = time.monotonic()
+            return entry.credentials
+
+        self._entries[user_email] = CachedCredentials(
+            credentials,
+            user_data.get("session_token") or user_data.get("access_token")
+        )
+        return credentials
+
+    def invalidate(self, user_email: str) -> None:
+        """Forget cached credentials (e.g. after the user signs in again)."""
+        self._entries.pop(user_email, None)
+
+    async def refresh(self, user_email: str) -> None:
+        """Refresh a user's access token. Concurrent callers share one refresh."""
+        task = self._refreshing.get(user_email)
+        if task is None:
+            task = asyncio.create_task(self._refresh(user_email))
+            self._refreshing[user_email] = task
+            task.add_done_callback(lambda _: self._refreshing.pop(user_email, None))
+        await asyncio.shield(task)
+
+    async def refresh_expiring(self) -> int:
+        """Refresh every cached token that expires within the margin. Returns count refreshed."""
+        now = time.monotonic()
+        for user_email, entry in list(self._entries.items()):
+            if now - entry.last_used > self.idle_seconds:
+                self._entries.pop(user_email, None)
+
+        expiring = [
+            user_email for user_email, entry in self._entries.items()
+            if self._expires_soon(entry.credentials)
+        ]
+        if not expiring:
+            return 0
+
+        results = await asyncio.gather(
+            *(self.refresh(user_email) for user_email in expiring),
+            return_exceptions=True
+        )
+        for user_email, result in zip(expiring, results):
+            if isinstance(result, Exception) and not _is_revoked(result):
+                logger.warning(f"Background token refresh failed for {user_email}: {result}")
+        return sum(1 for r in results if not isinstance(r, Exception))
+
+    def start(self) -> None:
+        """Start the background refresher."""
+        if self._refresher is None:
+            self._refresher = asyncio.create_task(self._run_refresher())
+
+    async def stop(self) -> None:
+        """Stop the background refresher."""
+        if self._refresher is not None:
+            self._refresher.cancel()
+            try:
+                await self._refresher
+            except asyncio.CancelledError:
+                pass
+            self._refresher = None
+
+    async def _run_refresher(self) -> None:
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            try:
+                refreshed = await self.refresh_expiring()
+                if refreshed:
+                    logger.info(f"Refreshed {refreshed} access tokens")
+            except Exception as e:
+                logger.error(f"Credential refresher error: {e}")
+
+    async def _load(self, user_email: str) -> CachedCredentials | None:
+        doc = await get_db().collection("users").document(user_email).get()
+        if not doc.exists:
+            return None
+        if self.prime(user_email, doc.to_dict()) is None:
+            return None
+        return self._entries[user_email]
+
+    async def _refresh(self, user_email: str) -> None:
+        entry = self._entries.get(user_email)
+        if entry is None or not entry.credentials.refresh_token:
+            return
+
+        from google.auth.transport.requests import Request
+
+        # google-auth's refresh is blocking - keep it off the event loop
+        try:
+            await asyncio.to_thread(entry.credentials.refresh, Request())
+        except Exception as e:
+            if _is_revoked(e) and self._entries.get(user_email) is entry:
+                logger.warning(f"Refresh token for {user_email} was revoked; dropping cached credentials")
+                del self._entries[user_email]
+            raise
+        logger.info(f"Refreshed access token for {user_email}")
+
+        await store_user_credentials(
+            user_email,
+            entry.credentials,
+            session_token=entry.session_token
+        )
+
+    def _expires_soon(self, credentials: Credentials) -> bool:
+        if not credentials.token:
+            return True
+        if not credentials.expiry:
+            return False
+        # google-auth keeps expiry as naive UTC
+        now = datetime.now(timezone.utc).replace(tzinfo=None)
+        return now >= credentials.expiry - self.refresh_margin
+
+
+def _is_revoked(error: Exception) -> bool:
+    """Whether a refresh failed because the grant was revoked or expired."""
+    from google.auth.exceptions import RefreshError
+
+    return isinstance(error, RefreshError) and "invalid_grant" in str(error)
+
+
+credential_store = CredentialStore()
@@ -1,21 +1,28 @@
 from datetime import datetime, timezone
 from google.oauth2.credentials import Credentials
-from google.cloud import firestore
 
+from app.db import get_db
 from app.config import get_settings
 
 settings = get_settings()
-db = firestore.AsyncClient(project=settings.project_id)
 
 
 async def store_user_credentials(
     user_email: str,
-    credentials: Credentials
+    credentials: Credentials,
+    session_token: str | None = None
 ) -> None:
-    """Store user credentials in Firestore."""
-    doc_ref = db.collection("users").document(user_email)
+    """Store user credentials in Firestore.
 
-    await doc_ref.set({
+    session_token is the token the desktop app authenticates with. It is only
+    written when given, so server-side refreshes don't sign the app out.
+    """
+    doc_ref = get_db().collection("users").document(user_email)
+
+    # google-auth keeps expiry as naive UTC
+    expiry = credentials.expiry.replace(tzinfo=timezone.utc) if credentials.expiry else None
+
+    data = {
         "email": user_email,
         "access_token": credentials.token,  # Top-level for easier querying
         "credentials": {
@@ -25,25 +32,27 @@ async def store_user_credentials(
             "client_id": credentials.client_id,
             "client_secret": credentials.client_secret,
             "scopes": list(credentials.scopes) if credentials.scopes else [],
+            "expiry": expiry,
         },
         "updated_at": datetime.now(timezone.utc)
-    }, merge=True)
+    }
+    if session_token:
+        data["session_token"] = session_token
 
+    await doc_ref.set(data, merge=True)
 
-async def get_user_credentials(user_email: str) -> Credentials | None:
-    """Get user credentials from Firestore."""
-    doc_ref = db.collection("users").document(user_email)
-    doc = await doc_ref.get()
 
-    if not doc.exists:
-        return None
-
-    data = doc.to_dict()
+def credentials_from_user_doc(data: dict) -> Credentials | None:
+    """Build Credentials from a user document, or None if it has none."""
     creds_data = data.get("credentials", {})
 
     if not creds_data:
         return None
 
+    expiry = creds_data.get("expiry")
+    if expiry:
+        expiry = expiry.astimezone(timezone.utc).replace(tzinfo=None)
+
     return Credentials(
         token=creds_data.get("token"),
         refresh_token=creds_data.get("refresh_token"),
@@ -51,9 +60,21 @@ async def get_user_credentials(user_email: str) -> Credentials | None:
         client_id=creds_data.get("client_id", settings.google_client_id),
         client_secret=creds_data.get("client_secret", settings.google_client_secret),
         scopes=creds_data.get("scopes", settings.gmail_scopes),
+        expiry=expiry,
     )
 
 
+async def get_user_credentials(user_email: str) -> Credentials | None:
+    """Get user credentials from Firestore."""
+    doc_ref = get_db().collection("users").document(user_email)
+    doc = await doc_ref.get()
+
+    if not doc.exists:
+        return None
+
+    return credentials_from_user_doc(doc.to_dict())
+
+
 async def get_user_credentials_by_token(access_token: str) -> dict | None:
     """Look up user by access token."""
     import logging
@@ -61,18 +82,20 @@ async def get_user_credentials_by_token(access_token: str) -> dict | None:
 
     logger.info(f"Looking up user by token: {access_token[:20]}...")
 
-    # Query users collection for matching token (using top-level field)
-    query = db.collection("users").where("access_token", "==", access_token)
-
-    async for doc in query.stream():
-        data = doc.to_dict()
-        logger.info(f"Found user: {data.get('email')}")
-        credentials = await get_user_credentials(data["email"])
-        if credentials:
-            return {
-                "email": data["email"],
-                "credentials": credentials
-            }
+    # Query users collection for matching session token, falling back to the
+    # top-level access token for users who signed in before session tokens existed
+    for field in ("session_token", "access_token"):
+        query = get_db().collection("users").where(field, "==", access_token)
+
+        async for doc in query.stream():
+            data = doc.to_dict()
+            logger.info(f"Found user: {data.get('email')}")
+            credentials = credentials_from_user_doc(data)
+            if credentials:
+                return {
+                    "email": data["email"],
+                    "credentials": credentials
+                }
 
     logger.warning("No user found for token")
     return None
@@ -80,7 +103,7 @@ async def get_user_credentials_by_token(access_token: str) -> dict | None:
 
 async def update_history_id(user_email: str, history_id: str) -> None:
     """Update the last known history ID for a user."""
-    doc_ref = db.collection("users").document(user_email)
+    doc_ref = get_db().collection("users").document(user_email)
     await doc_ref.set({
         "last_history_id": history_id,
         "history_updated_at": datetime.now(timezone.utc)
@@ -89,7 +112,7 @@ async def update_history_id(user_email: str, history_id: str) -> None:
 
 async def get_last_history_id(user_email: str) -> str | None:
     """Get the last known history ID for a user."""
-    doc_ref = db.collection("users").document(user_email)
+    doc_ref = get_db().collection("users").document(user_email)
     doc = await doc_ref.get()
 
     if doc.exists:
@@ -11,6 +11,12 @@ class Settings(BaseSettings):
     def pubsub_topic(self) -> str:
         return f"projects/{self.project_id}/topics/gmail-notifications"
 
+    @property
+    def pubsub_subscription(self) -> str:
+        return f"projects/{self.project_id}/subscriptions/{self.pubsub_subscription_name}"
+
+    pubsub_subscription_name: str = os.getenv("PUBSUB_SUBSCRIPTION", "gmail-notifications")
+
     # OAuth
     google_client_id: str = os.getenv("GOOGLE_CLIENT_ID", "")
     google_client_secret: str = os.getenv("GOOGLE_CLIENT_SECRET", "")
@@ -27,6 +33,97 @@ class Settings(BaseSettings):
     # Magic folder prefix
     magic_folder_prefix: str = "@AutoSort"
 
+    # Credential cache - refresh access tokens this many seconds before they expire
+    credential_refresh_margin_seconds: int = 300
+    credential_refresh_interval_seconds: int = 60
+    # Drop cached credentials for users with no activity for this long
+    credential_idle_seconds: int = 3600
+
+    # Rule delta sync - tombstones outlive this many days, sync tokens older than that are rejected
+    rule_tombstone_retention_days: int = 30
+    # Overlap applied to sync tokens to absorb clock skew between instances
+    rule_sync_skew_seconds: int = 60
+
+    # Concurrent Firestore batch commits for bulk writes, and tries for the
+    # rules version bump that follows them
+    bulk_write_concurrency: int = 4
+    rules_version_bump_attempts: int = 3
+
+    # Rule simulation - how long fetched INBOX senders are reused
+    simulation_cache_ttl_seconds: int = 300
+
+    # Gmail quota - 250 units/s per user, 1.2M units/min per project
+    gmail_user_quota_per_second: float = 250
+    gmail_project_quota_per_second: float = 20000
+    gmail_max_retries: int = 5
+    gmail_backoff_base_seconds: float = 1.0
+    gmail_backoff_max_seconds: float = 32.0
+
+    # Watch renewal - Gmail watches last 7 days; renew those expiring within the window
+    watch_renewal_window_hours: int = 48
+    watch_renewal_concurrency: int = 10
+
+    # Deployment mode: "all" (single tier), "ingest" (webhooks forward to workers)
+    # or "worker" (processes notifications forwarded by the ingest tier)
+    deployment_mode: str = os.getenv("DEPLOYMENT_MODE", "all")
+    worker_urls: str = os.getenv("WORKER_URLS", "")  # Comma-separated worker base URLs
+    worker_token: str = os.getenv("WORKER_TOKEN", "")  # Shared secret between tiers
+    worker_request_timeout_seconds: float = 5.0
+    worker_health_interval_seconds: float = 10.0
+
+    @property
+    def worker_url_list(self) -> list[str]:
+        return [url.strip().rstrip("/") for url in self.worker_urls.split(",") if url.strip()]
+
+    # Mailbox mirror for cleanup jobs - tracked labels are rebuilt from Gmail this often
+    mailbox_mirror_rebuild_days: int = 7
+
+    # Unread auto-archive queue - entries popped per query, idle wake-up interval,
+    # and how long a user's entries wait before retrying after a failure
+    archive_queue_batch_size: int = 500
+    archive_queue_poll_seconds: float = 30.0
+    archive_queue_retry_seconds: int = 300
+
+    # Rule bootstrap from a folder's existing mail - minimum evidence for a rule,
+    # senders/domains counted at once, and how often progress is saved
+    bootstrap_min_sender_messages: int = 3
+    bootstrap_min_domain_messages: int = 20
+    bootstrap_min_domain_senders: int = 3
+    bootstrap_max_tracked_senders: int = 20000
+    bootstrap_progress_interval: int = 2000
+
+    # Rule compaction - fewest EXACT rules in a domain worth replacing with a DOMAIN rule
+    compaction_min_rules: int = 3
+
+    # Event stream (GET /events) - events kept per user for Last-Event-ID resume,
+    # events queued for a connection before it is dropped as too slow, heartbeat
+    # interval, and how long a user's buffer outlives their last connection
+    event_buffer_size: int = 500
+    event_queue_size: int = 1000
+    event_heartbeat_seconds: float = 15.0
+    event_channel_idle_seconds: int = 300
+
+    # Byte budget for per-user rule sets and matchers kept in memory
+    rule_cache_max_bytes: int = 64 * 1024 * 1024
+
+    # Built Gmail services kept per user so repeat notifications skip discovery
+    gmail_client_cache_size: int = 1000
+
+    # Fast ingest route - push auth (`?token=` and/or OIDC JWT) and queued processing
+    pubsub_verification_token: str = os.getenv("PUBSUB_VERIFICATION_TOKEN", "")
+    pubsub_push_audience: str = os.getenv("PUBSUB_PUSH_AUDIENCE", "")
+    pubsub_push_service_account: str = os.getenv("PUBSUB_PUSH_SERVICE_ACCOUNT", "")
+    ingest_workers: int = 32
+    ingest_max_pending: int = 10000
+
+    # Pull consumer - messages requested per pull and held unacked at once
+    pull_max_messages: int = 100
+    pull_max_outstanding: int = 1000
+    # Lease extended while processing; acks are sent in batches of this size or interval
+    pull_ack_deadline_seconds: int = 60
+    ack_batch_size: int = 500
+    ack_flush_interval_seconds: float = 1.0
+
     class Config:
         env_file = ".env"
 
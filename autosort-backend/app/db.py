@@ -0,0 +1,16 @@
+from functools import lru_cache
+
+from app.config import get_settings
+
+
+@lru_cache
+def get_db():
+    """
+    Shared Firestore client, created on first use.
+
+    google.cloud.firestore pulls in grpc and protobuf, so it is imported here
+    rather than at module level to keep app startup cheap.
+    """
+    from google.cloud import firestore
+
+    return firestore.AsyncClient(project=get_settings().project_id)
@@ -0,0 +1,135 @@
+import asyncio
+import logging
+import time
+import uuid
+from collections import deque
+from typing import AsyncIterator
+
+import orjson
+
+from app.config import get_settings
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+
+def _format(event_id: str, event: str, data: dict) -> bytes:
+    """One server-sent event frame."""
+    return b"id: %s\nevent: %s\ndata: %s\n\n" % (event_id.encode(), event.encode(), orjson.dumps(data))
+
+
+class _Channel:
+    """One user's recent events and open connections."""
+
+    __slots__ = ("events", "complete_after", "subscribers", "idle_since")
+
+    def __init__(self, sequence: int):
+        self.events: deque[tuple[int, bytes]] = deque()
+        # Every event for the user after this sequence is still in `events`
+        self.complete_after = sequence
+        self.subscribers: set[asyncio.Queue] = set()
+        self.idle_since: float | None = None
+
+
+class EventBus:
+    """
+    In-process pub/sub of per-user events for the GET /events stream.
+
+    Publishing for a user with no open connection is a dict miss, so the
+    notification path pays nothing for users without the desktop app open.
+    While a user is connected (and for event_channel_idle_seconds after)
+    the last event_buffer_size events are kept, so a reconnecting client
+    resumes from its Last-Event-ID. IDs carry a per-process epoch; an ID
+    from another process, or older than the buffer, gets a "reset" event
+    telling the client to re-sync (e.g. GET /rules?since=).
+
+    A connection only sees events published by the process serving it.
+    """
+
+    def __init__(self):
+        self.epoch = uuid.uuid4().hex[:8]
+        self._sequence = 0
+        self._channels: dict[str, _Channel] = {}
+
+    def publish(self, user_id: str, event: str, data: dict) -> None:
+        channel = self._channels.get(user_id)
+        if channel is None:
+            return
+        if channel.idle_since is not None and time.monotonic() - channel.idle_since > settings.event_channel_idle_seconds:
+            del self._channels[user_id]
+            return
+
+        self._sequence += 1
+        message = _format(f"{self.epoch}-{self._sequence}", event, data)
+        if len(channel.events) >= settings.event_buffer_size:
+            channel.complete_after = channel.events.popleft()[0]
+        channel.events.append((self._sequence, message))
+
+        for queue in list(channel.subscribers):
+            if queue.qsize() >= settings.event_queue_size:
+                # Drop a client that stopped reading; it resumes from the buffer on reconnect
+                logger.warning(f"Dropping slow event stream for {user_id}")
+                channel.subscribers.discard(queue)
+                queue.put_nowait(None)
+            else:
+                queue.put_nowait(message)
+
+    async def stream(self, user_id: str, last_event_id: str | None = None) -> AsyncIterator[bytes]:
+        """
+        Yield a user's events as SSE frames, starting with any missed since
+        last_event_id, with a comment line every event_heartbeat_seconds.
+        Ends when the client is dropped for falling behind.
+        """
+        self._prune()
+        channel = self._channels.get(user_id)
+        if channel is None:
+            channel = self._channels[user_id] = _Channel(self._sequence)
+
+        # Replay and subscribe without awaiting in between, so nothing is missed
+        replay = self._replay(channel, last_event_id)
+        queue: asyncio.Queue = asyncio.Queue()
+        channel.subscribers.add(queue)
+        channel.idle_since = None
+        try:
+            for message in replay:
+                yield message
+            while True:
+                try:
+                    message = await asyncio.wait_for(queue.get(), settings.event_heartbeat_seconds)
+                except asyncio.TimeoutError:
+                    yield b": heartbeat\n\n"
+                    continue
+                if message is None:
+                    return
+                yield message
+        finally:
+            channel.subscribers.discard(queue)
+            if not channel.subscribers:
+                channel.idle_since = time.monotonic()
+
+    def _replay(self, channel: _Channel, last_event_id: str | None) -> list[bytes]:
+        if not last_event_id:
+            return []
+        epoch, _, sequence = last_event_id.partition("-")
+        if epoch == self.epoch and sequence.isdigit() and int(sequence) >= channel.complete_after:
+            return [message for number, message in channel.events if number > int(sequence)]
+        return [_format(f"{self.epoch}-{self._sequence}", "reset", {})]
+
+    def _prune(self) -> None:
+        """Forget users whose last connection closed more than event_channel_idle_seconds ago."""
+        cutoff = time.monotonic() - settings.event_channel_idle_seconds
+        for user_id in [
+            user_id for user_id, channel in self._channels.items()
+            if channel.idle_since is not None and channel.idle_since < cutoff
+        ]:
+            del self._channels[user_id]
+
+    def stats(self) -> dict:
+        return {
+            "users": len(self._channels),
+            "connections": sum(len(channel.subscribers) for channel in self._channels.values()),
+            "sequence": self._sequence,
+        }
+
+
+event_bus = EventBus()
@@ -0,0 +1,219 @@
+"""
+Event-driven auto-archive of unread messages.
+
+When a message lands in a magic folder with unread auto-archive enabled, its
+due time (received time + the folder's window) is queued in Firestore. A
+worker pops due entries oldest first and archives them with grouped
+batchModify calls, so hour-level windows fire on time without searching
+folders.
+
+    python -m app.gmail.archive_queue
+
+or call POST /api/v1/cleanup/archive/due from Cloud Scheduler every minute.
+"""
+import asyncio
+import logging
+import signal
+import time
+
+from app.auth.credential_store import credential_store
+from app.db import get_db
+from app.gmail.client import get_gmail_client
+from app.gmail.mirror import BATCH_WRITE_LIMIT, chunks
+from app.rules.engine import RuleEngine
+from app.rules.models import MagicFolderSettings, TimeUnit
+from app.config import get_settings
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+
+def archive_windows(folder_settings_list: list[MagicFolderSettings]) -> dict[str, int]:
+    """Label ID -> unread auto-archive window in seconds, for folders that have one."""
+    return {
+        fs.label_id: fs.archive_unread_value * (3600 if fs.archive_unread_unit == TimeUnit.HOURS else 86400)
+        for fs in folder_settings_list
+        if fs.archive_unread_enabled
+    }
+
+
+def due_entry(label_id: str, message: dict, window_seconds: int) -> tuple[str, str, int]:
+    """(label_id, message_id, due_at_ms) for a message that should be archived if still unread."""
+    return label_id, message["id"], int(message.get("internalDate", 0)) + window_seconds * 1000
+
+
+class ArchiveScheduler:
+    """
+    Persistent priority queue of pending unread archives, keyed by due time.
+
+    Entries live in the top-level `archive_queue` collection, one doc per
+    (user, label, message) so re-queueing a message replaces its entry. A pop
+    is an ordered range query on `due_at`, served by Firestore's single-field
+    index.
+
+    Nothing is trusted from enqueue time: when an entry comes due the folder
+    setting and the message's labels are re-read, so messages the user has
+    read or moved, or folders whose setting was turned off, are dropped, and
+    entries whose window was lengthened are pushed back. The cleanup_archive
+    job still sweeps folders as a backstop for messages that were never
+    queued (e.g. already in a folder when the setting was enabled).
+    """
+
+    def __init__(self, batch_size: int = None, poll_seconds: float = None):
+        self.batch_size = batch_size or settings.archive_queue_batch_size
+        self.poll_seconds = poll_seconds or settings.archive_queue_poll_seconds
+        self._stopping = asyncio.Event()
+
+    @property
+    def collection(self):
+        return get_db().collection("archive_queue")
+
+    def _doc(self, user_id: str, label_id: str, message_id: str):
+        return self.collection.document(f"{user_id}:{label_id}:{message_id}")
+
+    async def schedule(self, user_id: str, entries: list[tuple[str, str, int]]) -> None:
+        """Queue (label_id, message_id, due_at_ms) entries for a user."""
+        for start in range(0, len(entries), BATCH_WRITE_LIMIT):
+            batch = get_db().batch()
+            for label_id, message_id, due_at in entries[start:start + BATCH_WRITE_LIMIT]:
+                batch.set(self._doc(user_id, label_id, message_id), {
+                    "user_id": user_id,
+                    "label_id": label_id,
+                    "message_id": message_id,
+                    "due_at": due_at,
+                })
+            await batch.commit()
+
+    async def next_due(self) -> int | None:
+        """Due time (epoch ms) of the earliest queued entry, or None if empty."""
+        query = self.collection.order_by("due_at").limit(1)
+        async for doc in query.stream():
+            return doc.get("due_at")
+        return None
+
+    async def run_due(self, now_ms: int = None) -> dict:
+        """Pop and process due entries in batches until none are left. Returns counts."""
+        now_ms = now_ms or int(time.time() * 1000)
+        stats = {"archived": 0, "dropped": 0, "rescheduled": 0, "failed": 0}
+
+        while True:
+            query = self.collection.where("due_at", "<=", now_ms).order_by("due_at").limit(self.batch_size)
+            docs = [doc async for doc in query.stream()]
+            if not docs:
+                break
+
+            by_user: dict[str, list] = {}
+            for doc in docs:
+                by_user.setdefault(doc.get("user_id"), []).append(doc)
+            for user_id, user_docs in by_user.items():
+                await self._process_user(user_id, user_docs, now_ms, stats)
+
+            if len(docs) < self.batch_size:
+                break
+
+        if any(stats.values()):
+            logger.info(f"Archive queue: {stats}")
+        return stats
+
+    async def _process_user(self, user_id: str, docs: list, now_ms: int, stats: dict) -> None:
+        reschedule: list[tuple[str, str, int]] = []
+        try:
+            credentials = await credential_store.get(user_id)
+            if credentials is None:
+                logger.warning(f"No credentials for {user_id}, dropping {len(docs)} queued archives")
+                stats["dropped"] += len(docs)
+                await self._delete(docs)
+                return
+
+            gmail = get_gmail_client(credentials, user_id)
+            windows = archive_windows(await RuleEngine(user_id).get_all_folder_settings())
+            metadata = await gmail.get_messages_metadata(sorted({doc.get("message_id") for doc in docs}))
+
+            # Group what is still due by folder so each folder is one batchModify per 1000 messages
+            by_label: dict[str, list[str]] = {}
+            for doc in docs:
+                label_id = doc.get("label_id")
+                message = metadata.get(doc.get("message_id"))
+                window = windows.get(label_id)
+                labels = message.get("labelIds", []) if message else []
+                if window is None or label_id not in labels or "UNREAD" not in labels:
+                    stats["dropped"] += 1
+                    continue
+                entry = due_entry(label_id, message, window)
+                if entry[2] > now_ms:
+                    reschedule.append(entry)
+                    continue
+                by_label.setdefault(label_id, []).append(message["id"])
+
+            for label_id, message_ids in by_label.items():
+                for chunk in chunks(message_ids):
+                    await gmail.batch_modify_labels(chunk, remove_labels=[label_id, "UNREAD"])
+                stats["archived"] += len(message_ids)
+                logger.info(f"Archived {len(message_ids)} unread emails from {label_id} for {user_id}")
+        except Exception as e:
+            # Retry the whole group later rather than spinning on it
+            logger.error(f"Failed to process queued archives for {user_id}: {e}")
+            stats["failed"] += len(docs)
+            retry_at = now_ms + settings.archive_queue_retry_seconds * 1000
+            reschedule = [(doc.get("label_id"), doc.get("message_id"), retry_at) for doc in docs]
+
+        rescheduled = {(label_id, message_id) for label_id, message_id, _ in reschedule}
+        await self._delete([
+            doc for doc in docs
+            if (doc.get("label_id"), doc.get("message_id")) not in rescheduled
+        ])
+        if reschedule:
+            await self.schedule(user_id, reschedule)
+            stats["rescheduled"] += len(reschedule)
+
+    async def _delete(self, docs: list) -> None:
+        for start in range(0, len(docs), BATCH_WRITE_LIMIT):
+            batch = get_db().batch()
+            for doc in docs[start:start + BATCH_WRITE_LIMIT]:
+                batch.delete(doc.reference)
+            await batch.commit()
+
+    async def run(self) -> None:
+        """Archive entries as they come due until stop() is called."""
+        logger.info(f"Archive scheduler started (batch_size={self.batch_size})")
+        while not self._stopping.is_set():
+            try:
+                await self.run_due()
+                next_due = await self.next_due()
+            except Exception as e:
+                logger.error(f"Archive queue pass failed: {e}")
+                next_due = None
+
+            # Sleep until the next entry is due, waking at least every poll interval
+            # to pick up entries queued by other instances
+            delay = self.poll_seconds
+            if next_due is not None:
+                delay = min(delay, max(next_due / 1000 - time.time(), 0))
+            try:
+                await asyncio.wait_for(self._stopping.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                pass
+        logger.info("Archive scheduler stopped")
+
+    def stop(self) -> None:
+        self._stopping.set()
+
+
+archive_scheduler = ArchiveScheduler()
+
+
+async def main() -> None:
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, archive_scheduler.stop)
+
+    credential_store.start()
+    try:
+        await archive_scheduler.run()
+    finally:
+        await credential_store.stop()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(main())
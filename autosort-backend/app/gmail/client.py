@@ -1,17 +1,31 @@
 from google.oauth2.credentials import Credentials
-from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
 import re
+from collections import OrderedDict
 
+from app.gmail.rate_limit import gmail_rate_limiter, is_retryable
 from app.config import get_settings
 
 settings = get_settings()
 
+# Gmail accepts up to 100 calls per batch request but recommends 50 to avoid rate limiting
+GMAIL_BATCH_SIZE = 50
+
 
 class GmailClient:
-    def __init__(self, credentials: Credentials):
+    def __init__(self, credentials: Credentials, user_email: str | None = None):
+        # Discovery is slow to import; only pay for it once a client is needed
+        from googleapiclient.discovery import build
+
+        self.credentials = credentials
         self.service = build("gmail", "v1", credentials=credentials)
         self.user_id = "me"
+        # Key for per-user quota accounting
+        self.quota_key = user_email or credentials.refresh_token or str(id(credentials))
+
+    async def _execute(self, method: str, request):
+        """Execute a request under the Gmail quota limiter."""
+        return await gmail_rate_limiter.execute(self.quota_key, method, request)
 
     async def start_watch(self) -> dict:
         """
@@ -24,14 +38,14 @@ class GmailClient:
             "topicName": settings.pubsub_topic,
             "labelFilterBehavior": "INCLUDE"
         }
-        return self.service.users().watch(
+        return await self._execute("watch", self.service.users().watch(
             userId=self.user_id,
             body=request_body
-        ).execute()
+        ))
 
     async def stop_watch(self) -> None:
         """Unsubscribe from push notifications."""
-        self.service.users().stop(userId=self.user_id).execute()
+        await self._execute("stop", self.service.users().stop(userId=self.user_id))
 
     async def get_history(
         self,
@@ -57,7 +71,7 @@ class GmailClient:
                 if page_token:
                     params["pageToken"] = page_token
 
-                response = self.service.users().history().list(**params).execute()
+                response = await self._execute("history.list", self.service.users().history().list(**params))
                 all_history.extend(response.get("history", []))
 
                 page_token = response.get("nextPageToken")
@@ -92,7 +106,55 @@ class GmailClient:
         if headers:
             params["metadataHeaders"] = headers
 
-        return self.service.users().messages().get(**params).execute()
+        return await self._execute("messages.get", self.service.users().messages().get(**params))
+
+    async def get_messages_metadata(
+        self,
+        message_ids: list[str],
+        headers: list[str] = None
+    ) -> dict[str, dict]:
+        """
+        Get metadata for many messages using batch requests.
+        Returns message ID -> metadata; messages that fail to load are omitted.
+        """
+        results = {}
+
+        for start in range(0, len(message_ids), GMAIL_BATCH_SIZE):
+            pending = message_ids[start:start + GMAIL_BATCH_SIZE]
+            attempt = 0
+
+            while pending:
+                retry = []
+
+                def collect(request_id, response, exception):
+                    if exception is None:
+                        results[request_id] = response
+                    elif is_retryable(exception):
+                        retry.append((request_id, exception))
+
+                batch = self.service.new_batch_http_request(callback=collect)
+                for message_id in pending:
+                    params = {
+                        "userId": self.user_id,
+                        "id": message_id,
+                        "format": "metadata",
+                    }
+                    if headers:
+                        params["metadataHeaders"] = headers
+                    batch.add(self.service.users().messages().get(**params), request_id=message_id)
+
+                # Each call in a batch is charged separately
+                await gmail_rate_limiter.acquire(self.quota_key, "messages.get", calls=len(pending))
+                batch.execute()
+
+                # Retry only the calls that were rate limited or hit server errors
+                if not retry or attempt >= gmail_rate_limiter.max_retries:
+                    break
+                await gmail_rate_limiter.backoff(self.quota_key, attempt, retry[0][1])
+                pending = [request_id for request_id, _ in retry]
+                attempt += 1
+
+        return results
 
     async def modify_labels(
         self,
@@ -107,26 +169,33 @@ class GmailClient:
         if remove_labels:
             body["removeLabelIds"] = remove_labels
 
-        return self.service.users().messages().modify(
+        return await self._execute("messages.modify", self.service.users().messages().modify(
             userId=self.user_id,
             id=message_id,
             body=body
-        ).execute()
+        ))
 
     async def trash_message(self, message_id: str) -> dict:
         """Move message to trash."""
-        return self.service.users().messages().trash(
+        return await self._execute("messages.trash", self.service.users().messages().trash(
             userId=self.user_id,
             id=message_id
-        ).execute()
+        ))
 
     async def list_labels(self) -> list[dict]:
         """Get all labels for the user."""
-        response = self.service.users().labels().list(
+        response = await self._execute("labels.list", self.service.users().labels().list(
             userId=self.user_id
-        ).execute()
+        ))
         return response.get("labels", [])
 
+    async def get_label(self, label_id: str) -> dict:
+        """Get a label, including its messagesTotal and messagesUnread counts."""
+        return await self._execute("labels.get", self.service.users().labels().get(
+            userId=self.user_id,
+            id=label_id
+        ))
+
     async def create_label(self, name: str) -> dict:
         """Create a new label."""
         label_body = {
@@ -134,17 +203,17 @@ class GmailClient:
             "labelListVisibility": "labelShow",
             "messageListVisibility": "show"
         }
-        return self.service.users().labels().create(
+        return await self._execute("labels.create", self.service.users().labels().create(
             userId=self.user_id,
             body=label_body
-        ).execute()
+        ))
 
     async def delete_label(self, label_id: str) -> None:
         """Delete a label."""
-        self.service.users().labels().delete(
+        await self._execute("labels.delete", self.service.users().labels().delete(
             userId=self.user_id,
             id=label_id
-        ).execute()
+        ))
 
     async def search_messages(self, query: str, max_results: int = 500, label_ids: list[str] = None) -> list[str]:
         """
@@ -166,7 +235,7 @@ class GmailClient:
             if page_token:
                 params["pageToken"] = page_token
 
-            response = self.service.users().messages().list(**params).execute()
+            response = await self._execute("messages.list", self.service.users().messages().list(**params))
             messages = response.get("messages", [])
             message_ids.extend([m["id"] for m in messages])
 
@@ -179,6 +248,45 @@ class GmailClient:
 
         return message_ids
 
+    async def iter_message_ids(
+        self,
+        query: str = None,
+        label_ids: list[str] = None,
+        max_results: int = None,
+        page_size: int = 500
+    ):
+        """
+        Yield pages of message IDs matching a query and/or labels, newest first.
+        Streams page by page so callers never hold the full listing.
+        """
+        yielded = 0
+        page_token = None
+
+        while True:
+            params = {
+                "userId": self.user_id,
+                "maxResults": page_size if max_results is None else min(max_results - yielded, page_size)
+            }
+            if query:
+                params["q"] = query
+            if label_ids:
+                params["labelIds"] = label_ids
+            if page_token:
+                params["pageToken"] = page_token
+
+            response = await self._execute("messages.list", self.service.users().messages().list(**params))
+            page = [m["id"] for m in response.get("messages", [])]
+            if page:
+                yield page
+                yielded += len(page)
+
+            if max_results is not None and yielded >= max_results:
+                break
+
+            page_token = response.get("nextPageToken")
+            if not page_token:
+                break
+
     async def get_messages_by_label(self, label_id: str, read_only: bool = False, unread_only: bool = False, max_results: int = 500) -> list[str]:
         """
         Get messages with a specific label, optionally filtered by read status.
@@ -202,18 +310,18 @@ class GmailClient:
             if page_token:
                 params["pageToken"] = page_token
 
-            response = self.service.users().messages().list(**params).execute()
+            response = await self._execute("messages.list", self.service.users().messages().list(**params))
             messages = response.get("messages", [])
 
             if read_only:
                 # Filter for read messages (those without UNREAD label)
                 for msg in messages:
                     # Get message to check labels
-                    msg_detail = self.service.users().messages().get(
+                    msg_detail = await self._execute("messages.get", self.service.users().messages().get(
                         userId=self.user_id,
                         id=msg["id"],
                         format="minimal"
-                    ).execute()
+                    ))
                     if "UNREAD" not in msg_detail.get("labelIds", []):
                         message_ids.append(msg["id"])
             else:
@@ -230,19 +338,19 @@ class GmailClient:
 
     async def delete_message(self, message_id: str) -> None:
         """Permanently delete a message (not trash)."""
-        self.service.users().messages().delete(
+        await self._execute("messages.delete", self.service.users().messages().delete(
             userId=self.user_id,
             id=message_id
-        ).execute()
+        ))
 
     async def batch_delete_messages(self, message_ids: list[str]) -> None:
         """Permanently delete multiple messages."""
         if not message_ids:
             return
-        self.service.users().messages().batchDelete(
+        await self._execute("messages.batchDelete", self.service.users().messages().batchDelete(
             userId=self.user_id,
             body={"ids": message_ids}
-        ).execute()
+        ))
 
     async def batch_modify_labels(
         self,
@@ -259,10 +367,32 @@ class GmailClient:
         if remove_labels:
             body["removeLabelIds"] = remove_labels
 
-        self.service.users().messages().batchModify(
+        await self._execute("messages.batchModify", self.service.users().messages().batchModify(
             userId=self.user_id,
             body=body
-        ).execute()
+        ))
+
+
+# user email -> GmailClient, most recently used last
+_client_cache: OrderedDict[str, GmailClient] = OrderedDict()
+
+
+def get_gmail_client(credentials: Credentials, user_email: str) -> GmailClient:
+    """
+    Get a GmailClient for a user, reusing the built service while the user's
+    cached credentials object is unchanged.
+    """
+    client = _client_cache.get(user_email)
+    if client is not None and client.credentials is credentials:
+        _client_cache.move_to_end(user_email)
+        return client
+
+    client = GmailClient(credentials, user_email)
+    _client_cache[user_email] = client
+    _client_cache.move_to_end(user_email)
+    while len(_client_cache) > settings.gmail_client_cache_size:
+        _client_cache.popitem(last=False)
+    return client
 
 
 def extract_email_address(message: dict) -> str | None:
@@ -274,7 +404,7 @@ def extract_email_address(message: dict) -> str | None:
             # Extract email from "Name <email@example.com>" format
             match = re.search(r'<([^>]+)>', value)
             if match:
-                return match.group(1).lower()
+                return match.group(1).strip().lower()
             # Or just the plain email
             if "@" in value:
                 return value.strip().lower()
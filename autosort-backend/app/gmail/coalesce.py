@@ -0,0 +1,102 @@
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable
+
+logger = logging.getLogger(__name__)
+
+
+def keep_latest(pending: Any, new: Any) -> Any:
+    return new
+
+
+class UserCoalescer:
+    """
+    Runs notification work one user at a time, folding work that arrives
+    for a user while earlier work is queued into that one pending item.
+
+    Processing reads Gmail history from the stored baseline, so a single
+    run with the newest history ID covers every notification folded into
+    it. merge(pending, new) combines payloads (default: keep the newest).
+
+    With `workers`, items run on a fixed pool of tasks started by start(),
+    so submit() is a dict update and a queue put with no task creation.
+    Without, each user with work gets a drain task of its own.
+    """
+
+    def __init__(
+        self,
+        handler: Callable[[str, Any], Awaitable[None]],
+        merge: Callable[[Any, Any], Any] = keep_latest,
+        workers: int = 0,
+        max_pending: int = 0
+    ):
+        self.handler = handler
+        self.merge = merge
+        self.workers = workers
+        self.max_pending = max_pending
+        self._pending: dict[str, Any] = {}
+        self._active: dict[str, asyncio.Task | None] = {}
+        self._queue: asyncio.Queue[str] = asyncio.Queue()
+        self._tasks: list[asyncio.Task] = []
+        self._idle = asyncio.Event()
+        self._idle.set()
+
+    def start(self) -> None:
+        self._tasks = [asyncio.create_task(self._run_worker()) for _ in range(self.workers)]
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def join(self) -> None:
+        """Wait until no user has work pending or running."""
+        await self._idle.wait()
+
+    def submit(self, user_email: str, item: Any) -> bool | None:
+        """
+        Queue work for a user. Returns False if it was folded into pending
+        work, or None if max_pending users are queued and the caller should
+        retry later.
+        """
+        if user_email in self._pending:
+            self._pending[user_email] = self.merge(self._pending[user_email], item)
+            return False
+        if self.max_pending and len(self._pending) >= self.max_pending:
+            return None
+
+        self._pending[user_email] = item
+        self._idle.clear()
+        # An active user's drain picks up the new item when it finishes
+        if user_email not in self._active:
+            if self.workers:
+                self._active[user_email] = None
+                self._queue.put_nowait(user_email)
+            else:
+                self._active[user_email] = asyncio.create_task(self._drain(user_email))
+        return True
+
+    async def _run_worker(self) -> None:
+        while True:
+            await self._drain(await self._queue.get())
+
+    async def _drain(self, user_email: str) -> None:
+        try:
+            while user_email in self._pending:
+                item = self._pending.pop(user_email)
+                try:
+                    await self.handler(user_email, item)
+                except Exception as e:
+                    logger.error(f"Failed to process notification for {user_email}: {e}")
+        finally:
+            del self._active[user_email]
+            if not self._active:
+                self._idle.set()
+
+    def stats(self) -> dict:
+        return {
+            "pending": len(self._pending),
+            "active": len(self._active),
+            "workers": len(self._tasks),
+        }
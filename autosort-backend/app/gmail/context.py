@@ -0,0 +1,137 @@
+import asyncio
+import logging
+
+from google.oauth2.credentials import Credentials
+
+from app.auth.credential_store import credential_store
+from app.gmail.archive_queue import archive_windows, due_entry
+from app.gmail.client import GmailClient
+from app.rules.engine import RuleEngine
+from app.rules.matcher import RuleMatcher
+from app.rules.models import Rule, UserSettings
+from app.rules.records import RuleRecord
+
+logger = logging.getLogger(__name__)
+
+
+class UserContext:
+    """
+    Snapshot of one user's state, loaded once per notification.
+
+    Holds credentials, history ID, settings, auto-learn folder IDs and enabled
+    rules so per-message handlers don't re-read Firestore. Handlers that change
+    rules or settings update the snapshot so later messages see the change.
+    """
+
+    def __init__(
+        self,
+        user_email: str,
+        credentials: Credentials,
+        last_history_id: str | None,
+        settings: UserSettings,
+        auto_learn_ids: set[str],
+        rules: list[RuleRecord],
+        matcher: RuleMatcher | None = None,
+        mirror_labels: dict[str, dict] | None = None,
+        rule_ids_keyed: bool = False
+    ):
+        self.user_email = user_email
+        self.credentials = credentials
+        self.last_history_id = last_history_id
+        self.settings = settings
+        self.auto_learn_ids = auto_learn_ids
+        self.rules = rules
+        self._label_map: dict[str, str] | None = None
+        self._matcher = matcher
+        # Labels indexed by the mailbox mirror -> when they were bootstrapped and their shard count
+        self.mirror_labels = mirror_labels or {}
+        # Every exact rule is stored under its deterministic pattern ID
+        self.rule_ids_keyed = rule_ids_keyed
+        self._archive_windows: dict[str, int] | None = None
+        # (label_id, message_id, due_at_ms) to add to the archive queue
+        self.pending_archives: list[tuple[str, str, int]] = []
+        # Rule ID -> messages it sorted, published as one stats event
+        self.rules_applied: dict[str, int] = {}
+
+    @classmethod
+    async def load(cls, rule_engine: RuleEngine) -> "UserContext | None":
+        """
+        Load the user doc and auto-learn folders in parallel, then the enabled
+        rules from the shared cache for the doc's rules_version.
+        """
+        user_email = rule_engine.user_id
+        user_doc, auto_learn_ids = await asyncio.gather(
+            rule_engine.stats_doc.get(),
+            rule_engine.get_auto_learn_folder_ids()
+        )
+
+        if not user_doc.exists:
+            return None
+
+        data = user_doc.to_dict()
+
+        # Seed the credential cache from the doc we already have, then let it
+        # refresh the token if it is about to expire
+        if credential_store.prime(user_email, data) is None:
+            return None
+        credentials = await credential_store.get(user_email)
+        cached = await rule_engine.get_cached_rules(data.get("rules_version", 0))
+
+        return cls(
+            user_email=user_email,
+            credentials=credentials,
+            last_history_id=data.get("last_history_id"),
+            settings=RuleEngine.user_settings_from_doc(data),
+            auto_learn_ids=auto_learn_ids,
+            rules=cached.rules,
+            matcher=cached.matcher,
+            mirror_labels=data.get("mirror_labels"),
+            rule_ids_keyed=data.get("rule_ids_keyed", False)
+        )
+
+    @property
+    def blackhole_label_id(self) -> str | None:
+        return self.settings.blackhole_label_id
+
+    async def get_label_map(self, gmail: GmailClient) -> dict[str, str]:
+        """Label ID -> name, fetched from Gmail at most once per notification."""
+        if self._label_map is None:
+            labels = await gmail.list_labels()
+            self._label_map = {l["id"]: l["name"] for l in labels}
+        return self._label_map
+
+    async def queue_archive(self, rule_engine: RuleEngine, label_id: str, message: dict) -> None:
+        """
+        Queue an unread message that just entered a folder for auto-archive,
+        if the folder has an unread window. Folder settings are read at most
+        once per notification.
+        """
+        if self._archive_windows is None:
+            self._archive_windows = archive_windows(await rule_engine.get_all_folder_settings())
+        window = self._archive_windows.get(label_id)
+        if window is not None:
+            self.pending_archives.append(due_entry(label_id, message, window))
+
+    def find_matching_rule(self, sender_email: str) -> RuleRecord | None:
+        """Match a sender against the loaded rules."""
+        if self._matcher is None:
+            self._matcher = RuleMatcher(self.rules)
+        return self._matcher.match(sender_email)
+
+    def upsert_rule(self, rule: Rule | RuleRecord | None) -> None:
+        """Record a rule created or updated while processing this notification."""
+        if rule is not None:
+            self.upsert_rules([rule])
+
+    def upsert_rules(self, rules: list[Rule | RuleRecord]) -> None:
+        """Record many created or updated rules, rebuilding the matcher once."""
+        if not rules:
+            return
+        changed = {rule.id: rule for rule in rules}
+        self.rules = [r for r in self.rules if r.id not in changed]
+        for rule in changed.values():
+            if rule.enabled:
+                self.rules.append(rule if isinstance(rule, RuleRecord) else RuleRecord.from_rule(rule))
+        # Keep Firestore's document ID order so matching stays the same
+        self.rules.sort(key=lambda r: r.id)
+        self._matcher = None
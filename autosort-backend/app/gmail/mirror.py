@@ -0,0 +1,273 @@
+import logging
+import time
+
+from app.db import get_db
+from app.gmail.client import GmailClient
+from app.config import get_settings
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+# A label's index is split over enough docs for this many messages each, sized
+# from the label's messagesTotal at bootstrap. Firestore caps a doc at 20k fields
+# and 1MB (an entry is ~40 bytes). A label that grows past RESHARD_FACTOR times
+# its shards' capacity (8000 a shard on average, leaving room for uneven
+# hashing) is re-bootstrapped with more shards the next time it is read.
+MESSAGES_PER_SHARD = 2000
+RESHARD_FACTOR = 4
+
+# Firestore allows at most 500 writes per batch commit
+BATCH_WRITE_LIMIT = 500
+
+# Gmail batchModify/batchDelete accept up to 1000 IDs per call
+GMAIL_BULK_LIMIT = 1000
+
+
+def _shard(message_id: str, shards: int) -> int:
+    return int(message_id, 16) % shards
+
+
+def shard_counts(mirror_labels: dict) -> dict[str, int]:
+    """Tracked label ID -> index shard count, from the user doc's `mirror_labels`."""
+    return {
+        label_id: info["shards"] for label_id, info in mirror_labels.items()
+        if isinstance(info, dict) and "shards" in info
+    }
+
+
+class MailboxMirror:
+    """
+    Compact per-user index of messages in cleanup-managed labels.
+
+    For each tracked label it stores message ID -> [internalDate (ms), unread]
+    in users/{id}/mailbox_index/{label_id}_{shard}, over as many shards as the
+    label's size needs. A label is bootstrapped
+    from a full Gmail listing the first time a cleanup job needs it (and again
+    every mailbox_mirror_rebuild_days as a safety net), then kept current from
+    the history records each notification already fetches. Cleanup jobs pick
+    messages from the index and only call Gmail for the final batch action.
+
+    Tracked labels, when they were bootstrapped and their shard counts are
+    kept on the user doc as `mirror_labels` ({label_id: {"bootstrapped_at",
+    "shards"}}), so notifications learn what to track from the doc they
+    already load. The `messages` maps need a single-field index exemption
+    (see the README), or each entry would also cost index entries.
+    """
+
+    def __init__(self, user_id: str):
+        self.user_id = user_id
+        self.db = get_db()
+        self.user_doc = self.db.collection("users").document(user_id)
+        self.index_collection = self.user_doc.collection("mailbox_index")
+        # Shard counts of labels read or rebuilt through this instance
+        self._shards: dict[str, int] = {}
+
+    def _doc(self, label_id: str, shard: int):
+        return self.index_collection.document(f"{label_id}_{shard}")
+
+    async def get_entries(
+        self,
+        gmail: GmailClient,
+        label_id: str,
+        mirror_labels: dict[str, int]
+    ) -> dict[str, list]:
+        """
+        Message ID -> [internal_date_ms, unread] for a label, bootstrapping
+        the index first if the label is untracked or due for a rebuild, or
+        re-bootstrapping it if it has outgrown its shards.
+        """
+        info = mirror_labels.get(label_id)
+        max_age_ms = settings.mailbox_mirror_rebuild_days * 86400 * 1000
+        if (
+            not isinstance(info, dict) or "shards" not in info
+            or time.time() * 1000 - info["bootstrapped_at"] > max_age_ms
+        ):
+            return await self.bootstrap(gmail, label_id)
+
+        self._shards[label_id] = info["shards"]
+        refs = [self._doc(label_id, shard) for shard in range(info["shards"])]
+        entries = {}
+        async for doc in self.db.get_all(refs):
+            if doc.exists:
+                entries.update(doc.to_dict().get("messages", {}))
+
+        if len(entries) > info["shards"] * MESSAGES_PER_SHARD * RESHARD_FACTOR:
+            logger.info(f"Resharding mailbox mirror for {self.user_id} label {label_id}: {len(entries)} messages")
+            return await self.bootstrap(gmail, label_id)
+        return entries
+
+    async def bootstrap(self, gmail: GmailClient, label_id: str) -> dict[str, list]:
+        """
+        Rebuild a label's index from a full Gmail listing and start tracking
+        it. Shards are sized from the label's messagesTotal and written page
+        by page as the listing is read.
+        """
+        from google.cloud import firestore
+
+        label = await gmail.get_label(label_id)
+        shards = max(1, -(-label.get("messagesTotal", 0) // MESSAGES_PER_SHARD))
+        self._shards[label_id] = shards
+
+        # Empty this label's shards, drop docs from a larger previous layout and
+        # stop tracking the label until the listing has been written
+        current = {self._doc(label_id, shard).id for shard in range(shards)}
+        await self._delete_docs([doc_id for doc_id in await self._doc_ids(label_id) if doc_id not in current])
+        await self._commit({(label_id, shard): {} for shard in range(shards)}, merge=False)
+        await self.user_doc.set({"mirror_labels": {label_id: firestore.DELETE_FIELD}}, merge=True)
+
+        entries = {}
+        async for page in gmail.iter_message_ids(label_ids=[label_id]):
+            metadata = await gmail.get_messages_metadata(page, headers=["From"])
+            writes: dict[tuple[str, int], dict] = {}
+            for message_id, message in metadata.items():
+                entries[message_id] = _entry(message)
+                writes.setdefault((label_id, _shard(message_id, shards)), {})[message_id] = entries[message_id]
+            await self._commit(writes)
+
+        await self.user_doc.set({
+            "mirror_labels": {label_id: {"bootstrapped_at": int(time.time() * 1000), "shards": shards}}
+        }, merge=True)
+
+        logger.info(
+            f"Bootstrapped mailbox mirror for {self.user_id} label {label_id}: "
+            f"{len(entries)} messages in {shards} shards"
+        )
+        return entries
+
+    async def apply_history(
+        self,
+        gmail: GmailClient,
+        records: list[dict],
+        mirror_labels: dict
+    ) -> int:
+        """
+        Fold Gmail history records into the index for the labels tracked in
+        the user doc's `mirror_labels`. Needs history fetched with labelAdded,
+        labelRemoved, messageAdded and messageDeleted. Returns the number of
+        messages updated.
+        """
+        shards = shard_counts(mirror_labels)
+        tracked = set(shards)
+        if not tracked:
+            return 0
+
+        # Messages now in a tracked label, and tracked labels messages left
+        present: set[str] = set()
+        removed: dict[str, set[str]] = {}
+        for record in records:
+            for key in ("messagesAdded", "labelsAdded", "labelsRemoved"):
+                for change in record.get(key, []):
+                    message = change["message"]
+                    if tracked.intersection(message.get("labelIds", [])):
+                        present.add(message["id"])
+            for change in record.get("labelsRemoved", []):
+                for label_id in tracked.intersection(change.get("labelIds", [])):
+                    removed.setdefault(change["message"]["id"], set()).add(label_id)
+            for change in record.get("messagesDeleted", []):
+                message_id = change["message"]["id"]
+                present.discard(message_id)
+                removed[message_id] = set(tracked)
+
+        if not present and not removed:
+            return 0
+
+        # Current labels, unread state and date for messages in tracked labels
+        metadata = await gmail.get_messages_metadata(sorted(present), headers=["From"]) if present else {}
+
+        from google.cloud import firestore
+
+        writes: dict[tuple[str, int], dict] = {}
+        for message_id in present | set(removed):
+            message = metadata.get(message_id)
+            current = set(message.get("labelIds", [])) if message else set()
+            left = removed.get(message_id, set())
+            if message is None and message_id in present:
+                # Vanished before we could read it - it is gone everywhere
+                left = tracked
+            for label_id in tracked:
+                if label_id in current:
+                    value = _entry(message)
+                elif label_id in left:
+                    value = firestore.DELETE_FIELD
+                else:
+                    continue
+                writes.setdefault((label_id, _shard(message_id, shards[label_id])), {})[message_id] = value
+
+        await self._commit(writes)
+        return len(present | set(removed))
+
+    async def remove(self, label_id: str, message_ids: list[str]) -> None:
+        """Drop messages a cleanup job has just moved out of a label read with get_entries."""
+        from google.cloud import firestore
+
+        shards = self._shards[label_id]
+        writes: dict[tuple[str, int], dict] = {}
+        for message_id in message_ids:
+            writes.setdefault((label_id, _shard(message_id, shards)), {})[message_id] = firestore.DELETE_FIELD
+        await self._commit(writes)
+
+    async def untrack(self, label_ids: list[str]) -> None:
+        """Stop tracking labels and delete their index docs."""
+        if not label_ids:
+            return
+        from google.cloud import firestore
+
+        for label_id in label_ids:
+            await self._delete_docs(await self._doc_ids(label_id))
+        await self.user_doc.set({
+            "mirror_labels": {label_id: firestore.DELETE_FIELD for label_id in label_ids}
+        }, merge=True)
+
+    async def invalidate(self) -> None:
+        """Force every tracked label to re-bootstrap, e.g. after history was lost."""
+        from google.cloud import firestore
+
+        await self.user_doc.update({"mirror_labels": firestore.DELETE_FIELD})
+
+    async def _doc_ids(self, label_id: str) -> list[str]:
+        """IDs of every index doc for a label, whatever layout wrote them."""
+        query = self.index_collection.where("label_id", "==", label_id).select(["label_id"])
+        return [doc.id async for doc in query.stream()]
+
+    async def _delete_docs(self, doc_ids: list[str]) -> None:
+        for start in range(0, len(doc_ids), BATCH_WRITE_LIMIT):
+            batch = self.db.batch()
+            for doc_id in doc_ids[start:start + BATCH_WRITE_LIMIT]:
+                batch.delete(self.index_collection.document(doc_id))
+            await batch.commit()
+
+    async def _commit(self, writes: dict[tuple[str, int], dict], merge: bool = True) -> None:
+        """Write message maps per (label_id, shard), merged into the shard docs unless merge=False."""
+        items = list(writes.items())
+        for start in range(0, len(items), BATCH_WRITE_LIMIT):
+            batch = self.db.batch()
+            for (label_id, shard), messages in items[start:start + BATCH_WRITE_LIMIT]:
+                batch.set(self._doc(label_id, shard), {"label_id": label_id, "messages": messages}, merge=merge)
+            await batch.commit()
+
+
+def _entry(message: dict) -> list:
+    return [int(message.get("internalDate", 0)), "UNREAD" in message.get("labelIds", [])]
+
+
+def due_messages(
+    entries: dict[str, list],
+    older_than_ms: int | None = None,
+    unread: bool | None = None
+) -> list[str]:
+    """
+    Message IDs from an index matching the filters, oldest first.
+    older_than_ms: only messages received before this epoch-ms timestamp.
+    unread: only unread (True) or read (False) messages.
+    """
+    due = [
+        (internal_date, message_id)
+        for message_id, (internal_date, is_unread) in entries.items()
+        if (older_than_ms is None or internal_date < older_than_ms)
+        and (unread is None or is_unread == unread)
+    ]
+    return [message_id for _, message_id in sorted(due)]
+
+
+def chunks(message_ids: list[str], size: int = GMAIL_BULK_LIMIT) -> list[list[str]]:
+    return [message_ids[i:i + size] for i in range(0, len(message_ids), size)]
@@ -0,0 +1,251 @@
+"""
+Pull-mode ingestion: consume Gmail notifications from the Pub/Sub
+subscription instead of receiving pushes on /webhooks/gmail.
+
+    python -m app.gmail.pull
+
+Set PUBSUB_EMULATOR_HOST to run against the Pub/Sub emulator.
+"""
+import asyncio
+import logging
+import os
+import signal
+
+from google.api_core.exceptions import DeadlineExceeded
+from google.pubsub_v1 import SubscriberAsyncClient
+
+from app.auth.credential_store import credential_store
+from app.gmail.coalesce import UserCoalescer
+from app.gmail.push import decode_notification, process_gmail_notification
+from app.config import get_settings
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+# Pub/Sub caps ack and modifyAckDeadline requests well above this; keep payloads small
+MAX_ACK_IDS_PER_REQUEST = 2500
+
+
+def _subscriber_client() -> SubscriberAsyncClient:
+    emulator_host = os.getenv("PUBSUB_EMULATOR_HOST")
+    if not emulator_host:
+        return SubscriberAsyncClient()
+
+    import grpc
+    from google.pubsub_v1.services.subscriber.transports import SubscriberGrpcAsyncIOTransport
+
+    transport = SubscriberGrpcAsyncIOTransport(channel=grpc.aio.insecure_channel(emulator_host))
+    return SubscriberAsyncClient(transport=transport)
+
+
+class PullConsumer:
+    """
+    Pulls notifications from the subscription with bounded outstanding work.
+
+    - Only pulls while fewer than `max_outstanding` messages are unacked, so a
+      slow backlog applies backpressure instead of piling up in memory.
+    - Notifications for the same user run one at a time; ones arriving while
+      another is still waiting are folded into it, since processing reads
+      history from the stored baseline.
+    - Messages are acked in batches only after processing succeeds. Failures
+      are nacked for redelivery, and leases are extended while work runs.
+    """
+
+    def __init__(
+        self,
+        subscription: str = None,
+        max_messages: int = None,
+        max_outstanding: int = None,
+    ):
+        self.subscription = subscription or settings.pubsub_subscription
+        self.max_messages = max_messages or settings.pull_max_messages
+        self.max_outstanding = max_outstanding or settings.pull_max_outstanding
+
+        self._client: SubscriberAsyncClient | None = None
+        self._stopping = asyncio.Event()
+        self._released = asyncio.Event()
+        self._outstanding: set[str] = set()
+        self._users = UserCoalescer(self._process, merge=_merge_pending)
+        self._ack_ids: list[str] = []
+        self._nack_ids: list[str] = []
+        self._stats = {"pulled": 0, "acked": 0, "nacked": 0, "invalid": 0, "coalesced": 0}
+
+    async def run(self) -> None:
+        """Pull and process until stop() is called, then drain in-flight work."""
+        self._client = _subscriber_client()
+        logger.info(
+            f"Pulling from {self.subscription} "
+            f"(max_messages={self.max_messages}, max_outstanding={self.max_outstanding})"
+        )
+        flusher = asyncio.create_task(self._run_flusher())
+        leaser = asyncio.create_task(self._run_leaser())
+        try:
+            while not self._stopping.is_set():
+                capacity = await self._wait_for_capacity()
+                if capacity == 0:
+                    continue
+                try:
+                    await self._pull(min(capacity, self.max_messages))
+                except DeadlineExceeded:
+                    continue
+                except Exception as e:
+                    logger.error(f"Pull from {self.subscription} failed: {e}")
+                    await asyncio.sleep(1)
+        finally:
+            await self._users.join()
+            for task in (flusher, leaser):
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+            await self.flush()
+            logger.info(f"Pull consumer stopped: {self._stats}")
+
+    def stop(self) -> None:
+        self._stopping.set()
+        self._released.set()
+
+    def stats(self) -> dict:
+        return {
+            **self._stats,
+            "outstanding": len(self._outstanding),
+            "active_users": self._users.stats()["active"],
+        }
+
+    async def flush(self) -> None:
+        """Send pending acks and nacks."""
+        ack_ids, self._ack_ids = self._ack_ids, []
+        nack_ids, self._nack_ids = self._nack_ids, []
+
+        for chunk in _chunks(ack_ids):
+            try:
+                await self._client.acknowledge(subscription=self.subscription, ack_ids=chunk)
+                self._stats["acked"] += len(chunk)
+            except Exception as e:
+                # Unacked messages are redelivered once their lease lapses
+                logger.error(f"Failed to ack {len(chunk)} messages: {e}")
+
+        for chunk in _chunks(nack_ids):
+            try:
+                await self._client.modify_ack_deadline(
+                    subscription=self.subscription, ack_ids=chunk, ack_deadline_seconds=0
+                )
+                self._stats["nacked"] += len(chunk)
+            except Exception as e:
+                logger.error(f"Failed to nack {len(chunk)} messages: {e}")
+
+    async def _wait_for_capacity(self) -> int:
+        while len(self._outstanding) >= self.max_outstanding and not self._stopping.is_set():
+            self._released.clear()
+            await self._released.wait()
+        if self._stopping.is_set():
+            return 0
+        return self.max_outstanding - len(self._outstanding)
+
+    async def _pull(self, max_messages: int) -> None:
+        # A pull with no messages available returns empty after a short wait
+        response = await self._client.pull(
+            subscription=self.subscription, max_messages=max_messages, timeout=30
+        )
+        if not response.received_messages:
+            return
+
+        self._stats["pulled"] += len(response.received_messages)
+
+        # Group by user so a burst for one mailbox is processed once
+        batch: dict[str, tuple[str, list[str]]] = {}
+        for received in response.received_messages:
+            try:
+                user_email, history_id = decode_notification(received.message.data)
+            except ValueError as e:
+                # Redelivering a malformed message will never succeed; drop it
+                logger.warning(f"Dropping message {received.message.message_id}: {e}")
+                self._stats["invalid"] += 1
+                self._ack_ids.append(received.ack_id)
+                continue
+
+            self._outstanding.add(received.ack_id)
+            _, ack_ids = batch.get(user_email, (history_id, []))
+            ack_ids.append(received.ack_id)
+            batch[user_email] = (history_id, ack_ids)
+
+        for user_email, (history_id, ack_ids) in batch.items():
+            self._submit(user_email, history_id, ack_ids)
+
+        if len(self._ack_ids) >= settings.ack_batch_size:
+            await self.flush()
+
+    def _submit(self, user_email: str, history_id: str, ack_ids: list[str]) -> None:
+        if self._users.submit(user_email, (history_id, list(ack_ids))) is False:
+            self._stats["coalesced"] += len(ack_ids)
+
+    async def _process(self, user_email: str, pending: tuple[str, list[str]]) -> None:
+        history_id, ack_ids = pending
+        try:
+            await process_gmail_notification(user_email, history_id)
+            self._ack_ids.extend(ack_ids)
+        except Exception as e:
+            logger.error(f"Failed to process notification for {user_email}: {e}")
+            self._nack_ids.extend(ack_ids)
+        await self._release(ack_ids)
+
+    async def _release(self, ack_ids: list[str]) -> None:
+        self._outstanding.difference_update(ack_ids)
+        self._released.set()
+        if len(self._ack_ids) >= settings.ack_batch_size:
+            await self.flush()
+
+    async def _run_flusher(self) -> None:
+        while True:
+            await asyncio.sleep(settings.ack_flush_interval_seconds)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Ack flush error: {e}")
+
+    async def _run_leaser(self) -> None:
+        """Keep leases on in-flight messages from lapsing while they are processed."""
+        interval = settings.pull_ack_deadline_seconds / 2
+        while True:
+            await asyncio.sleep(interval)
+            for chunk in _chunks(list(self._outstanding)):
+                try:
+                    await self._client.modify_ack_deadline(
+                        subscription=self.subscription,
+                        ack_ids=chunk,
+                        ack_deadline_seconds=settings.pull_ack_deadline_seconds,
+                    )
+                except Exception as e:
+                    logger.warning(f"Failed to extend lease on {len(chunk)} messages: {e}")
+
+
+def _merge_pending(pending: tuple[str, list[str]], new: tuple[str, list[str]]) -> tuple[str, list[str]]:
+    """Fold a user's new notification into the waiting one: newest history ID, every ack ID."""
+    return new[0], pending[1] + new[1]
+
+
+def _chunks(items: list[str]) -> list[list[str]]:
+    return [
+        items[i:i + MAX_ACK_IDS_PER_REQUEST]
+        for i in range(0, len(items), MAX_ACK_IDS_PER_REQUEST)
+    ]
+
+
+async def main() -> None:
+    consumer = PullConsumer()
+
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, consumer.stop)
+
+    credential_store.start()
+    try:
+        await consumer.run()
+    finally:
+        await credential_store.stop()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(main())
@@ -1,13 +1,18 @@
 import base64
-import json
 import logging
+import orjson
 from fastapi import APIRouter, Request, HTTPException, BackgroundTasks
 from google.oauth2.credentials import Credentials
 
-from app.gmail.client import GmailClient, extract_email_address
+from app.gmail.client import GmailClient, extract_email_address, get_gmail_client
+from app.gmail.archive_queue import archive_scheduler
+from app.gmail.context import UserContext
+from app.gmail.mirror import MailboxMirror, chunks
+from app.events import event_bus
 from app.rules.engine import RuleEngine
 from app.rules.models import ActionType
-from app.auth.tokens import get_user_credentials, update_history_id, get_last_history_id
+from app.auth.tokens import update_history_id
+from app.sharding.dispatch import worker_dispatcher
 from app.config import get_settings
 
 logger = logging.getLogger(__name__)
@@ -15,6 +20,32 @@ router = APIRouter()
 settings = get_settings()
 
 
+def decode_notification(data: bytes) -> tuple[str, str]:
+    """
+    Decode a Gmail notification payload (the Pub/Sub message data, already
+    base64-decoded) into (user_email, history_id).
+    Raises ValueError if it is malformed. Shared by push and pull delivery.
+    """
+    try:
+        notification = orjson.loads(data)
+        logger.debug(f"Notification: {notification}")
+    except Exception as e:
+        raise ValueError(f"Invalid Pub/Sub message: {e}")
+
+    if not isinstance(notification, dict):
+        raise ValueError("Invalid Pub/Sub message: expected a JSON object")
+
+    user_email = notification.get("emailAddress")
+    history_id = notification.get("historyId")
+
+    logger.debug(f"User: {user_email}, History ID: {history_id}")
+
+    if not user_email or not history_id:
+        raise ValueError("Missing required fields")
+
+    return user_email, str(history_id)
+
+
 @router.post("/gmail")
 async def handle_gmail_push(request: Request, background_tasks: BackgroundTasks):
     """
@@ -29,27 +60,30 @@ async def handle_gmail_push(request: Request, background_tasks: BackgroundTasks)
 
     try:
         envelope = await request.json()
-        logger.info(f"Envelope: {envelope}")
+        logger.debug(f"Envelope: {envelope}")
     except Exception:
         raise HTTPException(status_code=400, detail="Invalid JSON")
 
     # Decode the Pub/Sub message
     try:
-        message_data = base64.b64decode(
-            envelope["message"]["data"]
-        ).decode("utf-8")
-        notification = json.loads(message_data)
-        logger.info(f"Notification: {notification}")
+        message_data = base64.b64decode(envelope["message"]["data"])
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Invalid Pub/Sub message: {e}")
 
-    user_email = notification.get("emailAddress")
-    history_id = notification.get("historyId")
-
-    logger.info(f"User: {user_email}, History ID: {history_id}")
-
-    if not user_email or not history_id:
-        raise HTTPException(status_code=400, detail="Missing required fields")
+    try:
+        user_email, history_id = decode_notification(message_data)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    # In ingest mode, hand off to the worker that owns this user. Only ack once
+    # a worker has accepted it so Pub/Sub redelivers otherwise.
+    if settings.deployment_mode == "ingest":
+        try:
+            worker = await worker_dispatcher.dispatch(user_email, history_id)
+        except Exception as e:
+            logger.error(f"Failed to dispatch notification for {user_email}: {e}")
+            raise HTTPException(status_code=503, detail="No worker available")
+        return {"status": "accepted", "worker": worker}
 
     # Process in background to return quickly to Pub/Sub
     background_tasks.add_task(
@@ -65,43 +99,82 @@ async def process_gmail_notification(user_email: str, history_id: str):
     """Background task to process Gmail changes."""
     logger.info(f"Processing notification for {user_email}, history_id: {history_id}")
 
-    # Get user credentials from Firestore
-    credentials = await get_user_credentials(user_email)
-    if not credentials:
+    rule_engine = RuleEngine(user_email)
+
+    # Load credentials, history ID, settings, auto-learn folders and rules once
+    context = await UserContext.load(rule_engine)
+    if not context:
         logger.warning(f"No credentials for user: {user_email}")
         return
 
-    gmail = GmailClient(credentials)
-    rule_engine = RuleEngine(user_email)
+    gmail = get_gmail_client(context.credentials, user_email)
 
     # Get last known history ID
-    last_history_id = await get_last_history_id(user_email)
+    last_history_id = context.last_history_id
     logger.info(f"Last history ID: {last_history_id}")
     if not last_history_id:
         last_history_id = history_id
 
-    # Fetch history since last known historyId
+    # Fetch history since last known historyId. Removals and deletions are
+    # only needed to keep the mailbox mirror current.
+    history_types = ["messageAdded", "labelAdded"]
+    if context.mirror_labels:
+        history_types += ["labelRemoved", "messageDeleted"]
     history = await gmail.get_history(
         start_history_id=last_history_id,
-        history_types=["messageAdded", "labelAdded"]
+        history_types=history_types
     )
     logger.info(f"History records: {len(history.get('history', []))}")
 
-    for record in history.get("history", []):
-        # Handle new messages → apply existing rules
-        for msg_added in record.get("messagesAdded", []):
-            message_id = msg_added["message"]["id"]
-            logger.info(f"Processing new message: {message_id}")
-            await process_new_email(gmail, rule_engine, message_id)
+    records = history.get("history", [])
 
-        # Handle label additions → detect magic folder drops
+    # Handle label additions → detect magic folder drops. Drags are handled
+    # as one batch, and first, so new mail in the same batch sees the rules
+    # they teach.
+    label_changes: dict[str, list[str]] = {}
+    for record in records:
         for label_added in record.get("labelsAdded", []):
             message_id = label_added["message"]["id"]
-            added_labels = label_added.get("labelIds", [])
-            logger.info(f"Processing label change: {message_id}, labels: {added_labels}")
-            await process_label_change(
-                gmail, rule_engine, message_id, added_labels
-            )
+            label_changes.setdefault(message_id, []).extend(label_added.get("labelIds", []))
+    if label_changes:
+        logger.info(f"Processing label changes for {len(label_changes)} messages")
+        await process_label_changes(gmail, rule_engine, context, label_changes)
+
+    # Handle new messages → apply existing rules
+    for record in records:
+        for msg_added in record.get("messagesAdded", []):
+            message_id = msg_added["message"]["id"]
+            logger.info(f"Processing new message: {message_id}")
+            await process_new_email(gmail, rule_engine, context, message_id)
+
+    if context.rules_applied:
+        event_bus.publish(user_email, "stats", {
+            "emails_processed": sum(context.rules_applied.values()),
+            "rules_applied": context.rules_applied,
+        })
+
+    if context.pending_archives:
+        try:
+            await archive_scheduler.schedule(user_email, context.pending_archives)
+            logger.info(f"Queued {len(context.pending_archives)} messages for auto-archive")
+        except Exception as e:
+            logger.error(f"Failed to queue auto-archives for {user_email}: {e}")
+
+    if context.mirror_labels:
+        mirror = MailboxMirror(user_email)
+        try:
+            if "historyId" not in history:
+                # History was too old to replay - the mirror may have missed changes
+                await mirror.invalidate()
+            else:
+                await mirror.apply_history(gmail, history["history"], context.mirror_labels)
+        except Exception as e:
+            # A failed update leaves the mirror missing changes - rebuild it like lost history
+            logger.error(f"Failed to update mailbox mirror for {user_email}, invalidating it: {e}")
+            try:
+                await mirror.invalidate()
+            except Exception as e:
+                logger.error(f"Failed to invalidate mailbox mirror for {user_email}: {e}")
 
     # Use the latest historyId from the API response (most up-to-date),
     # falling back to the notification's historyId
@@ -118,6 +191,7 @@ async def process_gmail_notification(user_email: str, history_id: str):
 async def process_new_email(
     gmail: GmailClient,
     rule_engine: RuleEngine,
+    context: UserContext,
     message_id: str
 ):
     """Apply existing rules to a newly arrived email."""
@@ -143,13 +217,12 @@ async def process_new_email(
             return
 
         # Check if email is already in an auto-learn folder (user is organizing)
-        auto_learn_ids = await rule_engine.get_auto_learn_folder_ids()
-        if any(label in auto_learn_ids for label in current_labels):
+        if any(label in context.auto_learn_ids for label in current_labels):
             logger.info("Message in auto-learn folder, skipping")
             return
 
         # Find matching rule
-        rule = await rule_engine.find_matching_rule(sender)
+        rule = context.find_matching_rule(sender)
         logger.info(f"Matching rule: {rule}")
 
         if rule and rule.enabled:
@@ -157,8 +230,7 @@ async def process_new_email(
             if rule.action == ActionType.MOVE:
                 remove_labels = ["INBOX"]
                 # Mark as read if rule has mark_as_read enabled or destination is blackhole
-                blackhole_label_id = await rule_engine.get_blackhole_label_id()
-                if rule.mark_as_read or rule.destination_label_id == blackhole_label_id:
+                if rule.mark_as_read or rule.destination_label_id == context.blackhole_label_id:
                     remove_labels.append("UNREAD")
                     logger.info("Marking as read")
 
@@ -168,6 +240,8 @@ async def process_new_email(
                     remove_labels=remove_labels
                 )
                 logger.info(f"Moved message to {rule.destination_label_name}")
+                if "UNREAD" not in remove_labels and "UNREAD" in current_labels:
+                    await context.queue_archive(rule_engine, rule.destination_label_id, message)
             elif rule.action == ActionType.READ_ARCHIVE:
                 await gmail.modify_labels(
                     message_id,
@@ -185,6 +259,15 @@ async def process_new_email(
             # Update stats
             await rule_engine.increment_rule_counter(rule.id)
             await rule_engine.increment_emails_processed()
+            context.rules_applied[rule.id] = context.rules_applied.get(rule.id, 0) + 1
+            event_bus.publish(rule_engine.user_id, "sorted", {
+                "message_id": message_id,
+                "sender": sender,
+                "rule_id": rule.id,
+                "action": rule.action.value,
+                "destination_label_id": rule.destination_label_id,
+                "destination_label_name": rule.destination_label_name,
+            })
         else:
             logger.info("No matching rule found")
 
@@ -192,76 +275,63 @@ async def process_new_email(
         logger.error(f"Error processing new email {message_id}: {e}")
 
 
-async def process_label_change(
+async def process_label_changes(
     gmail: GmailClient,
     rule_engine: RuleEngine,
-    message_id: str,
-    added_labels: list[str]
+    context: UserContext,
+    label_changes: dict[str, list[str]]
 ):
     """
-    Detect when user drags email to a magic folder (starts with @).
-    Create a rule so future emails from that sender go to the same folder.
+    Detect when user drags emails to a magic folder (starts with @).
+    Create rules so future emails from those senders go to the same folder.
     No opt-in required - any @folder learns automatically.
+
+    label_changes maps message ID -> labels added, in history order. A drag of hundreds of
+    emails is handled in bulk: one metadata batch, rule point reads and
+    writes in one transaction per ~250 senders, and one batchModify per
+    label change.
     """
 
     try:
-        # Get all labels to map IDs to names
-        all_labels = await gmail.list_labels()
-        label_map = {l["id"]: l["name"] for l in all_labels}
+        # Map label IDs to names (fetched once per notification)
+        label_map = await context.get_label_map(gmail)
 
         # Get stored blackhole label ID
-        blackhole_label_id = await rule_engine.get_blackhole_label_id()
-
-        for label_id in added_labels:
-            label_name = label_map.get(label_id, "")
-
-            # Only process magic folders (start with @)
-            if not label_name.startswith("@"):
+        blackhole_label_id = context.blackhole_label_id
+
+        # A message moved through several magic folders in one history
+        # window belongs to the last one it was added to
+        destinations: dict[str, str] = {}
+        for message_id, added_labels in label_changes.items():
+            label_id = next((l for l in reversed(added_labels) if label_map.get(l, "").startswith("@")), None)
+            if label_id is None:
                 continue
-
-            logger.info(f"Magic folder detected: {label_name}")
+            destinations[message_id] = label_id
 
             # Auto-detect and store blackhole folder ID if not set
-            if label_name == "@Blackhole" and blackhole_label_id != label_id:
+            if label_map[label_id] == "@Blackhole" and blackhole_label_id != label_id:
                 await rule_engine.set_blackhole_label_id(label_id)
                 blackhole_label_id = label_id
+                context.settings.blackhole_label_id = label_id
                 logger.info(f"Stored blackhole label ID: {label_id}")
 
-            # Get the sender from this message
-            message = await gmail.get_message_metadata(
-                message_id,
-                headers=["From"]
-            )
-            sender = extract_email_address(message)
+        if not destinations:
+            return
+        logger.info(f"Magic folder drops: {len(destinations)} messages")
+
+        # Get the senders of these messages
+        messages = await gmail.get_messages_metadata(list(destinations), headers=["From"])
 
+        # Latest drop wins when one sender's mail went to several folders
+        learned: dict[str, tuple[str, str]] = {}
+        remove_groups: dict[tuple[str, ...], list[str]] = {}
+        for message_id, label_id in destinations.items():
+            message = messages.get(message_id)
+            sender = extract_email_address(message) if message else None
             if not sender:
-                logger.warning("Could not extract sender from message")
-                return
-
-            logger.info(f"Creating rule: {sender} -> {label_name}")
-
-            # Check if rule already exists for this exact sender (prevents duplicates)
-            existing_rule = await rule_engine.get_rule_by_pattern(sender)
-            if existing_rule:
-                # Rule exists - update it to point to new folder
-                if existing_rule.destination_label_id != label_id:
-                    await rule_engine.update_rule(existing_rule.id, {
-                        "destination_label_id": label_id,
-                        "destination_label_name": label_name,
-                        "action": "move"
-                    })
-                    logger.info(f"Updated existing rule for {sender}")
-            else:
-                # Create new rule with deterministic ID to prevent duplicates
-                await rule_engine.create_rule(
-                    email_pattern=sender,
-                    match_type="exact",
-                    action="move",
-                    destination_label_id=label_id,
-                    destination_label_name=label_name,
-                    use_deterministic_id=True
-                )
-                logger.info(f"Created new rule: {sender} -> {label_name}")
+                logger.warning(f"Could not extract sender from message {message_id}")
+                continue
+            learned[sender.lower()] = (label_id, label_map[label_id])
 
             # Email stays in the folder where user dragged it
             # Just remove from INBOX if present
@@ -273,15 +343,26 @@ async def process_label_change(
             # If moved to blackhole folder, also mark as read
             if label_id == blackhole_label_id:
                 remove_labels.append("UNREAD")
-                logger.info("Blackhole folder - marking as read")
+            elif "UNREAD" in current_labels:
+                await context.queue_archive(rule_engine, label_id, message)
 
             if remove_labels:
-                await gmail.modify_labels(
-                    message_id,
-                    remove_labels=remove_labels
-                )
-
-            break  # Only process first magic folder match
+                remove_groups.setdefault(tuple(remove_labels), []).append(message_id)
+
+        # Update existing rules for these senders to point to the new folder,
+        # create deterministic-ID rules for the rest (prevents duplicates)
+        written = await rule_engine.upsert_learned_rules(learned, context.rule_ids_keyed)
+        context.upsert_rules(written)
+        if written:
+            event_bus.publish(rule_engine.user_id, "rules", {
+                "source": "auto_learn",
+                "rules": [rule.to_dict() for rule in written],
+            })
+        logger.info(f"Learned {len(learned)} senders: {len(written)} rules written")
+
+        for remove_labels, message_ids in remove_groups.items():
+            for chunk in chunks(message_ids):
+                await gmail.batch_modify_labels(chunk, remove_labels=list(remove_labels))
 
     except Exception as e:
-        logger.error(f"Error processing label change for {message_id}: {e}")
+        logger.error(f"Error processing label changes for {len(label_changes)} messages: {e}")
@@ -0,0 +1,200 @@
+import asyncio
+import logging
+import random
+import time
+from collections import defaultdict
+
+from googleapiclient.errors import HttpError
+
+from app.config import get_settings
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+# Gmail API quota units per method
+# https://developers.google.com/gmail/api/reference/quota
+QUOTA_UNITS = {
+    "watch": 100,
+    "stop": 50,
+    "history.list": 2,
+    "labels.list": 1,
+    "labels.get": 1,
+    "labels.create": 5,
+    "labels.delete": 5,
+    "messages.list": 5,
+    "messages.get": 5,
+    "messages.modify": 5,
+    "messages.trash": 5,
+    "messages.delete": 10,
+    "messages.batchModify": 50,
+    "messages.batchDelete": 50,
+}
+
+RATE_LIMIT_REASONS = ("rateLimitExceeded", "userRateLimitExceeded", "quotaExceeded")
+
+
+def is_retryable(error: Exception) -> bool:
+    """True for Gmail errors worth retrying: rate limits and server errors."""
+    if isinstance(error, HttpError):
+        status = error.resp.status
+        if status == 429 or status >= 500:
+            return True
+        if status == 403:
+            content = error.content.decode("utf-8", "ignore") if error.content else ""
+            return any(reason in content for reason in RATE_LIMIT_REASONS)
+        return False
+    return isinstance(error, (TimeoutError, ConnectionError))
+
+
+def retry_after_seconds(error: Exception) -> float | None:
+    """Seconds from a Retry-After header, if the response has one."""
+    if isinstance(error, HttpError):
+        value = error.resp.get("retry-after")
+        if value:
+            try:
+                return float(value)
+            except ValueError:
+                return None
+    return None
+
+
+class TokenBucket:
+    """
+    Token bucket refilled at `rate` units per second, holding at most one
+    second's worth. The rate adapts: it halves when Gmail throttles and
+    creeps back up toward the configured maximum on success.
+    """
+
+    def __init__(self, rate: float):
+        self.max_rate = rate
+        self.rate = rate
+        self.tokens = rate
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self, units: float) -> None:
+        """Wait until `units` tokens are available."""
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                # A call bigger than the bucket goes through once it is full
+                needed = min(units, self.rate)
+                if self.tokens >= needed:
+                    self.tokens -= units
+                    return
+                await asyncio.sleep((needed - self.tokens) / self.rate)
+
+    def throttled(self) -> None:
+        """Gmail pushed back - halve the rate."""
+        self.rate = max(self.max_rate * 0.05, self.rate * 0.5)
+
+    def succeeded(self, units: float) -> None:
+        """Recover rate additively after a successful call."""
+        if self.rate < self.max_rate:
+            self.rate = min(self.max_rate, self.rate + units * 0.1)
+
+    @property
+    def idle(self) -> bool:
+        return self.rate == self.max_rate and self.tokens >= self.rate and not self._lock.locked()
+
+
+class GmailRateLimiter:
+    """
+    Per-user and per-project quota limiter for Gmail API calls.
+
+    Each call is weighted by its quota units. Rate-limit and server errors are
+    retried with jittered exponential backoff, honouring Retry-After.
+    """
+
+    def __init__(
+        self,
+        user_units_per_second: float = settings.gmail_user_quota_per_second,
+        project_units_per_second: float = settings.gmail_project_quota_per_second,
+        max_retries: int = settings.gmail_max_retries
+    ):
+        self.user_units_per_second = user_units_per_second
+        self.max_retries = max_retries
+        self.project_bucket = TokenBucket(project_units_per_second)
+        self._user_buckets: dict[str, TokenBucket] = {}
+
+        # Counters
+        self.units_used: dict[str, int] = defaultdict(int)
+        self.calls: dict[str, int] = defaultdict(int)
+        self.retries = 0
+        self.throttled = 0
+        self.failures = 0
+        self.wait_seconds = 0.0
+
+    def _user_bucket(self, user_key: str) -> TokenBucket:
+        bucket = self._user_buckets.get(user_key)
+        if bucket is None:
+            if len(self._user_buckets) >= 10000:
+                # Forget buckets that are back at full rate and capacity
+                for key in [k for k, b in self._user_buckets.items() if b.idle]:
+                    del self._user_buckets[key]
+            bucket = TokenBucket(self.user_units_per_second)
+            self._user_buckets[user_key] = bucket
+        return bucket
+
+    async def acquire(self, user_key: str, method: str, calls: int = 1) -> int:
+        """Reserve quota for `calls` calls of a method. Returns units reserved."""
+        units = QUOTA_UNITS.get(method, 5) * calls
+        started = time.monotonic()
+        await self._user_bucket(user_key).acquire(units)
+        await self.project_bucket.acquire(units)
+        self.wait_seconds += time.monotonic() - started
+        self.units_used[method] += units
+        self.calls[method] += calls
+        return units
+
+    async def backoff(self, user_key: str, attempt: int, error: Exception) -> None:
+        """Record a retryable failure and sleep before the next attempt."""
+        self.retries += 1
+        if isinstance(error, HttpError) and error.resp.status in (403, 429):
+            self.throttled += 1
+            self._user_bucket(user_key).throttled()
+
+        delay = retry_after_seconds(error)
+        if delay is None:
+            # Full jitter: uniform over [0, base * 2^attempt], capped
+            delay = random.uniform(0, min(
+                settings.gmail_backoff_max_seconds,
+                settings.gmail_backoff_base_seconds * (2 ** attempt)
+            ))
+        logger.warning(f"Gmail call failed ({error}), retry {attempt + 1}/{self.max_retries} in {delay:.2f}s")
+        await asyncio.sleep(delay)
+
+    async def execute(self, user_key: str, method: str, request):
+        """Execute a googleapiclient request under quota, retrying transient failures."""
+        attempt = 0
+        while True:
+            units = await self.acquire(user_key, method)
+            try:
+                response = request.execute()
+            except Exception as e:
+                if attempt >= self.max_retries or not is_retryable(e):
+                    self.failures += 1
+                    raise
+                await self.backoff(user_key, attempt, e)
+                attempt += 1
+                continue
+            self._user_bucket(user_key).succeeded(units)
+            return response
+
+    def stats(self) -> dict:
+        """Quota counters for monitoring."""
+        return {
+            "units_used": sum(self.units_used.values()),
+            "units_by_method": dict(self.units_used),
+            "calls_by_method": dict(self.calls),
+            "retries": self.retries,
+            "throttled": self.throttled,
+            "failures": self.failures,
+            "wait_seconds": round(self.wait_seconds, 3),
+            "tracked_users": len(self._user_buckets),
+        }
+
+
+gmail_rate_limiter = GmailRateLimiter()
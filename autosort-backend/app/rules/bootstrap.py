@@ -0,0 +1,197 @@
+import logging
+from datetime import datetime, timedelta, timezone
+
+from app.gmail.client import GmailClient, extract_email_address
+from app.rules.engine import RuleEngine
+from app.rules.models import MatchType
+from app.config import get_settings
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+# Shared mailbox providers - a folder full of gmail.com senders says nothing about gmail.com
+PERSONAL_DOMAINS = frozenset({
+    "gmail.com", "googlemail.com", "yahoo.com", "ymail.com", "outlook.com", "hotmail.com",
+    "live.com", "msn.com", "icloud.com", "me.com", "mac.com", "aol.com", "proton.me",
+    "protonmail.com", "gmx.com", "mail.com", "fastmail.com",
+})
+
+# A running job whose progress hasn't moved for this long is assumed dead
+STALE_AFTER = timedelta(minutes=15)
+
+
+def is_running(progress: dict | None) -> bool:
+    """Whether a bootstrap job with this progress is still live."""
+    return (
+        progress is not None
+        and progress.get("status") == "running"
+        and datetime.now(timezone.utc) - progress["updated_at"] < STALE_AFTER
+    )
+
+
+class FrequencyCounter:
+    """
+    Misra-Gries frequency summary holding at most `capacity` keys.
+
+    Counts are exact while there are fewer distinct keys than the capacity.
+    Past that, each count can undercount by at most total / (capacity + 1),
+    never overcount, so thresholds on it stay conservative.
+    """
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.counts: dict[str, int] = {}
+        self.total = 0
+
+    def add(self, key: str) -> None:
+        self.total += 1
+        if key in self.counts:
+            self.counts[key] += 1
+        elif len(self.counts) < self.capacity:
+            self.counts[key] = 1
+        else:
+            # Decrement everything; total decrements never exceed total adds
+            for other in list(self.counts):
+                self.counts[other] -= 1
+                if self.counts[other] == 0:
+                    del self.counts[other]
+
+    def at_least(self, threshold: int) -> dict[str, int]:
+        return {key: count for key, count in self.counts.items() if count >= threshold}
+
+
+class FolderBootstrap:
+    """
+    Learn rules from the messages already filed in a folder.
+
+    Streams the label's message IDs page by page, batch-fetches From headers
+    and counts senders and domains in bounded memory, then creates:
+    - a DOMAIN rule for domains with at least bootstrap_min_domain_messages
+      messages from at least bootstrap_min_domain_senders senders (personal
+      mail providers excluded)
+    - an EXACT rule for other senders with at least
+      bootstrap_min_sender_messages messages
+
+    Senders and domains already handled by an enabled rule, or with any rule
+    for the same pattern, are left alone. Progress is written to
+    users/{id}/rule_bootstraps/{label_id} as it goes.
+    """
+
+    def __init__(self, engine: RuleEngine, gmail: GmailClient, label_id: str, label_name: str):
+        self.engine = engine
+        self.gmail = gmail
+        self.label_id = label_id
+        self.label_name = label_name
+        self.job_doc = engine.stats_doc.collection("rule_bootstraps").document(label_id)
+
+        self.senders = FrequencyCounter(settings.bootstrap_max_tracked_senders)
+        self.domains = FrequencyCounter(settings.bootstrap_max_tracked_senders)
+        # Distinct senders seen per domain, capped at the number a domain rule needs
+        self.domain_senders: dict[str, set[str]] = {}
+
+    async def start(self) -> dict:
+        """Record the job as running. Returns its initial progress."""
+        label = await self.gmail.get_label(self.label_id)
+        job = {
+            "label_id": self.label_id,
+            "label_name": self.label_name,
+            "status": "running",
+            "messages_total": label.get("messagesTotal", 0),
+            "messages_scanned": 0,
+            "rules_created": 0,
+            "started_at": datetime.now(timezone.utc),
+            "updated_at": datetime.now(timezone.utc),
+        }
+        await self.job_doc.set(job)
+        return job
+
+    async def run(self) -> dict:
+        """Scan the folder and create rules. Returns the final progress."""
+        try:
+            scanned = await self._scan()
+            patterns = await self._select_patterns()
+            failures = await self.engine.bulk_create_rules(patterns, self.label_id, self.label_name)
+            result = {
+                "status": "completed",
+                "messages_scanned": scanned,
+                "rules_created": len(patterns) - len(failures),
+                "domain_rules": sum(1 for _, match_type in patterns if match_type == MatchType.DOMAIN.value),
+                "failed": failures,
+            }
+        except Exception as e:
+            logger.error(f"Rule bootstrap failed for {self.engine.user_id} label {self.label_id}: {e}")
+            result = {"status": "failed", "error": str(e)}
+
+        result["updated_at"] = datetime.now(timezone.utc)
+        await self.job_doc.set(result, merge=True)
+        logger.info(f"Rule bootstrap for {self.engine.user_id} label {self.label_name}: {result}")
+        return result
+
+    async def _scan(self) -> int:
+        scanned = 0
+        reported = 0
+        async for page in self.gmail.iter_message_ids(label_ids=[self.label_id]):
+            metadata = await self.gmail.get_messages_metadata(page, headers=["From"])
+            for message in metadata.values():
+                sender = extract_email_address(message)
+                if sender:
+                    self._count(sender.lower())
+            scanned += len(page)
+
+            if scanned - reported >= settings.bootstrap_progress_interval:
+                reported = scanned
+                await self.job_doc.update({
+                    "messages_scanned": scanned,
+                    "updated_at": datetime.now(timezone.utc)
+                })
+        return scanned
+
+    def _count(self, sender: str) -> None:
+        self.senders.add(sender)
+        domain = sender.rpartition("@")[2]
+        if not domain or domain in PERSONAL_DOMAINS:
+            return
+        self.domains.add(domain)
+        if domain in self.domains.counts:
+            seen = self.domain_senders.setdefault(domain, set())
+            if len(seen) < settings.bootstrap_min_domain_senders:
+                seen.add(sender)
+        # Keep per-domain sender sets only for domains still being counted
+        if len(self.domain_senders) > 2 * self.domains.capacity:
+            self.domain_senders = {d: s for d, s in self.domain_senders.items() if d in self.domains.counts}
+
+    async def _select_patterns(self) -> list[tuple[str, str]]:
+        """(email_pattern, match_type) for the rules to create."""
+        cached = await self.engine.get_cached_rules(await self.engine.get_rules_version())
+
+        # Skip anything an enabled rule already routes, and patterns that have a
+        # (possibly disabled) rule, so existing user decisions win. A bare
+        # "@domain" matches DOMAIN rules for it but no sender's EXACT rule.
+        domains = [
+            domain for domain in self.domains.at_least(settings.bootstrap_min_domain_messages)
+            if len(self.domain_senders.get(domain, ())) >= settings.bootstrap_min_domain_senders
+        ]
+        routed = cached.matcher.match_many([f"@{domain}" for domain in domains])
+        domain_patterns = [f"@{domain}" for domain in domains if routed[f"@{domain}"] is None]
+        existing = await self.engine.get_rules_by_patterns(domain_patterns)
+        domain_patterns = [pattern for pattern in domain_patterns if pattern not in existing]
+
+        # Senders in a domain getting a rule are covered by it
+        covered = {pattern[1:] for pattern in domain_patterns}
+        senders = [
+            sender for sender in self.senders.at_least(settings.bootstrap_min_sender_messages)
+            if sender.rpartition("@")[2] not in covered
+        ]
+        routed = cached.matcher.match_many(senders)
+        senders = [sender for sender in senders if routed[sender] is None]
+        existing = await self.engine.get_rules_by_patterns(senders)
+        senders = [sender for sender in senders if sender not in existing]
+
+        return (
+            [(pattern, MatchType.DOMAIN.value) for pattern in domain_patterns]
+            + [(sender, MatchType.EXACT.value) for sender in senders]
+        )
+
+    async def get_progress(self) -> dict | None:
+        doc = await self.job_doc.get()
+        return doc.to_dict() if doc.exists else None
@@ -0,0 +1,199 @@
+import sys
+from collections import OrderedDict
+
+from app.rules.matcher import RuleMatcher
+from app.rules.records import RuleRecord
+from app.config import get_settings
+
+settings = get_settings()
+
+
+class FrequencySketch:
+    """
+    Count-Min sketch of recent access frequency, with 4 rows of byte counters
+    capped at 15. Every `sample_size` increments all counters are halved so
+    old popularity fades.
+    """
+
+    def __init__(self, width: int):
+        self.width = 1 << max(width - 1, 1).bit_length()
+        self._mask = self.width - 1
+        self._rows = [bytearray(self.width) for _ in range(4)]
+        self.sample_size = 10 * self.width
+        self._additions = 0
+
+    def _indexes(self, key: str):
+        for seed, row in enumerate(self._rows):
+            yield row, hash((seed, key)) & self._mask
+
+    def increment(self, key: str) -> None:
+        for row, index in self._indexes(key):
+            if row[index] < 15:
+                row[index] += 1
+        self._additions += 1
+        if self._additions >= self.sample_size:
+            self._reset()
+
+    def estimate(self, key: str) -> int:
+        return min(row[index] for row, index in self._indexes(key))
+
+    def _reset(self) -> None:
+        self._rows = [bytearray(c >> 1 for c in row) for row in self._rows]
+        self._additions //= 2
+
+
+class CachedRuleSet:
+    """One user's enabled rules and matcher, valid for one rules_version."""
+
+    __slots__ = ("user_id", "version", "rules", "matcher", "size")
+
+    def __init__(self, user_id: str, version: int, rules: list[RuleRecord]):
+        self.user_id = user_id
+        self.version = version
+        self.rules = rules
+        self.matcher = RuleMatcher(rules)
+        self.size = _estimate_size(self)
+
+
+def _estimate_size(entry: CachedRuleSet) -> int:
+    """
+    Approximate resident bytes for an entry. Pattern and label strings are
+    interned and shared across users, so only per-rule objects and rule IDs
+    are charged to the entry.
+    """
+    size = sys.getsizeof(entry) + sys.getsizeof(entry.user_id) + sys.getsizeof(entry.rules)
+    for rule in entry.rules:
+        size += sys.getsizeof(rule) + sys.getsizeof(rule.id)
+    return size + entry.matcher.memory_size()
+
+
+class RuleSetCache:
+    """
+    Byte-budgeted cache of per-user rule sets, shared by every request in the
+    process.
+
+    Eviction follows W-TinyLFU: new entries land in a small LRU window; when
+    the window overflows its oldest entry competes with the main region's
+    least valuable entry and only the one seen more often (by a frequency
+    sketch) is kept. The main region is a segmented LRU, so entries hit twice
+    are protected from one-off scans. This keeps frequently active users
+    resident even when a burst of one-time users passes through.
+
+    Entries are tagged with the user's rules_version; a lookup with a newer
+    version misses, so the cache never serves rules older than the caller has
+    seen.
+    """
+
+    def __init__(self, max_bytes: int, window_fraction: float = 0.01, protected_fraction: float = 0.8):
+        self.max_bytes = max_bytes
+        self.window_max = max(int(max_bytes * window_fraction), 1)
+        self.main_max = max_bytes - self.window_max
+        self.protected_max = int(self.main_max * protected_fraction)
+
+        self._window: OrderedDict[str, CachedRuleSet] = OrderedDict()
+        self._probation: OrderedDict[str, CachedRuleSet] = OrderedDict()
+        self._protected: OrderedDict[str, CachedRuleSet] = OrderedDict()
+        self._window_bytes = 0
+        self._probation_bytes = 0
+        self._protected_bytes = 0
+
+        # Size the sketch for the number of entries the budget can hold at ~4KB each
+        self._sketch = FrequencySketch(max(1024, max_bytes // 4096))
+        self._stats = {"hits": 0, "misses": 0, "stale": 0, "evictions": 0, "rejections": 0}
+
+    def get(self, user_id: str, version: int) -> CachedRuleSet | None:
+        """Cached rules for a user at exactly this rules_version, or None."""
+        self._sketch.increment(user_id)
+
+        if user_id in self._window:
+            entry = self._window[user_id]
+            segment = self._window
+        elif user_id in self._probation:
+            entry = self._probation[user_id]
+            segment = self._probation
+        elif user_id in self._protected:
+            entry = self._protected[user_id]
+            segment = self._protected
+        else:
+            self._stats["misses"] += 1
+            return None
+
+        if entry.version != version:
+            self._stats["stale"] += 1
+            self.invalidate(user_id)
+            return None
+
+        self._stats["hits"] += 1
+        if segment is self._probation:
+            # Second hit - promote, demoting protected LRU entries if it overflows
+            del self._probation[user_id]
+            self._probation_bytes -= entry.size
+            self._protected[user_id] = entry
+            self._protected_bytes += entry.size
+            while self._protected_bytes > self.protected_max and len(self._protected) > 1:
+                _, demoted = self._protected.popitem(last=False)
+                self._protected_bytes -= demoted.size
+                self._probation[demoted.user_id] = demoted
+                self._probation_bytes += demoted.size
+        else:
+            segment.move_to_end(user_id)
+        return entry
+
+    def put(self, user_id: str, version: int, rules: list[RuleRecord]) -> CachedRuleSet:
+        """Cache a user's enabled rules. Returns the entry even if it is not retained."""
+        self.invalidate(user_id)
+        entry = CachedRuleSet(user_id, version, rules)
+        if entry.size > self.main_max:
+            self._stats["rejections"] += 1
+            return entry
+
+        self._window[user_id] = entry
+        self._window_bytes += entry.size
+        while self._window_bytes > self.window_max and self._window:
+            _, candidate = self._window.popitem(last=False)
+            self._window_bytes -= candidate.size
+            self._admit(candidate)
+        return entry
+
+    def invalidate(self, user_id: str) -> None:
+        for segment in (self._window, self._probation, self._protected):
+            entry = segment.pop(user_id, None)
+            if entry is not None:
+                self._adjust(segment, -entry.size)
+
+    def _admit(self, candidate: CachedRuleSet) -> None:
+        """Move a window victim into the main region if it beats what it would displace."""
+        candidate_frequency = self._sketch.estimate(candidate.user_id)
+        while self._probation_bytes + self._protected_bytes + candidate.size > self.main_max:
+            segment = self._probation or self._protected
+            victim = next(iter(segment.values()))
+            if candidate_frequency <= self._sketch.estimate(victim.user_id):
+                self._stats["rejections"] += 1
+                return
+            del segment[victim.user_id]
+            self._adjust(segment, -victim.size)
+            self._stats["evictions"] += 1
+
+        self._probation[candidate.user_id] = candidate
+        self._probation_bytes += candidate.size
+
+    def _adjust(self, segment: OrderedDict, delta: int) -> None:
+        if segment is self._window:
+            self._window_bytes += delta
+        elif segment is self._probation:
+            self._probation_bytes += delta
+        else:
+            self._protected_bytes += delta
+
+    def stats(self) -> dict:
+        lookups = self._stats["hits"] + self._stats["misses"] + self._stats["stale"]
+        return {
+            **self._stats,
+            "hit_ratio": self._stats["hits"] / lookups if lookups else 0.0,
+            "entries": len(self._window) + len(self._probation) + len(self._protected),
+            "resident_bytes": self._window_bytes + self._probation_bytes + self._protected_bytes,
+            "max_bytes": self.max_bytes,
+        }
+
+
+rule_set_cache = RuleSetCache(settings.rule_cache_max_bytes)
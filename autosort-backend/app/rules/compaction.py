@@ -0,0 +1,170 @@
+from app.rules.engine import RuleEngine, deterministic_rule_id
+from app.rules.matcher import RuleMatcher
+from app.rules.models import MatchType
+from app.rules.records import RuleRecord, MATCH_EXACT, MATCH_DOMAIN, MATCH_CONTAINS, rule_outcome
+from app.config import get_settings
+
+settings = get_settings()
+
+
+def _probe(rule: RuleRecord) -> str:
+    """
+    A string that a rule matches and that any rule matching it also matches
+    for every sender the rule covers: the sender for EXACT, "@domain" for
+    DOMAIN and the pattern itself for CONTAINS.
+    """
+    if rule.match_code == MATCH_DOMAIN:
+        return "@" + rule.email_pattern.lstrip("@")
+    return rule.email_pattern
+
+
+def _covers(earlier: RuleRecord, rule: RuleRecord) -> bool:
+    """Whether `earlier` matching this rule's probe means it matches everything the rule does."""
+    if rule.match_code == MATCH_EXACT:
+        return True
+    if rule.match_code == MATCH_DOMAIN:
+        return earlier.match_code in (MATCH_DOMAIN, MATCH_CONTAINS)
+    return earlier.match_code == MATCH_CONTAINS
+
+
+def find_shadowed_rules(rules: list[RuleRecord]) -> list[dict]:
+    """
+    Enabled rules that can never win because an earlier rule (in matching
+    order) matches every sender they would. Conservative: only the first
+    earlier match is considered.
+    """
+    enabled = [rule for rule in rules if rule.enabled]
+    position = {rule.id: index for index, rule in enumerate(enabled)}
+    matcher = RuleMatcher(enabled)
+
+    shadowed = []
+    for rule in enabled:
+        winner = matcher.match(_probe(rule))
+        if winner is None or winner.id == rule.id or position[winner.id] > position[rule.id]:
+            continue
+        if _covers(winner, rule):
+            shadowed.append({
+                "rule_id": rule.id,
+                "email_pattern": rule.email_pattern,
+                "match_type": rule.match_type.value,
+                "shadowed_by": winner.id,
+                "shadowed_by_pattern": winner.email_pattern,
+            })
+    return shadowed
+
+
+def find_compactions(rules: list[RuleRecord]) -> list[dict]:
+    """
+    Domains whose EXACT rules (at least compaction_min_rules of them) all share
+    an action, destination and mark-as-read setting and could be replaced by
+    one DOMAIN rule.
+
+    Domains with a disabled rule for one of their senders, or with a DOMAIN
+    rule sending elsewhere, are skipped. A proposal is only made if every
+    replaced sender still ends up with the same outcome once the DOMAIN rule
+    takes the position its deterministic ID gives it in matching order.
+    """
+    by_domain: dict[str, list[RuleRecord]] = {}
+    domain_rules: dict[str, RuleRecord] = {}
+    for rule in rules:
+        if rule.match_code == MATCH_EXACT and "@" in rule.email_pattern:
+            by_domain.setdefault(rule.email_pattern.rsplit("@", 1)[1], []).append(rule)
+        elif rule.match_code == MATCH_DOMAIN:
+            domain_rules.setdefault(rule.email_pattern.lstrip("@"), rule)
+
+    enabled = [rule for rule in rules if rule.enabled]
+    current = RuleMatcher(enabled)
+
+    proposals = []
+    for domain, group in by_domain.items():
+        if len(group) < settings.compaction_min_rules:
+            continue
+        if not all(rule.enabled for rule in group):
+            continue
+        outcomes = {rule_outcome(rule) for rule in group}
+        if len(outcomes) != 1:
+            continue
+        outcome = outcomes.pop()
+
+        existing = domain_rules.get(domain)
+        if existing is not None and (not existing.enabled or rule_outcome(existing) != outcome):
+            continue
+
+        # Rebuild the matching order without the exact rules, plus the domain rule
+        first = group[0]
+        replacement = existing or RuleRecord(
+            deterministic_rule_id(f"@{domain}"), f"@{domain}", MATCH_DOMAIN, first.action_code,
+            first.destination_label_id, first.destination_label_name, True, first.mark_as_read
+        )
+        removed = {rule.id for rule in group}
+        compacted = [rule for rule in enabled if rule.id not in removed and rule.id != replacement.id]
+        compacted.append(replacement)
+        compacted.sort(key=lambda r: r.id)
+        after = RuleMatcher(compacted)
+        if any(rule_outcome(after.match(rule.email_pattern)) != rule_outcome(current.match(rule.email_pattern))
+               for rule in group):
+            continue
+
+        proposals.append({
+            "domain": domain,
+            "email_pattern": f"@{domain}",
+            "domain_rule_id": replacement.id,
+            "domain_rule_exists": existing is not None,
+            "action": replacement.action.value,
+            "destination_label_id": replacement.destination_label_id,
+            "destination_label_name": replacement.destination_label_name,
+            "mark_as_read": replacement.mark_as_read,
+            "replaces": sorted(removed),
+            "replaces_patterns": sorted(rule.email_pattern for rule in group),
+        })
+
+    proposals.sort(key=lambda p: len(p["replaces"]), reverse=True)
+    return proposals
+
+
+async def analyze_rules(engine: RuleEngine) -> dict:
+    """Compaction proposals and shadowed rules for a user's rule set."""
+    rules = [RuleRecord.from_rule(rule) for rule in await engine.list_rules()]
+    proposals = find_compactions(rules)
+    return {
+        "rules": len(rules),
+        "compactions": proposals,
+        "rules_removable": sum(len(p["replaces"]) - (0 if p["domain_rule_exists"] else 1) for p in proposals),
+        "shadowed_rules": find_shadowed_rules(rules),
+    }
+
+
+async def compact_rules(engine: RuleEngine, domains: list[str] | None = None) -> dict:
+    """
+    Apply compaction proposals (all, or only the given domains). Proposals
+    are recomputed from the current rules, and each is written in one
+    transaction that re-checks the rules it deletes.
+    """
+    rules = [RuleRecord.from_rule(rule) for rule in await engine.list_rules()]
+    proposals = find_compactions(rules)
+    if domains is not None:
+        wanted = {domain.lower().lstrip("@") for domain in domains}
+        proposals = [p for p in proposals if p["domain"] in wanted]
+
+    applied = []
+    failed = []
+    for proposal in proposals:
+        try:
+            removed = await engine.replace_with_domain_rule(
+                proposal["domain_rule_id"],
+                proposal["email_pattern"],
+                proposal["replaces"],
+                {
+                    "match_type": MatchType.DOMAIN.value,
+                    "action": proposal["action"],
+                    "destination_label_id": proposal["destination_label_id"],
+                    "destination_label_name": proposal["destination_label_name"],
+                    "mark_as_read": proposal["mark_as_read"],
+                },
+                domain_rule_exists=proposal["domain_rule_exists"]
+            )
+            applied.append({"domain": proposal["domain"], "rules_removed": removed})
+        except Exception as e:
+            failed.append({"domain": proposal["domain"], "error": str(e)})
+
+    return {"applied": applied, "failed": failed}
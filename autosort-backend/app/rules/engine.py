@@ -1,52 +1,527 @@
-from datetime import datetime, timezone
+from datetime import datetime, timedelta, timezone
+import asyncio
 import hashlib
+import logging
 import uuid
 
-from google.cloud import firestore
-
+from app.db import get_db
+from app.rules.cache import CachedRuleSet, rule_set_cache
+from app.rules.matcher import RuleMatcher
+from app.rules.records import RuleRecord, RECORD_FIELDS, rule_outcome
 from app.rules.models import Rule, MagicFolder, AutoLearnFolder, MatchType, ActionType, UserSettings, MagicFolderSettings
 from app.config import get_settings
 
+logger = logging.getLogger(__name__)
 settings = get_settings()
-db = firestore.AsyncClient()
+
+# Firestore allows at most 500 writes per batch commit
+BATCH_WRITE_LIMIT = 500
+
+# Firestore allows at most 30 values in an `in` filter
+IN_QUERY_LIMIT = 30
+
+
+def deterministic_rule_id(email_pattern: str) -> str:
+    """Rule document ID derived from the pattern, so concurrent creates collapse into one rule."""
+    return hashlib.sha256(email_pattern.lower().encode()).hexdigest()[:20]
+
+
+def _changes_key(updates: dict) -> bool:
+    """Whether a rule update can move an exact rule's pattern away from its ID."""
+    return "email_pattern" in updates or "match_type" in updates
 
 
 class RuleEngine:
     def __init__(self, user_id: str):
         self.user_id = user_id
-        self.rules_collection = db.collection("users").document(user_id).collection("rules")
-        self.magic_folders_collection = db.collection("users").document(user_id).collection("magic_folders")
-        self.auto_learn_collection = db.collection("users").document(user_id).collection("auto_learn_folders")
-        self.folder_settings_collection = db.collection("users").document(user_id).collection("folder_settings")
-        self.stats_doc = db.collection("users").document(user_id)
+        self.db = get_db()
+        self.rules_collection = self.db.collection("users").document(user_id).collection("rules")
+        self.magic_folders_collection = self.db.collection("users").document(user_id).collection("magic_folders")
+        self.auto_learn_collection = self.db.collection("users").document(user_id).collection("auto_learn_folders")
+        self.folder_settings_collection = self.db.collection("users").document(user_id).collection("folder_settings")
+        self.rule_tombstones_collection = self.db.collection("users").document(user_id).collection("rule_tombstones")
+        self.stats_doc = self.db.collection("users").document(user_id)
 
-    async def find_matching_rule(self, sender_email: str) -> Rule | None:
+    async def find_matching_rule(self, sender_email: str) -> RuleRecord | None:
         """Find the first rule that matches the sender email."""
         sender_email = sender_email.lower()
 
         # Get all enabled rules
-        rules_query = self.rules_collection.where("enabled", "==", True)
+        rules_query = self.rules_collection.where("enabled", "==", True).select(RECORD_FIELDS)
         rules_docs = rules_query.stream()
 
         async for doc in rules_docs:
-            rule_data = doc.to_dict()
-            rule_data["id"] = doc.id
-            rule = Rule(**rule_data)
+            rule = RuleRecord.from_doc(doc.id, doc.to_dict())
 
             if self._matches_pattern(sender_email, rule.email_pattern, rule.match_type):
                 return rule
 
         return None
 
-    async def get_rule_by_pattern(self, email_pattern: str) -> Rule | None:
-        """Find a rule by exact email pattern match (for deduplication)."""
-        email_pattern = email_pattern.lower()
-        rules_query = self.rules_collection.where("email_pattern", "==", email_pattern)
-        async for doc in rules_query.stream():
-            rule_data = doc.to_dict()
-            rule_data["id"] = doc.id
-            return Rule(**rule_data)
-        return None
+    async def list_enabled_rules(self) -> list[RuleRecord]:
+        """Get all enabled rules, in the order find_matching_rule checks them."""
+        query = self.rules_collection.where("enabled", "==", True).select(RECORD_FIELDS)
+        return [RuleRecord.from_doc(doc.id, doc.to_dict()) async for doc in query.stream()]
+
+    async def find_matching_rules(self, sender_emails: list[str]) -> dict[str, RuleRecord | None]:
+        """
+        Find the first matching rule for each of many senders with one rules query.
+        Returns normalized (lowercased) sender -> rule or None.
+        """
+        cached = await self.get_cached_rules(await self.get_rules_version())
+        return cached.matcher.match_many(sender_emails)
+
+    async def get_cached_rules(self, rules_version: int) -> CachedRuleSet:
+        """
+        Enabled rules and their matcher from the shared cache, loading them on
+        a miss. rules_version must be read before calling so a concurrent
+        write can only make the cached rules newer, never older.
+        """
+        cached = rule_set_cache.get(self.user_id, rules_version)
+        if cached is None:
+            cached = rule_set_cache.put(self.user_id, rules_version, await self.list_enabled_rules())
+        return cached
+
+    async def get_rules_by_patterns(self, email_patterns: list[str]) -> dict[str, RuleRecord]:
+        """
+        Find rules for many exact email patterns with `in` queries run in
+        parallel. Returns lowercased pattern -> rule for patterns that have one.
+        """
+        patterns = sorted({pattern.lower() for pattern in email_patterns})
+
+        async def query_chunk(chunk: list[str]) -> list[RuleRecord]:
+            query = self.rules_collection.where("email_pattern", "in", chunk).select(RECORD_FIELDS)
+            return [RuleRecord.from_doc(doc.id, doc.to_dict()) async for doc in query.stream()]
+
+        results = await asyncio.gather(*(
+            query_chunk(patterns[i:i + IN_QUERY_LIMIT]) for i in range(0, len(patterns), IN_QUERY_LIMIT)
+        ))
+        found = {}
+        for records in results:
+            for rule in records:
+                found.setdefault(rule.email_pattern, rule)
+        return found
+
+    async def upsert_learned_rules(
+        self,
+        learned: dict[str, tuple[str, str]],
+        rule_ids_keyed: bool = False
+    ) -> list[RuleRecord]:
+        """
+        Point rules for many senders at the folders their mail was dragged to.
+
+        learned maps sender -> (label_id, label_name). Each sender's rule is
+        found by a point read of its deterministic pattern ID and, in the same
+        transaction, retargeted if its folder changed or created if missing.
+        Unless rule_ids_keyed (every exact rule re-keyed by rekey_exact_rules),
+        senders missing by ID are also looked up by pattern so older UUID-keyed
+        rules are updated rather than duplicated.
+        Returns the rules that were written.
+        """
+        senders = list(learned)
+        legacy: dict[str, RuleRecord] = {}
+        if not rule_ids_keyed and senders:
+            legacy = {
+                pattern: rule for pattern, rule in (await self.get_rules_by_patterns(senders)).items()
+                if rule.id != deterministic_rule_id(pattern)
+            }
+
+        # Each sender needs at most two writes, plus the rules version bump
+        chunk_size = (BATCH_WRITE_LIMIT - 1) // 2
+        written = []
+        for start in range(0, len(senders), chunk_size):
+            chunk = {sender: learned[sender] for sender in senders[start:start + chunk_size]}
+            try:
+                written += await self._upsert_learned_chunk(chunk, legacy)
+            except Exception as e:
+                logger.error(f"Failed to upsert {len(chunk)} learned rules for {self.user_id}: {e}")
+        return written
+
+    async def _upsert_learned_chunk(
+        self,
+        learned: dict[str, tuple[str, str]],
+        legacy: dict[str, RuleRecord]
+    ) -> list[RuleRecord]:
+        from google.cloud import firestore
+
+        refs = {sender: self.rules_collection.document(deterministic_rule_id(sender)) for sender in learned}
+        for sender, rule in legacy.items():
+            if sender in learned:
+                refs[sender] = self.rules_collection.document(rule.id)
+
+        @firestore.async_transactional
+        async def upsert(transaction) -> list[RuleRecord]:
+            # Read through the client: AsyncTransaction.get_all awaits an async generator and fails
+            snapshots = {
+                snapshot.id: snapshot
+                async for snapshot in self.db.get_all(list(refs.values()), transaction=transaction)
+            }
+            now = datetime.now(timezone.utc)
+            records = []
+
+            for sender, (label_id, label_name) in learned.items():
+                ref = refs[sender]
+                snapshot = snapshots.get(ref.id)
+                if snapshot is not None and snapshot.exists:
+                    data = snapshot.to_dict()
+                    if data.get("destination_label_id") == label_id:
+                        continue
+                    updates = {
+                        "destination_label_id": label_id,
+                        "destination_label_name": label_name,
+                        "action": ActionType.MOVE.value,
+                        "updated_at": now
+                    }
+                    transaction.update(ref, updates)
+                    records.append(RuleRecord.from_doc(ref.id, {**data, **updates}))
+                else:
+                    data = {
+                        "email_pattern": sender,
+                        "match_type": MatchType.EXACT.value,
+                        "action": ActionType.MOVE.value,
+                        "destination_label_id": label_id,
+                        "destination_label_name": label_name,
+                        "created_at": now,
+                        "updated_at": now,
+                        "enabled": True,
+                        "mark_as_read": False,
+                        "times_applied": 0
+                    }
+                    transaction.create(ref, data)
+                    # A recreated deterministic ID is no longer deleted
+                    transaction.delete(self.rule_tombstones_collection.document(ref.id))
+                    records.append(RuleRecord.from_doc(ref.id, data))
+
+            if records:
+                self._bump_rules_version(transaction)
+            return records
+
+        return await upsert(self.db.transaction())
+
+    async def bulk_create_rules(
+        self,
+        patterns: list[tuple[str, str]],
+        destination_label_id: str,
+        destination_label_name: str
+    ) -> list[dict]:
+        """
+        Create MOVE rules for many (email_pattern, match_type) pairs in batched
+        writes, under deterministic pattern IDs. Callers filter out patterns
+        that already have a rule. Returns per-pattern failures.
+        """
+        now = datetime.now(timezone.utc)
+        rules = {
+            deterministic_rule_id(pattern): {
+                "email_pattern": pattern.lower(),
+                "match_type": match_type,
+                "action": ActionType.MOVE.value,
+                "destination_label_id": destination_label_id,
+                "destination_label_name": destination_label_name,
+                "created_at": now,
+                "updated_at": now,
+                "enabled": True,
+                "mark_as_read": False,
+                "times_applied": 0
+            }
+            for pattern, match_type in patterns
+        }
+
+        def add_writes(batch, rule_id):
+            batch.set(self.rules_collection.document(rule_id), rules[rule_id])
+            batch.delete(self.rule_tombstones_collection.document(rule_id))
+
+        failures = await self._bulk_commit(list(rules), add_writes, writes_per_item=2)
+        return [{**failure, "id": rules[failure["id"]]["email_pattern"]} for failure in failures]
+
+    async def import_rules(self, rules: dict[str, dict], rule_ids_keyed: bool = False) -> dict:
+        """
+        Write one batch of imported rules (lowercased pattern -> rule fields,
+        at most ~250) keyed by deterministic pattern ID. Existing rules for a
+        pattern - found by point reads, and by pattern for UUID-keyed rules
+        unless rule_ids_keyed - are updated in place if they differ.
+        Returns {"created", "updated", "unchanged", "failed"} counts.
+        """
+        refs = {pattern: self.rules_collection.document(deterministic_rule_id(pattern)) for pattern in rules}
+        existing: dict[str, RuleRecord] = {}
+        async for snapshot in self.db.get_all(list(refs.values())):
+            if snapshot.exists:
+                record = RuleRecord.from_doc(snapshot.id, snapshot.to_dict())
+                existing[record.email_pattern] = record
+        missing = [pattern for pattern in rules if pattern not in existing]
+        if missing and not rule_ids_keyed:
+            existing.update(await self.get_rules_by_patterns(missing))
+
+        def key(record: RuleRecord) -> tuple:
+            return (
+                record.match_code, record.action_code, record.destination_label_id,
+                record.destination_label_name, record.enabled, record.mark_as_read
+            )
+
+        now = datetime.now(timezone.utc)
+        counts = {"created": 0, "updated": 0, "unchanged": 0, "failed": 0}
+        # An updated UUID-keyed rule (e.g. now exact) stays off its pattern ID
+        unkeyed = False
+        batch = self.db.batch()
+        for pattern, fields in rules.items():
+            current = existing.get(pattern)
+            if current is None:
+                batch.set(refs[pattern], {
+                    **fields, "email_pattern": pattern, "created_at": now, "updated_at": now, "times_applied": 0
+                })
+                batch.delete(self.rule_tombstones_collection.document(refs[pattern].id))
+                counts["created"] += 1
+            elif key(current) != key(RuleRecord.from_doc(current.id, {**fields, "email_pattern": pattern})):
+                batch.update(self.rules_collection.document(current.id), {**fields, "updated_at": now})
+                unkeyed = unkeyed or current.id != refs[pattern].id
+                counts["updated"] += 1
+            else:
+                counts["unchanged"] += 1
+
+        if counts["created"] or counts["updated"]:
+            self._bump_rules_version(batch, unkeyed)
+            try:
+                await batch.commit()
+            except Exception as e:
+                logger.error(f"Rule import batch of {len(rules)} failed for {self.user_id}: {e}")
+                counts["failed"] = counts["created"] + counts["updated"]
+                counts["created"] = counts["updated"] = 0
+        return counts
+
+    async def replace_with_domain_rule(
+        self,
+        domain_rule_id: str,
+        domain_pattern: str,
+        rule_ids: list[str],
+        fields: dict,
+        domain_rule_exists: bool = False
+    ) -> int:
+        """
+        Replace EXACT rules with one DOMAIN rule: the existing rule
+        domain_rule_id (whatever its ID or pattern form), or a new rule created
+        there. Each transaction re-reads the rules it deletes and the domain
+        rule, and aborts if any has gone or no longer matches `fields`, so a
+        rule edited since the compaction was proposed is never lost. The
+        domain rule is written before any deletion, so a failure part way only
+        leaves redundant exact rules. Returns the number of rules deleted.
+        """
+        from google.cloud import firestore
+
+        domain_ref = self.rules_collection.document(domain_rule_id)
+        # Field -> default for rules written before the field existed
+        checked = {"action": ActionType.MOVE.value, "destination_label_id": None, "mark_as_read": False}
+        tombstone = self._tombstone(datetime.now(timezone.utc))
+
+        # Two writes per deleted rule, plus the domain rule and version bump
+        chunk_size = (BATCH_WRITE_LIMIT - 2) // 2
+        deleted = 0
+        for start in range(0, len(rule_ids), chunk_size):
+            refs = [self.rules_collection.document(rule_id) for rule_id in rule_ids[start:start + chunk_size]]
+
+            @firestore.async_transactional
+            async def replace(transaction) -> None:
+                snapshots = [
+                    snapshot async for snapshot in self.db.get_all(refs + [domain_ref], transaction=transaction)
+                ]
+                domain_exists = False
+                for snapshot in snapshots:
+                    if snapshot.id == domain_ref.id:
+                        domain_exists = snapshot.exists
+                        if not domain_exists and not domain_rule_exists:
+                            continue
+                    data = snapshot.to_dict() if snapshot.exists else None
+                    expected_type = MatchType.DOMAIN.value if snapshot.id == domain_ref.id else MatchType.EXACT.value
+                    if data is None or not data.get("enabled", True) or any(
+                        data.get(field, default) != fields.get(field) for field, default in checked.items()
+                    ) or data.get("match_type", MatchType.EXACT.value) != expected_type:
+                        raise ValueError(f"Rule {snapshot.id} changed since the compaction was proposed")
+
+                if not domain_exists:
+                    now = datetime.now(timezone.utc)
+                    transaction.set(domain_ref, {
+                        **fields,
+                        "email_pattern": domain_pattern.lower(),
+                        "created_at": now,
+                        "updated_at": now,
+                        "enabled": True,
+                        "times_applied": 0
+                    })
+                    transaction.delete(self.rule_tombstones_collection.document(domain_ref.id))
+                for ref in refs:
+                    transaction.delete(ref)
+                    transaction.set(self.rule_tombstones_collection.document(ref.id), tombstone)
+                self._bump_rules_version(transaction)
+
+            await replace(self.db.transaction())
+            deleted += len(refs)
+        return deleted
+
+    async def rekey_exact_rules(self) -> dict:
+        """
+        One-time migration: move exact-match rules stored under UUIDs to their
+        deterministic pattern IDs, so auto-learn can find any exact sender's
+        rule with a point read. Old IDs get tombstones and moved rules a new
+        updated_at, so delta-sync clients pick up the change.
+
+        Patterns with several exact rules are merged into one rule under the
+        deterministic ID (see _merge_duplicate_rules), so no UUID rule is left
+        for auto-learn to miss.
+
+        Rules match in ID order, so a new ID can put a DOMAIN or CONTAINS rule
+        ahead of (or behind) the exact rule. Patterns whose matching outcome
+        would change are held back and reported, as compaction does.
+
+        Sets rule_ids_keyed on the user doc only if every pattern was re-keyed
+        and no other rule write happened during the migration; otherwise it is
+        safe to run again.
+        """
+        from google.cloud import firestore
+
+        version = await self.get_rules_version()
+        now = datetime.now(timezone.utc)
+
+        # Deterministic ID -> IDs of the exact rules for that pattern
+        groups: dict[str, list[str]] = {}
+        query = self.rules_collection.where("match_type", "==", MatchType.EXACT.value)
+        docs = {doc.id: doc.to_dict() async for doc in query.stream()}
+        for rule_id, data in docs.items():
+            groups.setdefault(deterministic_rule_id(data["email_pattern"]), []).append(rule_id)
+
+        # Each re-keyed pattern's rule under its new ID: the rule that wins
+        # today (first enabled in ID order) is the one a merge keeps
+        rekeyed = {}
+        for target_id, rule_ids in groups.items():
+            if rule_ids != [target_id]:
+                ordered = sorted(rule_ids)
+                winner = next((rule_id for rule_id in ordered if docs[rule_id].get("enabled", True)), ordered[0])
+                rekeyed[target_id] = RuleRecord.from_doc(target_id, docs[winner])
+
+        cached = await self.get_cached_rules(version)
+        removed = {rule_id for target_id in rekeyed for rule_id in groups[target_id]}
+        after_rules = [rule for rule in cached.rules if rule.id not in removed]
+        after_rules.extend(rekeyed.values())
+        after_rules.sort(key=lambda r: r.id)
+        after = RuleMatcher(after_rules)
+        held = [
+            {"id": target_id, "email_pattern": rule.email_pattern}
+            for target_id, rule in rekeyed.items()
+            if rule_outcome(after.match(rule.email_pattern)) != rule_outcome(cached.matcher.match(rule.email_pattern))
+        ]
+        held_ids = {entry["id"] for entry in held}
+
+        moves: dict[str, tuple[str, dict]] = {}
+        duplicates: dict[str, list[str]] = {}
+        for target_id, rule_ids in groups.items():
+            if target_id in held_ids:
+                continue
+            if len(rule_ids) > 1:
+                duplicates[target_id] = rule_ids
+            elif rule_ids[0] != target_id:
+                moves[rule_ids[0]] = (target_id, {**docs[rule_ids[0]], "updated_at": now})
+
+        tombstone = self._tombstone(now)
+
+        def add_writes(batch, rule_id):
+            target_id, data = moves[rule_id]
+            batch.create(self.rules_collection.document(target_id), data)
+            batch.delete(self.rule_tombstones_collection.document(target_id))
+            batch.delete(self.rules_collection.document(rule_id))
+            batch.set(self.rule_tombstones_collection.document(rule_id), tombstone)
+
+        # The version is bumped once at the end so it also tells us whether
+        # anything else changed the rules meanwhile
+        failures = await self._bulk_commit(list(moves), add_writes, writes_per_item=4, bump_rules_version=False)
+        merged, merge_failures = await self._merge_duplicate_rules(duplicates, now)
+        failures += merge_failures
+
+        @firestore.async_transactional
+        async def finish(transaction) -> bool:
+            snapshot = await self.stats_doc.get(transaction=transaction)
+            current = (snapshot.to_dict() or {}).get("rules_version", 0) if snapshot.exists else 0
+            keyed = current == version and not failures and not held
+            transaction.set(self.stats_doc, {"rules_version": current + 1, "rule_ids_keyed": keyed}, merge=True)
+            return keyed
+
+        keyed = await finish(self.db.transaction())
+        return {
+            "moved": len(moves) - (len(failures) - len(merge_failures)),
+            "merged": merged,
+            "failed": failures,
+            "held": held,
+            "rule_ids_keyed": keyed
+        }
+
+    async def _merge_duplicate_rules(
+        self,
+        duplicates: dict[str, list[str]],
+        now: datetime
+    ) -> tuple[int, list[dict]]:
+        """
+        Collapse each pattern's exact rules into its deterministic ID. The
+        rule that wins matching today (the first enabled one in ID order, or
+        the first if none is enabled) keeps its fields, times_applied is
+        summed and the others are deleted with tombstones. Groups are re-read
+        in one transaction per ~500 writes, so a rule changed meanwhile is
+        merged as it now is.
+        Returns (rules deleted, failures as [{"id": deterministic_id, "error"}]).
+        """
+        from google.cloud import firestore
+
+        # A group needs its target write, a tombstone delete and two writes per other rule
+        chunks: list[list[str]] = [[]]
+        writes = 0
+        for target_id, rule_ids in duplicates.items():
+            group_writes = 2 + 2 * len(rule_ids)
+            if writes + group_writes > BATCH_WRITE_LIMIT and chunks[-1]:
+                chunks.append([])
+                writes = 0
+            chunks[-1].append(target_id)
+            writes += group_writes
+
+        tombstone = self._tombstone(now)
+        merged = 0
+        failures = []
+        for chunk in chunks:
+            if not chunk:
+                continue
+            refs = {
+                rule_id: self.rules_collection.document(rule_id)
+                for target_id in chunk for rule_id in {target_id, *duplicates[target_id]}
+            }
+
+            @firestore.async_transactional
+            async def merge(transaction) -> int:
+                current = {
+                    snapshot.id: snapshot.to_dict()
+                    async for snapshot in self.db.get_all(list(refs.values()), transaction=transaction)
+                    if snapshot.exists
+                }
+                deleted = 0
+                for target_id in chunk:
+                    rule_ids = sorted(rule_id for rule_id in {target_id, *duplicates[target_id]} if rule_id in current)
+                    if not rule_ids or rule_ids == [target_id]:
+                        continue
+                    winner = next((rule_id for rule_id in rule_ids if current[rule_id].get("enabled", True)), rule_ids[0])
+                    data = current[winner]
+                    transaction.set(refs[target_id], {
+                        **data,
+                        "email_pattern": data["email_pattern"].lower(),
+                        "times_applied": sum(current[rule_id].get("times_applied", 0) for rule_id in rule_ids),
+                        "updated_at": now
+                    })
+                    transaction.delete(self.rule_tombstones_collection.document(target_id))
+                    for rule_id in rule_ids:
+                        if rule_id != target_id:
+                            transaction.delete(refs[rule_id])
+                            transaction.set(self.rule_tombstones_collection.document(rule_id), tombstone)
+                            deleted += 1
+                return deleted
+
+            try:
+                merged += await merge(self.db.transaction())
+            except Exception as e:
+                logger.error(f"Merging duplicate rules failed for {self.user_id}: {e}")
+                failures += [{"id": target_id, "error": str(e)} for target_id in chunk]
+        return merged, failures
 
     def _matches_pattern(
         self,
@@ -88,7 +563,7 @@ class RuleEngine:
 
         if use_deterministic_id:
             # Create deterministic ID from email pattern to prevent duplicates
-            rule_id = hashlib.sha256(email_pattern_lower.encode()).hexdigest()[:20]
+            rule_id = deterministic_rule_id(email_pattern_lower)
         else:
             rule_id = str(uuid.uuid4())
 
@@ -101,13 +576,19 @@ class RuleEngine:
             "destination_label_id": destination_label_id,
             "destination_label_name": destination_label_name,
             "created_at": now,
+            "updated_at": now,
             "enabled": True,
             "mark_as_read": mark_as_read,
             "times_applied": 0
         }
 
         # Use set() which will create or overwrite - prevents duplicates with deterministic ID
-        await self.rules_collection.document(rule_id).set(rule_data)
+        batch = self.db.batch()
+        batch.set(self.rules_collection.document(rule_id), rule_data)
+        # A recreated deterministic ID is no longer deleted
+        batch.delete(self.rule_tombstones_collection.document(rule_id))
+        self._bump_rules_version(batch, unkeyed=not use_deterministic_id and match_type == MatchType.EXACT.value)
+        await batch.commit()
 
         rule_data["id"] = rule_id
         return Rule(**rule_data)
@@ -121,6 +602,89 @@ class RuleEngine:
             rules.append(Rule(**rule_data))
         return rules
 
+    async def list_rules_page(self, limit: int, cursor: str | None = None) -> tuple[list[Rule], str | None]:
+        """
+        Get one page of rules ordered by ID.
+        cursor is the last rule ID of the previous page.
+        Returns (rules, next_cursor); next_cursor is None on the last page.
+        """
+        query = self.rules_collection.order_by("__name__").limit(limit)
+        if cursor:
+            query = query.start_after({"__name__": cursor})
+
+        rules = []
+        async for doc in query.stream():
+            rule_data = doc.to_dict()
+            rule_data["id"] = doc.id
+            rules.append(Rule(**rule_data))
+
+        next_cursor = rules[-1].id if len(rules) == limit else None
+        return rules, next_cursor
+
+    async def list_rule_changes(self, since: datetime) -> tuple[list[Rule], list[str]]:
+        """
+        Get rules changed and rule IDs deleted at or after a point in time.
+        Returns (changed_rules, deleted_rule_ids).
+        """
+        rules = []
+        async for doc in self.rules_collection.where("updated_at", ">=", since).stream():
+            rule_data = doc.to_dict()
+            rule_data["id"] = doc.id
+            rules.append(Rule(**rule_data))
+
+        live_ids = {rule.id for rule in rules}
+        deleted = []
+        async for doc in self.rule_tombstones_collection.where("deleted_at", ">=", since).stream():
+            if doc.id not in live_ids:
+                deleted.append(doc.id)
+
+        return rules, deleted
+
+    async def get_rules_version(self) -> int:
+        """Get the user's rules version, bumped on every rule change."""
+        doc = await self.stats_doc.get()
+        if doc.exists:
+            return doc.to_dict().get("rules_version", 0)
+        return 0
+
+    def _bump_rules_version(self, batch, unkeyed: bool = False) -> None:
+        """
+        Add a rules version increment to a write batch. unkeyed marks writes
+        that may leave an exact rule outside its deterministic ID, so
+        auto-learn falls back to pattern lookups until the next re-key.
+        """
+        from google.cloud import firestore
+        update = {"rules_version": firestore.Increment(1)}
+        if unkeyed:
+            update["rule_ids_keyed"] = False
+        batch.set(self.stats_doc, update, merge=True)
+
+    async def _commit_rules_version(self, unkeyed: bool = False) -> None:
+        """
+        Bump the rules version on its own, after writes that were committed
+        without it. Retried up to rules_version_bump_attempts times, then
+        raised: the rules are already written, and without the bump other
+        instances keep serving their cached rules.
+        """
+        for attempt in range(settings.rules_version_bump_attempts):
+            batch = self.db.batch()
+            self._bump_rules_version(batch, unkeyed)
+            try:
+                await batch.commit()
+                return
+            except Exception as e:
+                logger.warning(f"Failed to bump rules version for {self.user_id} (attempt {attempt + 1}): {e}")
+                if attempt + 1 >= settings.rules_version_bump_attempts:
+                    raise
+                await asyncio.sleep(2 ** attempt * 0.1)
+
+    def _tombstone(self, now: datetime) -> dict:
+        """Tombstone data for a deleted rule. expire_at drives the Firestore TTL policy."""
+        return {
+            "deleted_at": now,
+            "expire_at": now + timedelta(days=settings.rule_tombstone_retention_days)
+        }
+
     async def get_rule(self, rule_id: str) -> Rule | None:
         """Get a specific rule."""
         doc = await self.rules_collection.document(rule_id).get()
@@ -134,30 +698,208 @@ class RuleEngine:
         """Update a rule."""
         # Remove None values and id from updates
         updates = {k: v for k, v in updates.items() if v is not None and k != "id"}
+        updates["updated_at"] = datetime.now(timezone.utc)
 
-        await self.rules_collection.document(rule_id).update(updates)
+        batch = self.db.batch()
+        batch.update(self.rules_collection.document(rule_id), updates)
+        self._bump_rules_version(batch, unkeyed=_changes_key(updates))
+        await batch.commit()
         return await self.get_rule(rule_id)
 
+    async def batch_update_rules(self, updates: dict[str, dict]) -> int:
+        """
+        Apply field updates to many rules using batched writes.
+        updates maps rule ID -> fields to set. Does not re-read the rules.
+        Returns count updated.
+        """
+        now = datetime.now(timezone.utc)
+
+        def add_writes(batch, rule_id):
+            batch.update(self.rules_collection.document(rule_id), {**updates[rule_id], "updated_at": now})
+
+        unkeyed = any(_changes_key(fields) for fields in updates.values())
+        failures = await self._bulk_commit(list(updates), add_writes, writes_per_item=1, unkeyed=unkeyed)
+        return len(updates) - len(failures)
+
+    async def apply_rule_operations(self, operations: list[tuple[str, str, dict]]) -> list[dict]:
+        """
+        Apply (op, rule_id, fields) operations - op "update" sets fields, op
+        "delete" removes the rule - in one transaction per ~250 operations.
+        Each transaction reads its rules first, so missing rules are reported
+        instead of written, and updated rules are returned without a re-read.
+        A failed transaction fails every operation in it. The transactions
+        don't touch the user doc; the rules version is bumped once after all
+        of them, so concurrent chunks don't contend on it. If that bump still
+        fails after retries its error is raised, though the writes stand.
+        Returns one result per operation, in order:
+        {"id", "op", "status": "updated" | "deleted" | "not_found" | "failed", "rule"?, "error"?}.
+        """
+        from google.cloud import firestore
+
+        # Up to two writes per operation
+        chunk_size = BATCH_WRITE_LIMIT // 2
+        chunks = [operations[i:i + chunk_size] for i in range(0, len(operations), chunk_size)]
+        semaphore = asyncio.Semaphore(settings.bulk_write_concurrency)
+
+        async def apply_chunk(chunk: list[tuple[str, str, dict]]) -> list[dict]:
+            refs = [self.rules_collection.document(rule_id) for _, rule_id, _ in chunk]
+
+            @firestore.async_transactional
+            async def apply(transaction) -> list[dict]:
+                snapshots = {
+                    snapshot.id: snapshot
+                    async for snapshot in self.db.get_all(refs, transaction=transaction)
+                }
+                now = datetime.now(timezone.utc)
+                tombstone = self._tombstone(now)
+                results = []
+                for (op, rule_id, fields), ref in zip(chunk, refs):
+                    snapshot = snapshots.get(rule_id)
+                    if snapshot is None or not snapshot.exists:
+                        results.append({"id": rule_id, "op": op, "status": "not_found"})
+                    elif op == "delete":
+                        transaction.delete(ref)
+                        transaction.set(self.rule_tombstones_collection.document(rule_id), tombstone)
+                        results.append({"id": rule_id, "op": op, "status": "deleted"})
+                    else:
+                        updates = {k: v for k, v in fields.items() if v is not None and k != "id"}
+                        updates["updated_at"] = now
+                        transaction.update(ref, updates)
+                        rule = Rule(**{**snapshot.to_dict(), **updates, "id": rule_id})
+                        results.append({"id": rule_id, "op": op, "status": "updated", "rule": rule})
+                return results
+
+            async with semaphore:
+                try:
+                    return await apply(self.db.transaction())
+                except Exception as e:
+                    logger.error(f"Rule batch of {len(chunk)} operations failed for {self.user_id}: {e}")
+                    return [
+                        {"id": rule_id, "op": op, "status": "failed", "error": str(e)}
+                        for op, rule_id, _ in chunk
+                    ]
+
+        chunk_results = await asyncio.gather(*(apply_chunk(chunk) for chunk in chunks))
+        results = [result for results in chunk_results for result in results]
+        if any(result["status"] in ("updated", "deleted") for result in results):
+            await self._commit_rules_version(unkeyed=any(
+                _changes_key(fields) for (_, _, fields), result in zip(operations, results)
+                if result["status"] == "updated"
+            ))
+        return results
+
     async def delete_rule(self, rule_id: str) -> None:
-        """Delete a rule."""
-        await self.rules_collection.document(rule_id).delete()
+        """Delete a rule, leaving a tombstone for delta sync."""
+        batch = self.db.batch()
+        batch.delete(self.rules_collection.document(rule_id))
+        batch.set(self.rule_tombstones_collection.document(rule_id), self._tombstone(datetime.now(timezone.utc)))
+        self._bump_rules_version(batch)
+        await batch.commit()
+
+    async def delete_rules(self, rule_ids: list[str]) -> list[dict]:
+        """Delete many rules in batched commits. Returns per-rule failures."""
+        now = datetime.now(timezone.utc)
+        tombstone = self._tombstone(now)
+
+        def add_writes(batch, rule_id):
+            batch.delete(self.rules_collection.document(rule_id))
+            batch.set(self.rule_tombstones_collection.document(rule_id), tombstone)
+
+        return await self._bulk_commit(rule_ids, add_writes, writes_per_item=2)
 
     async def delete_rules_by_destination(self, label_id: str) -> int:
         """Delete all rules that point to a specific destination label. Returns count deleted."""
-        deleted_count = 0
-        async for doc in self.rules_collection.where("destination_label_id", "==", label_id).stream():
-            await doc.reference.delete()
-            deleted_count += 1
-        return deleted_count
+        rule_ids = await self._rule_ids_by_destination(label_id)
+        failures = await self.delete_rules(rule_ids)
+        return len(rule_ids) - len(failures)
+
+    async def delete_label_data(self, label_id: str) -> dict:
+        """
+        Delete every rule, setting and registration tied to a label.
+        Returns {"rules_deleted": int, "failed": [{"id", "type", "error"}]}.
+        """
+        rule_ids = await self._rule_ids_by_destination(label_id)
+        failures = [{**f, "type": "rule"} for f in await self.delete_rules(rule_ids)]
+
+        # Folder-level docs fit in a single batch
+        batch = self.db.batch()
+        batch.delete(self.magic_folders_collection.document(label_id))
+        batch.delete(self.folder_settings_collection.document(label_id))
+        batch.delete(self.auto_learn_collection.document(label_id))
+        async for doc in self.magic_folders_collection.where("destination_label_id", "==", label_id).stream():
+            batch.delete(doc.reference)
+        try:
+            await batch.commit()
+        except Exception as e:
+            logger.error(f"Failed to delete folder data for {label_id}: {e}")
+            failures.append({"id": label_id, "type": "folder", "error": str(e)})
+
+        return {
+            "rules_deleted": len(rule_ids) - sum(1 for f in failures if f["type"] == "rule"),
+            "failed": failures
+        }
+
+    async def _rule_ids_by_destination(self, label_id: str) -> list[str]:
+        """IDs of rules pointing to a label, without downloading the rules."""
+        query = self.rules_collection.where("destination_label_id", "==", label_id).select(["destination_label_id"])
+        return [doc.id async for doc in query.stream()]
+
+    async def _bulk_commit(
+        self,
+        item_ids: list[str],
+        add_writes,
+        writes_per_item: int,
+        bump_rules_version: bool = True,
+        unkeyed: bool = False
+    ) -> list[dict]:
+        """
+        Write many items as Firestore batches, committing up to
+        bulk_write_concurrency batches at once.
+
+        add_writes(batch, item_id) adds one item's writes to a batch.
+        Batches are atomic, so a failed commit fails every item in it.
+        The rules version is bumped once after every batch has committed
+        (if any succeeded) rather than in each batch, so the parallel
+        commits don't all contend on the user doc; a bump that still fails
+        after retries raises.
+        Returns failures as [{"id": item_id, "error": str}].
+        """
+        chunk_size = BATCH_WRITE_LIMIT // writes_per_item
+        chunks = [item_ids[i:i + chunk_size] for i in range(0, len(item_ids), chunk_size)]
+        semaphore = asyncio.Semaphore(settings.bulk_write_concurrency)
+
+        async def commit_chunk(chunk: list[str]) -> list[dict]:
+            batch = self.db.batch()
+            for item_id in chunk:
+                add_writes(batch, item_id)
+            async with semaphore:
+                try:
+                    await batch.commit()
+                except Exception as e:
+                    logger.error(f"Batch commit of {len(chunk)} items failed for {self.user_id}: {e}")
+                    return [{"id": item_id, "error": str(e)} for item_id in chunk]
+            return []
+
+        results = await asyncio.gather(*(commit_chunk(chunk) for chunk in chunks))
+        failures = [failure for chunk_failures in results for failure in chunk_failures]
+        if bump_rules_version and len(failures) < len(item_ids):
+            await self._commit_rules_version(unkeyed)
+        return failures
 
     async def increment_rule_counter(self, rule_id: str) -> None:
-        """Increment the times_applied counter for a rule."""
+        """
+        Increment the times_applied counter for a rule. updated_at moves too,
+        so ?since= delta syncs pick up the new count.
+        """
+        from google.cloud import firestore
         await self.rules_collection.document(rule_id).update({
-            "times_applied": firestore.Increment(1)
+            "times_applied": firestore.Increment(1),
+            "updated_at": datetime.now(timezone.utc)
         })
 
     async def increment_emails_processed(self) -> None:
         """Increment the total emails processed counter."""
+        from google.cloud import firestore
         await self.stats_doc.set({
             "emails_processed": firestore.Increment(1),
             "last_processed_at": datetime.now(timezone.utc)
@@ -250,30 +992,60 @@ class RuleEngine:
             data = doc.to_dict()
             return {
                 "emails_processed": data.get("emails_processed", 0),
-                "rules_count": len(await self.list_rules()),
+                **await self.get_rule_counts(),
                 "last_processed_at": data.get("last_processed_at")
             }
         return {
             "emails_processed": 0,
             "rules_count": 0,
+            "rules_enabled": 0,
+            "rules_disabled": 0,
+            "rules_by_action": {action.value: 0 for action in ActionType},
             "last_processed_at": None
         }
 
+    async def get_rule_counts(self) -> dict:
+        """
+        Count rules with server-side aggregation queries, run in parallel.
+        Each count costs one read per 1000 rules instead of reading every rule.
+        """
+        actions = list(ActionType)
+        total, enabled, *per_action = await asyncio.gather(
+            self._count(self.rules_collection),
+            self._count(self.rules_collection.where("enabled", "==", True)),
+            *(self._count(self.rules_collection.where("action", "==", action.value)) for action in actions)
+        )
+        return {
+            "rules_count": total,
+            "rules_enabled": enabled,
+            "rules_disabled": total - enabled,
+            "rules_by_action": {action.value: count for action, count in zip(actions, per_action)}
+        }
+
+    async def _count(self, query) -> int:
+        """Run a count() aggregation query."""
+        result = await query.count(alias="count").get()
+        return result[0][0].value if result else 0
+
     # User Settings
 
     async def get_user_settings(self) -> UserSettings:
         """Get user settings, returning defaults if not set."""
         doc = await self.stats_doc.get()
         if doc.exists:
-            data = doc.to_dict()
-            settings_data = data.get("settings", {})
-            return UserSettings(
-                blackhole_enabled=settings_data.get("blackhole_enabled", True),
-                blackhole_delete_days=settings_data.get("blackhole_delete_days", 7),
-                blackhole_label_id=settings_data.get("blackhole_label_id")
-            )
+            return self.user_settings_from_doc(doc.to_dict())
         return UserSettings()
 
+    @staticmethod
+    def user_settings_from_doc(data: dict) -> UserSettings:
+        """Build UserSettings from an already-read user document."""
+        settings_data = data.get("settings", {})
+        return UserSettings(
+            blackhole_enabled=settings_data.get("blackhole_enabled", True),
+            blackhole_delete_days=settings_data.get("blackhole_delete_days", 7),
+            blackhole_label_id=settings_data.get("blackhole_label_id")
+        )
+
     async def get_blackhole_label_id(self) -> str | None:
         """Get the stored blackhole label ID."""
         settings = await self.get_user_settings()
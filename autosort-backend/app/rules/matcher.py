@@ -0,0 +1,111 @@
+import re
+import sys
+
+from app.rules.records import RuleRecord, MATCH_EXACT, MATCH_DOMAIN, MATCH_CONTAINS
+
+
+class RuleMatcher:
+    """
+    In-memory index over a rule set for matching many senders at once.
+
+    Gives the same answer as checking each rule in order with
+    RuleEngine._matches_pattern - the first enabled rule in list order wins -
+    but uses dict lookups for EXACT and DOMAIN rules and a single regex scan
+    for all CONTAINS rules.
+    """
+
+    def __init__(self, rules: list[RuleRecord]):
+        self.rules = [rule for rule in rules if rule.enabled]
+
+        # pattern/domain -> position of the first rule using it
+        self._exact: dict[str, int] = {}
+        self._domain: dict[str, int] = {}
+        # CONTAINS pattern -> position of the first rule using it
+        contains: dict[str, int] = {}
+        # DOMAIN patterns that can't be indexed by domain (e.g. "user@host")
+        self._fallback: list[int] = []
+
+        for position, rule in enumerate(self.rules):
+            # Already lowercased and interned by RuleRecord
+            pattern = rule.email_pattern
+            if rule.match_code == MATCH_EXACT:
+                self._exact.setdefault(pattern, position)
+            elif rule.match_code == MATCH_DOMAIN:
+                domain = sys.intern(pattern.lstrip("@"))
+                if "@" in domain:
+                    self._fallback.append(position)
+                else:
+                    self._domain.setdefault(domain, position)
+            elif rule.match_code == MATCH_CONTAINS:
+                contains.setdefault(pattern, position)
+
+        # Alternatives are ordered by rule position, so at each offset the
+        # regex picks the earliest rule matching there; the minimum over all
+        # offsets is the earliest CONTAINS rule matching anywhere.
+        self._contains_positions = contains
+        self._contains_regex = None
+        if contains:
+            ordered = sorted(contains, key=contains.get)
+            alternation = "|".join(re.escape(p) for p in ordered)
+            self._contains_regex = re.compile(f"(?=({alternation}))")
+
+    def memory_size(self) -> int:
+        """
+        Approximate bytes held by the index, excluding the rules themselves
+        and the interned pattern strings shared with other matchers.
+        """
+        size = (
+            sys.getsizeof(self.rules)
+            + sys.getsizeof(self._exact)
+            + sys.getsizeof(self._domain)
+            + sys.getsizeof(self._contains_positions)
+            + sys.getsizeof(self._fallback)
+        )
+        if self._contains_regex is not None:
+            # Compiled program is roughly proportional to the pattern length
+            size += 4 * sys.getsizeof(self._contains_regex.pattern)
+        return size
+
+    def match(self, sender_email: str) -> RuleRecord | None:
+        """Find the first rule that matches a sender."""
+        return self._match_normalized(sender_email.strip().lower())
+
+    def match_many(self, sender_emails: list[str]) -> dict[str, RuleRecord | None]:
+        """
+        Match a batch of senders in one pass.
+        Returns normalized (lowercased) sender -> first matching rule or None.
+        """
+        results = {}
+        for sender in sender_emails:
+            normalized = sender.strip().lower()
+            if normalized not in results:
+                results[normalized] = self._match_normalized(normalized)
+        return results
+
+    def _match_normalized(self, sender: str) -> RuleRecord | None:
+        best = None
+
+        position = self._exact.get(sender)
+        if position is not None:
+            best = position
+
+        if "@" in sender:
+            position = self._domain.get(sender.rsplit("@", 1)[1])
+            if position is not None and (best is None or position < best):
+                best = position
+
+        for position in self._fallback:
+            if best is not None and position > best:
+                break
+            domain = self.rules[position].email_pattern.lower().lstrip("@")
+            if sender.endswith(f"@{domain}"):
+                best = position
+                break
+
+        if self._contains_regex is not None:
+            for found in self._contains_regex.finditer(sender):
+                position = self._contains_positions[found.group(1)]
+                if best is None or position < best:
+                    best = position
+
+        return self.rules[best] if best is not None else None
@@ -1,7 +1,7 @@
 from datetime import datetime
 from enum import Enum
-from typing import Optional
-from pydantic import BaseModel
+from typing import Literal, Optional
+from pydantic import BaseModel, Field
 
 
 class MatchType(str, Enum):
@@ -24,11 +24,19 @@ class Rule(BaseModel):
     destination_label_id: Optional[str] = None
     destination_label_name: Optional[str] = None
     created_at: datetime
+    updated_at: Optional[datetime] = None
     enabled: bool = True
     mark_as_read: bool = False
     times_applied: int = 0
 
 
+class RuleChanges(BaseModel):
+    """Rules changed since a sync token (GET /rules?since=...)."""
+    rules: list[Rule]
+    deleted: list[str]
+    sync_token: str
+
+
 class RuleCreate(BaseModel):
     email_pattern: str
     match_type: MatchType = MatchType.EXACT
@@ -38,6 +46,11 @@ class RuleCreate(BaseModel):
     mark_as_read: bool = False
 
 
+class RuleImport(RuleCreate):
+    """One line of an NDJSON rule import (as written by GET /rules/export)."""
+    enabled: bool = True
+
+
 class RuleUpdate(BaseModel):
     email_pattern: Optional[str] = None
     match_type: Optional[MatchType] = None
@@ -48,6 +61,28 @@ class RuleUpdate(BaseModel):
     mark_as_read: Optional[bool] = None
 
 
+class RuleBatchOperation(BaseModel):
+    """One operation of a PATCH /rules:batch request; `update` holds the fields for op "update"."""
+    op: Literal["update", "delete"]
+    id: str
+    update: Optional[RuleUpdate] = None
+
+
+class RuleBatchRequest(BaseModel):
+    operations: list[RuleBatchOperation] = Field(min_length=1, max_length=1000)
+
+
+class RuleSimulationRequest(BaseModel):
+    """Proposed rules to dry-run against recent INBOX mail."""
+    rules: list[RuleCreate]
+    max_messages: int = Field(default=200, ge=1, le=1000)
+
+
+class RuleCompactionRequest(BaseModel):
+    """Domains whose compaction proposals to apply; all proposals if omitted."""
+    domains: Optional[list[str]] = None
+
+
 class MagicFolder(BaseModel):
     label_id: str
     label_name: str
@@ -66,6 +101,9 @@ class AutoLearnFolder(BaseModel):
 class ProcessingStats(BaseModel):
     emails_processed: int = 0
     rules_count: int = 0
+    rules_enabled: int = 0
+    rules_disabled: int = 0
+    rules_by_action: dict[str, int] = {}
     last_processed_at: Optional[datetime] = None
 
 
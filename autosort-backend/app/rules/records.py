@@ -0,0 +1,119 @@
+import sys
+
+from app.rules.models import Rule, MatchType, ActionType
+
+# Enums are stored as small ints; tuple position is the code
+MATCH_TYPES = (MatchType.EXACT, MatchType.DOMAIN, MatchType.CONTAINS)
+ACTIONS = (ActionType.MOVE, ActionType.BLOCK_DELETE, ActionType.READ_ARCHIVE)
+MATCH_EXACT, MATCH_DOMAIN, MATCH_CONTAINS = range(len(MATCH_TYPES))
+_MATCH_CODES = {match_type.value: code for code, match_type in enumerate(MATCH_TYPES)}
+_ACTION_CODES = {action.value: code for code, action in enumerate(ACTIONS)}
+
+# Firestore fields a RuleRecord needs - use with .select() to skip the rest
+RECORD_FIELDS = [
+    "email_pattern", "match_type", "action", "destination_label_id",
+    "destination_label_name", "enabled", "mark_as_read",
+]
+
+
+def _intern(value: str | None) -> str | None:
+    return sys.intern(value) if value is not None else None
+
+
+class RuleRecord:
+    """
+    Compact rule for matching and caching on the notification hot path.
+
+    Carries only what matching and applying a rule need: no timestamps or
+    counters, no validation. Patterns and label fields are interned so users
+    and rules sharing a value share one string, and enums are stored as ints.
+    `match_type` and `action` still read as enums, so code written against
+    Rule works unchanged. Full Rule models are only built at the API boundary.
+    """
+
+    __slots__ = (
+        "id", "email_pattern", "match_code", "action_code",
+        "destination_label_id", "destination_label_name", "enabled", "mark_as_read",
+    )
+
+    def __init__(
+        self,
+        id: str,
+        email_pattern: str,
+        match_code: int,
+        action_code: int,
+        destination_label_id: str | None = None,
+        destination_label_name: str | None = None,
+        enabled: bool = True,
+        mark_as_read: bool = False
+    ):
+        self.id = id
+        self.email_pattern = sys.intern(email_pattern.lower())
+        self.match_code = match_code
+        self.action_code = action_code
+        self.destination_label_id = _intern(destination_label_id)
+        self.destination_label_name = _intern(destination_label_name)
+        self.enabled = enabled
+        self.mark_as_read = mark_as_read
+
+    @classmethod
+    def from_doc(cls, rule_id: str, data: dict) -> "RuleRecord":
+        """Build from a Firestore rule document without Pydantic validation."""
+        return cls(
+            rule_id,
+            data["email_pattern"],
+            _MATCH_CODES[data.get("match_type", "exact")],
+            _ACTION_CODES[data.get("action", "move")],
+            data.get("destination_label_id"),
+            data.get("destination_label_name"),
+            data.get("enabled", True),
+            data.get("mark_as_read", False)
+        )
+
+    @classmethod
+    def from_rule(cls, rule: Rule) -> "RuleRecord":
+        return cls(
+            rule.id,
+            rule.email_pattern,
+            _MATCH_CODES[rule.match_type.value],
+            _ACTION_CODES[rule.action.value],
+            rule.destination_label_id,
+            rule.destination_label_name,
+            rule.enabled,
+            rule.mark_as_read
+        )
+
+    @property
+    def match_type(self) -> MatchType:
+        return MATCH_TYPES[self.match_code]
+
+    @property
+    def action(self) -> ActionType:
+        return ACTIONS[self.action_code]
+
+    def to_dict(self) -> dict:
+        """Rule fields as JSON-ready values, as the API returns them."""
+        return {
+            "id": self.id,
+            "email_pattern": self.email_pattern,
+            "match_type": self.match_type.value,
+            "action": self.action.value,
+            "destination_label_id": self.destination_label_id,
+            "destination_label_name": self.destination_label_name,
+            "enabled": self.enabled,
+            "mark_as_read": self.mark_as_read,
+        }
+
+    def __repr__(self) -> str:
+        return (
+            f"RuleRecord(id={self.id!r}, email_pattern={self.email_pattern!r}, "
+            f"match_type={self.match_type.value}, action={self.action.value}, "
+            f"destination_label_name={self.destination_label_name!r})"
+        )
+
+
+def rule_outcome(rule: RuleRecord | None) -> tuple | None:
+    """What happens to a message a rule matches, for comparing matching results."""
+    if rule is None:
+        return None
+    return (rule.action_code, rule.destination_label_id, rule.mark_as_read)
@@ -0,0 +1,118 @@
+import time
+
+from app.gmail.client import GmailClient, extract_email_address
+from app.rules.engine import RuleEngine, deterministic_rule_id
+from app.rules.matcher import RuleMatcher
+from app.rules.models import RuleCreate
+from app.rules.records import RuleRecord
+from app.config import get_settings
+
+settings = get_settings()
+
+# user -> (fetched_at, max_messages requested, [(message_id, sender)]) for recent INBOX mail
+_inbox_cache: dict[str, tuple[float, int, list[tuple[str, str]]]] = {}
+
+
+async def get_recent_inbox_senders(
+    user_id: str,
+    gmail: GmailClient,
+    max_messages: int
+) -> list[tuple[str, str]]:
+    """
+    Get (message_id, sender) for the newest INBOX messages.
+    Cached per user for simulation_cache_ttl_seconds so repeated edits don't refetch.
+    """
+    now = time.monotonic()
+    cached = _inbox_cache.get(user_id)
+    if cached and now - cached[0] < settings.simulation_cache_ttl_seconds and cached[1] >= max_messages:
+        return cached[2][:max_messages]
+
+    messages = []
+    async for page in gmail.iter_message_ids(label_ids=["INBOX"], max_results=max_messages):
+        metadata = await gmail.get_messages_metadata(page, headers=["From"])
+        for message_id in page:
+            message = metadata.get(message_id)
+            sender = extract_email_address(message) if message else None
+            if sender:
+                messages.append((message_id, sender))
+
+    # Drop expired entries so the cache only holds recently active users
+    for key in [k for k, (fetched_at, _, _) in _inbox_cache.items()
+                if now - fetched_at >= settings.simulation_cache_ttl_seconds]:
+        del _inbox_cache[key]
+    _inbox_cache[user_id] = (now, max_messages, messages)
+    return messages
+
+
+async def simulate_rules(
+    engine: RuleEngine,
+    gmail: GmailClient,
+    proposed: list[RuleCreate],
+    max_messages: int
+) -> dict:
+    """
+    Evaluate proposed rules plus the existing enabled rules against recent INBOX mail.
+
+    Rules match in document-ID order, so each proposed rule is placed where
+    it would land when saved under its pattern's deterministic ID (as
+    imports and learned rules are), replacing an existing rule with that ID.
+    Rules created through POST /rules get a random ID instead, so their real
+    position can differ. An existing rule is reported as shadowed when it
+    would have matched a message that a proposed rule now takes.
+    """
+    # A repeated pattern's last rule wins, as on import
+    proposed_rules: dict[str, RuleRecord] = {}
+    for rule in proposed:
+        rule_id = deterministic_rule_id(rule.email_pattern.lower())
+        proposed_rules[rule_id] = RuleRecord.from_doc(rule_id, rule.model_dump(mode="json"))
+
+    cached = await engine.get_cached_rules(await engine.get_rules_version())
+    combined_rules = [rule for rule in cached.rules if rule.id not in proposed_rules]
+    combined_rules.extend(proposed_rules.values())
+    combined_rules.sort(key=lambda r: r.id)
+    combined = RuleMatcher(combined_rules)
+    existing_only = cached.matcher
+
+    messages = await get_recent_inbox_senders(engine.user_id, gmail, max_messages)
+    senders = [sender for _, sender in messages]
+    combined_matches = combined.match_many(senders)
+    existing_matches = existing_only.match_many(senders)
+
+    matches = []
+    shadowed: dict[str, dict] = {}
+    for message_id, sender in messages:
+        # match_many keys results by normalized sender
+        key = sender.strip().lower()
+        rule = combined_matches[key]
+        if rule is None:
+            continue
+
+        is_proposed = rule.id in proposed_rules
+        matches.append({
+            "message_id": message_id,
+            "sender": sender,
+            "rule_id": rule.id,
+            "proposed": is_proposed,
+            "action": rule.action,
+            "destination_label_id": rule.destination_label_id,
+            "destination_label_name": rule.destination_label_name
+        })
+
+        previous = existing_matches[key]
+        if is_proposed and previous is not None and previous.id != rule.id:
+            entry = shadowed.setdefault(previous.id, {
+                "rule_id": previous.id,
+                "email_pattern": previous.email_pattern,
+                "destination_label_name": previous.destination_label_name,
+                "shadowed_by": rule.id,
+                "messages": 0
+            })
+            entry["messages"] += 1
+
+    return {
+        "ordering": "deterministic_id",
+        "messages_evaluated": len(messages),
+        "messages_matched": len(matches),
+        "matches": matches,
+        "shadowed_rules": list(shadowed.values())
+    }
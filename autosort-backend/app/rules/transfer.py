@@ -0,0 +1,134 @@
+from typing import AsyncIterator
+
+import orjson
+from pydantic import ValidationError
+
+from app.rules.engine import BATCH_WRITE_LIMIT, RuleEngine
+from app.rules.models import ActionType, RuleImport
+
+# Fields written per rule by the export, besides the rule ID
+EXPORT_FIELDS = [
+    "email_pattern", "match_type", "action", "destination_label_id",
+    "destination_label_name", "enabled", "mark_as_read",
+]
+
+# Export lines are sent in chunks of about this many bytes
+EXPORT_CHUNK_BYTES = 64 * 1024
+
+# Longest accepted import line; a rule is well under 1KB
+MAX_LINE_BYTES = 64 * 1024
+
+# Imported rules per batch: two writes each plus the rules version bump
+IMPORT_BATCH_SIZE = (BATCH_WRITE_LIMIT - 1) // 2
+
+# Invalid lines reported individually in the summary
+MAX_REPORTED_ERRORS = 100
+
+
+async def export_rules_ndjson(engine: RuleEngine) -> AsyncIterator[bytes]:
+    """Stream a user's rules as NDJSON, one rule per line, as they are read."""
+    buffer = bytearray()
+    async for doc in engine.rules_collection.select(EXPORT_FIELDS).stream():
+        buffer += orjson.dumps({"id": doc.id, **doc.to_dict()})
+        buffer += b"\n"
+        if len(buffer) >= EXPORT_CHUNK_BYTES:
+            yield bytes(buffer)
+            buffer.clear()
+    if buffer:
+        yield bytes(buffer)
+
+
+async def _iter_lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    """Split a streamed body into lines without holding more than one partial line."""
+    pending = b""
+    async for chunk in chunks:
+        lines = (pending + chunk).split(b"\n")
+        pending = lines.pop()
+        if len(pending) > MAX_LINE_BYTES:
+            raise ValueError(f"Line longer than {MAX_LINE_BYTES} bytes")
+        for line in lines:
+            yield line
+    if pending:
+        yield pending
+
+
+def _resolve_destination(rule: RuleImport, labels_by_name: dict[str, str], label_ids: set[str]) -> dict:
+    """
+    Rule fields with the destination mapped to this account's labels. Label
+    IDs differ between accounts, so the name is tried first.
+    """
+    fields = rule.model_dump(mode="json", exclude={"email_pattern"})
+    if rule.destination_label_name in labels_by_name:
+        fields["destination_label_id"] = labels_by_name[rule.destination_label_name]
+    elif rule.destination_label_id not in label_ids and rule.action == ActionType.MOVE:
+        raise ValueError(f"Unknown destination label: {rule.destination_label_name or rule.destination_label_id}")
+    return fields
+
+
+def _skip(summary: dict, line_number: int, error: str) -> None:
+    summary["skipped"] += 1
+    if len(summary["errors"]) < MAX_REPORTED_ERRORS:
+        summary["errors"].append({"line": line_number, "error": error})
+
+
+async def import_rules_ndjson(
+    engine: RuleEngine,
+    chunks: AsyncIterator[bytes],
+    labels: list[dict]
+) -> dict:
+    """
+    Import NDJSON rules from a streamed upload, parsing line by line and
+    writing every IMPORT_BATCH_SIZE rules, so memory stays flat however
+    large the file is.
+
+    Rules are keyed by deterministic pattern ID: a pattern that already has
+    a rule is updated if it differs. Only the current batch is held, so a
+    pattern repeated in the file is applied again in order (the last line
+    wins, and an identical repeat counts as skipped). Invalid lines are
+    skipped and reported.
+    """
+    labels_by_name = {label["name"]: label["id"] for label in labels}
+    label_ids = {label["id"] for label in labels}
+    user_doc = await engine.stats_doc.get()
+    rule_ids_keyed = user_doc.exists and user_doc.to_dict().get("rule_ids_keyed", False)
+
+    summary = {"created": 0, "updated": 0, "skipped": 0, "failed": 0, "errors": []}
+    pending: dict[str, dict] = {}
+
+    async def flush() -> None:
+        counts = await engine.import_rules(pending, rule_ids_keyed)
+        summary["created"] += counts["created"]
+        summary["updated"] += counts["updated"]
+        summary["skipped"] += counts["unchanged"]
+        summary["failed"] += counts["failed"]
+        pending.clear()
+
+    line_number = 0
+    async for line in _iter_lines(chunks):
+        line_number += 1
+        if not line.strip():
+            continue
+        try:
+            rule = RuleImport.model_validate(orjson.loads(line))
+            pattern = rule.email_pattern.strip().lower()
+            if not pattern:
+                raise ValueError("Empty email_pattern")
+            fields = _resolve_destination(rule, labels_by_name, label_ids)
+        except ValidationError as e:
+            error = e.errors()[0]
+            _skip(summary, line_number, f"{'.'.join(map(str, error['loc'])) or 'rule'}: {error['msg']}")
+            continue
+        except ValueError as e:
+            _skip(summary, line_number, str(e))
+            continue
+
+        # A repeat within the batch is written after the earlier line
+        if pattern in pending:
+            await flush()
+        pending[pattern] = fields
+        if len(pending) >= IMPORT_BATCH_SIZE:
+            await flush()
+
+    if pending:
+        await flush()
+    return summary
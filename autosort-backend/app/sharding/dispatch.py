@@ -0,0 +1,112 @@
+import asyncio
+import logging
+from typing import TYPE_CHECKING
+
+from app.sharding.ring import HashRing
+from app.config import get_settings
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+if TYPE_CHECKING:
+    import httpx
+
+
+class WorkerDispatcher:
+    """
+    Ingest-side router that forwards each notification to the worker owning
+    the user on a consistent hash ring.
+
+    Workers come from the WORKER_URLS setting. A health monitor takes
+    unresponsive workers off the ring and puts them back when they recover,
+    so only users on the affected arcs move.
+    """
+
+    def __init__(self, worker_urls: list[str]):
+        self.worker_urls = worker_urls
+        self.ring = HashRing(worker_urls)
+        self._client: "httpx.AsyncClient | None" = None
+        self._monitor: asyncio.Task | None = None
+
+    async def start(self) -> None:
+        """Open the HTTP client and start health monitoring."""
+        # httpx is only needed by the ingest tier
+        import httpx
+
+        self._client = httpx.AsyncClient(timeout=settings.worker_request_timeout_seconds)
+        self._monitor = asyncio.create_task(self._run_monitor())
+
+    async def stop(self) -> None:
+        if self._monitor is not None:
+            self._monitor.cancel()
+            try:
+                await self._monitor
+            except asyncio.CancelledError:
+                pass
+            self._monitor = None
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def dispatch(self, user_email: str, history_id: str) -> str:
+        """
+        Hand a notification to the user's worker. If that worker fails it is
+        taken off the ring and the next owner is tried.
+        Returns the worker URL that accepted it.
+        """
+        import httpx
+
+        for _ in range(max(len(self.worker_urls), 1)):
+            worker = self.ring.get(user_email)
+            if worker is None:
+                break
+            try:
+                response = await self._client.post(
+                    f"{worker}/internal/process",
+                    json={"user_email": user_email, "history_id": history_id},
+                    headers={"X-Worker-Token": settings.worker_token}
+                )
+                response.raise_for_status()
+                return worker
+            except httpx.HTTPError as e:
+                logger.warning(f"Worker {worker} failed for {user_email}: {e}")
+                self._leave(worker)
+
+        raise RuntimeError("No healthy workers available")
+
+    async def check_workers(self) -> None:
+        """Health-check every configured worker and rebalance the ring."""
+        results = await asyncio.gather(
+            *(self._is_healthy(worker) for worker in self.worker_urls)
+        )
+        for worker, healthy in zip(self.worker_urls, results):
+            if healthy and worker not in self.ring.nodes:
+                self.ring.add(worker)
+                logger.info(f"Worker joined: {worker} ({len(self.ring.nodes)} active)")
+            elif not healthy:
+                self._leave(worker)
+
+    def _leave(self, worker: str) -> None:
+        if worker in self.ring.nodes:
+            self.ring.remove(worker)
+            logger.warning(f"Worker left: {worker} ({len(self.ring.nodes)} active)")
+
+    async def _is_healthy(self, worker: str) -> bool:
+        import httpx
+
+        try:
+            response = await self._client.get(f"{worker}/health")
+            return response.status_code == 200
+        except httpx.HTTPError:
+            return False
+
+    async def _run_monitor(self) -> None:
+        while True:
+            try:
+                await self.check_workers()
+            except Exception as e:
+                logger.error(f"Worker health check error: {e}")
+            await asyncio.sleep(settings.worker_health_interval_seconds)
+
+
+worker_dispatcher = WorkerDispatcher(settings.worker_url_list)
@@ -0,0 +1,48 @@
+import bisect
+import hashlib
+
+
+def _hash(value: str) -> int:
+    return int.from_bytes(hashlib.md5(value.encode()).digest()[:8], "big")
+
+
+class HashRing:
+    """
+    Consistent hash ring mapping user emails to worker nodes.
+
+    Each node owns `replicas` virtual points so users spread evenly, and adding
+    or removing a node only moves the users on that node's arcs.
+    """
+
+    def __init__(self, nodes: list[str] = None, replicas: int = 160):
+        self.replicas = replicas
+        self._points: list[int] = []
+        self._owners: dict[int, str] = {}
+        self.nodes: set[str] = set()
+        for node in nodes or []:
+            self.add(node)
+
+    def add(self, node: str) -> None:
+        """Add a node to the ring."""
+        if node in self.nodes:
+            return
+        self.nodes.add(node)
+        for replica in range(self.replicas):
+            point = _hash(f"{node}#{replica}")
+            self._owners[point] = node
+            bisect.insort(self._points, point)
+
+    def remove(self, node: str) -> None:
+        """Remove a node; its users move to the next nodes on the ring."""
+        if node not in self.nodes:
+            return
+        self.nodes.discard(node)
+        self._points = [p for p in self._points if self._owners[p] != node]
+        self._owners = {p: self._owners[p] for p in self._points}
+
+    def get(self, key: str) -> str | None:
+        """Node that owns a key (user email), or None if the ring is empty."""
+        if not self._points:
+            return None
+        index = bisect.bisect(self._points, _hash(key.lower())) % len(self._points)
+        return self._owners[self._points[index]]
@@ -0,0 +1,43 @@
+import hmac
+
+from fastapi import APIRouter, Header, HTTPException
+from pydantic import BaseModel
+
+from app.gmail.coalesce import UserCoalescer
+from app.gmail.push import process_gmail_notification
+from app.config import get_settings
+
+router = APIRouter()
+settings = get_settings()
+
+
+class WorkerNotification(BaseModel):
+    user_email: str
+    history_id: str
+
+
+async def _process(user_email: str, history_id: str) -> None:
+    # Looked up at call time so the processing step can be patched out
+    await process_gmail_notification(user_email, history_id)
+
+
+# One run per user at a time; a notification for a user already waiting is folded into it
+user_queues = UserCoalescer(_process)
+
+
+@router.post("/process", status_code=202)
+async def process_notification(
+    notification: WorkerNotification,
+    x_worker_token: str = Header(...)
+):
+    """
+    Endpoint: POST /internal/process (worker mode only)
+
+    Accepts a notification forwarded by the ingest tier and queues it behind
+    any in-flight work for the same user.
+    """
+    if not settings.worker_token or not hmac.compare_digest(x_worker_token.encode(), settings.worker_token.encode()):
+        raise HTTPException(status_code=401, detail="Invalid worker token")
+
+    queued = user_queues.submit(notification.user_email, notification.history_id)
+    return {"status": "queued" if queued else "coalesced"}
@@ -6,6 +6,14 @@ from contextlib import asynccontextmanager
 from app.api.routes import router as api_router
 from app.api.auth_routes import router as auth_router
 from app.gmail.push import router as webhook_router
+from app.gmail.ingest import ingest_queue, router as ingest_router
+from app.auth.credential_store import credential_store
+from app.gmail.rate_limit import gmail_rate_limiter
+from app.rules.cache import rule_set_cache
+from app.events import event_bus
+from app.sharding.dispatch import worker_dispatcher
+from app.sharding.worker import router as worker_router
+from app.config import get_settings
 
 # Configure logging
 logging.basicConfig(
@@ -13,14 +21,24 @@ logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
 )
 
+settings = get_settings()
+
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup
-    print("AutoSort backend starting...")
+    print(f"AutoSort backend starting ({settings.deployment_mode} mode)...")
+    if settings.deployment_mode == "ingest":
+        await worker_dispatcher.start()
+    else:
+        credential_store.start()
+        ingest_queue.start()
     yield
     # Shutdown
     print("AutoSort backend shutting down...")
+    await worker_dispatcher.stop()
+    await ingest_queue.stop()
+    await credential_store.stop()
 
 
 app = FastAPI(
@@ -37,14 +55,33 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag", "X-Sync-Token", "X-Next-Cursor"],
 )
 
-# Routes
+# Routes - the ingest route is matched first since routing is a linear scan
+app.include_router(ingest_router, prefix="/webhooks")
 app.include_router(api_router, prefix="/api/v1")
 app.include_router(auth_router, prefix="/auth")
 app.include_router(webhook_router, prefix="/webhooks")
+if settings.deployment_mode == "worker":
+    app.include_router(worker_router, prefix="/internal")
 
 
 @app.get("/health")
 async def health_check():
     return {"status": "healthy", "service": "autosort-backend"}
+
+
+@app.get("/metrics/gmail-quota")
+async def gmail_quota_metrics():
+    return gmail_rate_limiter.stats()
+
+
+@app.get("/metrics/rule-cache")
+async def rule_cache_metrics():
+    return rule_set_cache.stats()
+
+
+@app.get("/metrics/events")
+async def event_metrics():
+    return event_bus.stats()
@@ -0,0 +1,168 @@
+"""
+Microbenchmark for the webhook ack path.
+
+    python scripts/bench_ingest.py inprocess --requests 20000
+        Drive the ASGI app directly (no sockets) and report per-request
+        latency for /webhooks/gmail and /webhooks/gmail/ingest, plus the
+        request rate one core could sustain. Processing is replaced by a no-op
+        so only the ack path is measured.
+
+    python scripts/bench_ingest.py load --url http://127.0.0.1:8080 --rate 5000 --seconds 10
+        Open-loop load against a running instance (uvicorn main:app). Requests
+        are sent on schedule regardless of responses, so latency includes
+        queueing when the server falls behind.
+"""
+import argparse
+import asyncio
+import base64
+import json
+import os
+import statistics
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+
+def make_body(i: int, users: int) -> bytes:
+    data = base64.b64encode(json.dumps({
+        "emailAddress": f"user{i % users}@example.com",
+        "historyId": 1000 + i,
+    }).encode()).decode()
+    return json.dumps({
+        "message": {"data": data, "messageId": str(i), "publishTime": "2024-01-01T00:00:00Z"},
+        "subscription": "projects/autosort-dev/subscriptions/gmail-notifications",
+    }).encode()
+
+
+def report(name: str, latencies: list[float], elapsed: float) -> None:
+    latencies.sort()
+    n = len(latencies)
+    print(f"{name}: {n} requests in {elapsed:.2f}s ({n / elapsed:,.0f} req/s)")
+    print(f"  mean {statistics.fmean(latencies) * 1e6:.0f}us  "
+          f"p50 {latencies[n // 2] * 1e6:.0f}us  "
+          f"p99 {latencies[int(n * 0.99)] * 1e6:.0f}us  "
+          f"max {latencies[-1] * 1e6:.0f}us")
+
+
+async def run_inprocess(requests: int, users: int) -> None:
+    os.environ.setdefault("GOOGLE_CLOUD_PROJECT", "autosort-dev")
+    import app.gmail.ingest as ingest
+    import app.gmail.push as push
+    from main import app
+
+    async def no_op(user_email: str, history_id: str):
+        pass
+
+    # Both routes call the name bound in their own module
+    push.process_gmail_notification = no_op
+    ingest.process_gmail_notification = no_op
+    ingest.ingest_queue.start()
+    bodies = [make_body(i, users) for i in range(requests)]
+
+    async def call(path: str, body: bytes) -> int:
+        scope = {
+            "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1",
+            "method": "POST", "scheme": "http", "path": path, "raw_path": path.encode(),
+            "root_path": "", "query_string": b"", "server": ("127.0.0.1", 8080),
+            "client": ("127.0.0.1", 50000),
+            "headers": [(b"content-type", b"application/json"),
+                        (b"content-length", str(len(body)).encode())],
+        }
+        status = 0
+
+        async def receive():
+            return {"type": "http.request", "body": body, "more_body": False}
+
+        async def send(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+
+        await app(scope, receive, send)
+        return status
+
+    for path in ("/webhooks/gmail", "/webhooks/gmail/ingest"):
+        for body in bodies[:500]:  # warm up
+            await call(path, body)
+
+        latencies = []
+        started = time.perf_counter()
+        for body in bodies:
+            t = time.perf_counter()
+            status = await call(path, body)
+            latencies.append(time.perf_counter() - t)
+            if status != 200:
+                sys.exit(f"{path} returned {status}")
+        report(path, latencies, time.perf_counter() - started)
+
+    await ingest.ingest_queue.stop()
+
+
+async def run_load(url: str, rate: int, seconds: float, users: int, connections: int) -> None:
+    import httpx
+
+    total = int(rate * seconds)
+    bodies = [make_body(i, users) for i in range(total)]
+    latencies: list[float] = []
+    failures = 0
+
+    limits = httpx.Limits(max_connections=connections, max_keepalive_connections=connections)
+    async with httpx.AsyncClient(base_url=url, limits=limits, timeout=10) as client:
+        async def post(body: bytes, scheduled: float):
+            nonlocal failures
+            try:
+                response = await client.post(
+                    "/webhooks/gmail/ingest", content=body,
+                    headers={"content-type": "application/json"}
+                )
+                if response.status_code != 200:
+                    failures += 1
+                    return
+            except httpx.HTTPError:
+                failures += 1
+                return
+            # Measure from the scheduled send time to avoid coordinated omission
+            latencies.append(time.perf_counter() - scheduled)
+
+        tasks = []
+        started = time.perf_counter()
+        for i, body in enumerate(bodies):
+            scheduled = started + i / rate
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            tasks.append(asyncio.create_task(post(body, scheduled)))
+        await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - started
+
+    print(f"Target {rate} req/s for {seconds}s, {failures} failed")
+    if latencies:
+        report("/webhooks/gmail/ingest", latencies, elapsed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    inprocess = sub.add_parser("inprocess")
+    inprocess.add_argument("--requests", type=int, default=20000)
+    inprocess.add_argument("--users", type=int, default=100)
+
+    load = sub.add_parser("load")
+    load.add_argument("--url", default="http://127.0.0.1:8080")
+    load.add_argument("--rate", type=int, default=5000)
+    load.add_argument("--seconds", type=float, default=10)
+    load.add_argument("--users", type=int, default=100)
+    load.add_argument("--connections", type=int, default=200)
+
+    args = parser.parse_args()
+    if args.command == "inprocess":
+        asyncio.run(run_inprocess(args.requests, args.users))
+    else:
+        asyncio.run(run_load(args.url, args.rate, args.seconds, args.users, args.connections))
+
+
+if __name__ == "__main__":
+    main()
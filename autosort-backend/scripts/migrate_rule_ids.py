@@ -0,0 +1,83 @@
+"""
+Re-key exact-match rules stored under UUIDs to their deterministic pattern
+IDs, so auto-learn finds each sender's rule with a point read instead of an
+email_pattern query. Several exact rules for one pattern are merged into
+one; the rule that currently wins matching keeps its settings. Patterns
+whose new ID would change which rule wins are held back and listed; fix or
+reorder those rules by hand, then re-run.
+
+    python scripts/migrate_rule_ids.py --dry-run
+    python scripts/migrate_rule_ids.py
+
+Users already marked rule_ids_keyed are skipped, so the job can be re-run
+until every user is keyed (a user whose rules changed mid-migration is left
+unkeyed and picked up by the next run).
+"""
+import argparse
+import asyncio
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from app.db import get_db  # noqa: E402
+from app.rules.engine import RuleEngine, deterministic_rule_id  # noqa: E402
+from app.rules.models import MatchType  # noqa: E402
+
+
+async def count_unkeyed(engine: RuleEngine) -> int:
+    query = engine.rules_collection.where("match_type", "==", MatchType.EXACT.value).select(["email_pattern"])
+    return sum(
+        1 async for doc in query.stream()
+        if doc.id != deterministic_rule_id(doc.get("email_pattern"))
+    )
+
+
+async def migrate(dry_run: bool, concurrency: int) -> None:
+    semaphore = asyncio.Semaphore(concurrency)
+    totals = {"users": 0, "skipped": 0, "moved": 0, "merged": 0, "failed": 0, "held": 0, "unkeyed": 0}
+
+    async def migrate_user(user_id: str) -> None:
+        engine = RuleEngine(user_id)
+        async with semaphore:
+            if dry_run:
+                totals["moved"] += await count_unkeyed(engine)
+                return
+            result = await engine.rekey_exact_rules()
+        totals["moved"] += result["moved"]
+        totals["merged"] += result["merged"]
+        totals["failed"] += len(result["failed"])
+        totals["held"] += len(result["held"])
+        for entry in result["held"]:
+            print(f"{user_id}: held back {entry['email_pattern']} - re-keying would change which rule matches it")
+        if not result["rule_ids_keyed"]:
+            totals["unkeyed"] += 1
+            print(f"{user_id}: not keyed yet (failed={len(result['failed'])}, held={len(result['held'])}), re-run to finish")
+
+    tasks = []
+    async for doc in get_db().collection("users").select(["rule_ids_keyed"]).stream():
+        totals["users"] += 1
+        if (doc.to_dict() or {}).get("rule_ids_keyed"):
+            totals["skipped"] += 1
+            continue
+        tasks.append(migrate_user(doc.id))
+    await asyncio.gather(*tasks)
+
+    verb = "would move" if dry_run else "moved"
+    print(
+        f"{totals['users']} users ({totals['skipped']} already keyed): {verb} {totals['moved']} rules, "
+        f"{totals['merged']} duplicates merged, {totals['failed']} failed, {totals['held']} held back, "
+        f"{totals['unkeyed']} users still unkeyed"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dry-run", action="store_true", help="Count rules that would move without writing")
+    parser.add_argument("--concurrency", type=int, default=10)
+    args = parser.parse_args()
+    asyncio.run(migrate(args.dry_run, args.concurrency))
+
+
+if __name__ == "__main__":
+    main()
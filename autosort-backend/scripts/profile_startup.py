@@ -0,0 +1,146 @@
+"""
+Cold-start profiling.
+
+    python scripts/profile_startup.py imports --runs 5
+        Time `import main` in fresh interpreters with -X importtime, list the
+        slowest packages and fail if the median exceeds the budget.
+
+    python scripts/profile_startup.py first-ack --runs 5
+        Start uvicorn from scratch and time how long until the first
+        POST /webhooks/gmail/ingest is acked.
+
+Import cost is what every scale-from-zero instance pays before serving, so
+keep new heavy imports (grpc, googleapiclient, httpx, ...) out of module
+level and behind the function that needs them.
+"""
+import argparse
+import base64
+import http.client
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+from collections import defaultdict
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+
+# Measured median `import main` is ~0.9s on 1 vCPU (down from ~1.0s with eager
+# Firestore/googleapiclient/httpx imports), of which FastAPI itself is
+# 0.35-0.5s. Raise deliberately, not by accident.
+IMPORT_BUDGET_MS = 1100
+
+
+def _env() -> dict:
+    env = {**os.environ}
+    env.setdefault("GOOGLE_CLOUD_PROJECT", "autosort-dev")
+    return env
+
+
+def profile_imports() -> tuple[float, dict[str, float]]:
+    """Import main once in a fresh interpreter. Returns (total_ms, self_ms by top-level package)."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import main"],
+        cwd=BACKEND_DIR, env=_env(), capture_output=True, text=True, check=True
+    )
+    by_package: dict[str, float] = defaultdict(float)
+    total_us = 0
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        module = name.strip()
+        by_package[module.split(".")[0]] += int(self_us) / 1000
+        if module == "main":
+            total_us = int(cumulative_us)
+    return total_us / 1000, dict(by_package)
+
+
+def run_imports(runs: int, top: int, budget_ms: float) -> None:
+    totals = []
+    packages: dict[str, list[float]] = defaultdict(list)
+    for _ in range(runs):
+        total, by_package = profile_imports()
+        totals.append(total)
+        for package, ms in by_package.items():
+            packages[package].append(ms)
+
+    median = statistics.median(totals)
+    print(f"import main: median {median:.0f}ms over {runs} runs "
+          f"(min {min(totals):.0f}ms, max {max(totals):.0f}ms), budget {budget_ms:.0f}ms")
+    print("Slowest packages (median self time):")
+    ranked = sorted(packages.items(), key=lambda item: statistics.median(item[1]), reverse=True)
+    for package, samples in ranked[:top]:
+        print(f"  {statistics.median(samples):8.1f}ms  {package}")
+
+    if median > budget_ms:
+        sys.exit(f"Over budget by {median - budget_ms:.0f}ms")
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def time_first_ack(timeout: float = 30) -> float:
+    """Seconds from spawning uvicorn to the first acked webhook."""
+    port = _free_port()
+    data = base64.b64encode(json.dumps({"emailAddress": "coldstart@example.com", "historyId": 1}).encode())
+    body = json.dumps({"message": {"data": data.decode(), "messageId": "1"}}).encode()
+
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1",
+         "--port", str(port), "--log-level", "warning"],
+        cwd=BACKEND_DIR, env=_env(), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        while time.perf_counter() - started < timeout:
+            try:
+                connection = http.client.HTTPConnection("127.0.0.1", port, timeout=5)
+                connection.request("POST", "/webhooks/gmail/ingest", body,
+                                   {"Content-Type": "application/json"})
+                status = connection.getresponse().status
+                connection.close()
+                if status != 200:
+                    sys.exit(f"Webhook returned {status}")
+                return time.perf_counter() - started
+            except (ConnectionRefusedError, http.client.RemoteDisconnected):
+                time.sleep(0.01)
+        sys.exit("Server did not ack within timeout")
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def run_first_ack(runs: int) -> None:
+    samples = [time_first_ack() for _ in range(runs)]
+    print(f"Time to first webhook ack: median {statistics.median(samples) * 1000:.0f}ms "
+          f"over {runs} runs (min {min(samples) * 1000:.0f}ms, max {max(samples) * 1000:.0f}ms)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    imports = sub.add_parser("imports")
+    imports.add_argument("--runs", type=int, default=5)
+    imports.add_argument("--top", type=int, default=15)
+    imports.add_argument("--budget-ms", type=float, default=IMPORT_BUDGET_MS)
+
+    first_ack = sub.add_parser("first-ack")
+    first_ack.add_argument("--runs", type=int, default=5)
+
+    args = parser.parse_args()
+    if args.command == "imports":
+        run_imports(args.runs, args.top, args.budget_ms)
+    else:
+        run_first_ack(args.runs)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""
+Set up the Pub/Sub emulator for the pull consumer and publish synthetic
+Gmail notifications to it.
+
+    gcloud beta emulators pubsub start --project=autosort-dev
+    export PUBSUB_EMULATOR_HOST=localhost:8085 GOOGLE_CLOUD_PROJECT=autosort-dev
+
+    python scripts/pubsub_emulator.py setup
+    python scripts/pubsub_emulator.py publish --users 20 --notifications 1000
+    python -m app.gmail.pull
+"""
+import argparse
+import json
+import os
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from google.api_core.exceptions import AlreadyExists  # noqa: E402
+from google.cloud import pubsub_v1  # noqa: E402
+
+from app.config import get_settings  # noqa: E402
+
+settings = get_settings()
+
+
+def run_setup() -> None:
+    publisher = pubsub_v1.PublisherClient()
+    subscriber = pubsub_v1.SubscriberClient()
+    try:
+        publisher.create_topic(name=settings.pubsub_topic)
+        print(f"Created {settings.pubsub_topic}")
+    except AlreadyExists:
+        pass
+    try:
+        subscriber.create_subscription(
+            name=settings.pubsub_subscription,
+            topic=settings.pubsub_topic,
+            ack_deadline_seconds=settings.pull_ack_deadline_seconds,
+        )
+        print(f"Created {settings.pubsub_subscription}")
+    except AlreadyExists:
+        pass
+
+
+def run_publish(users: int, notifications: int) -> None:
+    publisher = pubsub_v1.PublisherClient()
+    futures = [
+        publisher.publish(
+            settings.pubsub_topic,
+            json.dumps({"emailAddress": f"user{i % users}@example.com", "historyId": 1000 + i}).encode(),
+        )
+        for i in range(notifications)
+    ]
+    for future in futures:
+        future.result()
+    print(f"Published {notifications} notifications for {users} users")
+
+
+def main():
+    if not os.getenv("PUBSUB_EMULATOR_HOST"):
+        sys.exit("PUBSUB_EMULATOR_HOST is not set; refusing to touch a real project")
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("setup")
+    publish = sub.add_parser("publish")
+    publish.add_argument("--users", type=int, default=20)
+    publish.add_argument("--notifications", type=int, default=1000)
+
+    args = parser.parse_args()
+    if args.command == "setup":
+        run_setup()
+    else:
+        run_publish(args.users, args.notifications)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""
+Run the backend locally in sharded mode: one ingest process plus N workers.
+
+    python scripts/run_sharded.py --workers 3
+
+The ingest tier listens on --port and forwards /webhooks/gmail notifications
+to workers on --port+1 .. --port+N by consistent hashing on user email.
+Ctrl-C stops every process.
+"""
+import argparse
+import os
+import secrets
+import subprocess
+import sys
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+
+
+def spawn(port: int, env: dict) -> subprocess.Popen:
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port)],
+        cwd=BACKEND_DIR,
+        env=env,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=3)
+    parser.add_argument("--port", type=int, default=8080)
+    args = parser.parse_args()
+
+    token = os.environ.get("WORKER_TOKEN") or secrets.token_hex(16)
+    worker_ports = [args.port + i + 1 for i in range(args.workers)]
+    worker_urls = ",".join(f"http://127.0.0.1:{port}" for port in worker_ports)
+
+    processes = []
+    try:
+        for port in worker_ports:
+            env = {**os.environ, "DEPLOYMENT_MODE": "worker", "WORKER_TOKEN": token}
+            processes.append(spawn(port, env))
+
+        env = {**os.environ, "DEPLOYMENT_MODE": "ingest", "WORKER_TOKEN": token, "WORKER_URLS": worker_urls}
+        processes.append(spawn(args.port, env))
+
+        print(f"Ingest on :{args.port}, workers on {', '.join(f':{p}' for p in worker_ports)}")
+        for process in processes:
+            process.wait()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""
+Test harness for sharded worker mode.
+
+    python scripts/shard_harness.py ring --users 100000 --workers 8
+        Check how evenly users spread over workers and how many move when a
+        worker joins or leaves (ideally ~1/N).
+
+    python scripts/shard_harness.py load --url http://127.0.0.1:8080 --users 50 --notifications 500
+        Post synthetic Pub/Sub pushes to a running ingest tier (see
+        run_sharded.py) and check every user always lands on the same worker.
+"""
+import argparse
+import asyncio
+import base64
+import json
+import statistics
+import sys
+from collections import Counter, defaultdict
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from app.sharding.ring import HashRing  # noqa: E402
+
+
+def run_ring(users: int, workers: int) -> None:
+    emails = [f"user{i}@example.com" for i in range(users)]
+    nodes = [f"http://worker-{i}" for i in range(workers)]
+    ring = HashRing(nodes)
+
+    before = {email: ring.get(email) for email in emails}
+    counts = Counter(before.values())
+    mean = users / workers
+    print(f"{users} users over {workers} workers: "
+          f"min {min(counts.values())}, max {max(counts.values())}, "
+          f"stddev {statistics.pstdev(counts.values()) / mean:.1%} of mean")
+
+    ring.add("http://worker-new")
+    moved = sum(1 for email in emails if ring.get(email) != before[email])
+    print(f"Worker joins: {moved / users:.1%} of users moved (ideal {1 / (workers + 1):.1%})")
+
+    ring.remove("http://worker-new")
+    ring.remove(nodes[0])
+    moved = sum(1 for email in emails if ring.get(email) != before[email])
+    print(f"Worker leaves: {moved / users:.1%} of users moved (ideal {1 / workers:.1%})")
+
+
+async def run_load(url: str, users: int, notifications: int) -> None:
+    import httpx
+
+    assignments = defaultdict(set)
+    failures = 0
+
+    async with httpx.AsyncClient(timeout=10) as client:
+        async def push(i: int):
+            nonlocal failures
+            email = f"user{i % users}@example.com"
+            data = base64.b64encode(json.dumps({"emailAddress": email, "historyId": str(1000 + i)}).encode()).decode()
+            envelope = {"message": {"data": data, "messageId": str(i)}, "subscription": "harness"}
+            response = await client.post(f"{url}/webhooks/gmail", json=envelope)
+            if response.status_code != 200:
+                failures += 1
+                return
+            assignments[email].add(response.json().get("worker"))
+
+        await asyncio.gather(*(push(i) for i in range(notifications)))
+
+    split = [email for email, workers in assignments.items() if len(workers) > 1]
+    per_worker = Counter(next(iter(workers)) for workers in assignments.values())
+    print(f"{notifications - failures}/{notifications} accepted, {failures} failed")
+    print(f"Users per worker: {dict(per_worker)}")
+    print(f"Users split across workers: {len(split)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    ring = sub.add_parser("ring")
+    ring.add_argument("--users", type=int, default=100000)
+    ring.add_argument("--workers", type=int, default=8)
+
+    load = sub.add_parser("load")
+    load.add_argument("--url", default="http://127.0.0.1:8080")
+    load.add_argument("--users", type=int, default=50)
+    load.add_argument("--notifications", type=int, default=500)
+
+    args = parser.parse_args()
+    if args.command == "ring":
+        run_ring(args.users, args.workers)
+    else:
+        asyncio.run(run_load(args.url, args.users, args.notifications))
+
+
+if __name__ == "__main__":
+    main()